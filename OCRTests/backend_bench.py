@@ -0,0 +1,39 @@
+"""
+OCR backend throughput: runs every scanned page of a PDF through each
+backend the way InvoicePipeline does (page windows, OCR threads) and prints
+pages/sec per backend.
+
+    python OCRTests/backend_bench.py path/to/scanned.pdf [pytesseract,tesserocr,paddleocr]
+"""
+
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BASE_DIR))
+
+from src.core import InvoicePipeline
+
+# ================= CONFIG =================
+PDF_PATH = sys.argv[1] if len(sys.argv) > 1 else os.path.join(BASE_DIR, "invoice.pdf")
+BACKENDS = sys.argv[2].split(",") if len(sys.argv) > 2 else ["pytesseract", "tesserocr", "paddleocr"]
+
+# ================= RUN =================
+print(f"{'backend':>12} {'pages':>6} {'wall s':>8} {'ocr s':>8} {'pages/s':>8}")
+for name in BACKENDS:
+    try:
+        pipeline = InvoicePipeline(cache=False, ocr_engine=name)
+        start = time.perf_counter()
+        pipeline._extract_text(PDF_PATH)
+        wall = time.perf_counter() - start
+    except ImportError as e:
+        print(f"{name:>12} skipped ({e})")
+        continue
+
+    stats = pipeline.engine.stats()
+    print(
+        f"{name:>12} {stats['pages']:>6} {wall:>8.2f} "
+        f"{stats['seconds']:>8.2f} {stats['pages_per_sec']:>8.2f}"
+    )
+    pipeline.engine.close()
@@ -0,0 +1,89 @@
+"""
+Preprocessing benchmark: legacy (300 DPI RGB + Gaussian threshold over the
+full page) vs fast (grayscale probe, auto-crop, auto-DPI, mean threshold on
+the cropped region). Prints render / preprocess / OCR time per page.
+
+    python OCRTests/preprocess_bench.py path/to/scanned.pdf [pytesseract|tesserocr]
+"""
+
+import os
+import sys
+import time
+import numpy as np
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BASE_DIR))
+
+from src.core import POPPLER_PATH, OCR_DPI
+from src.ocr import create_engine
+from src.preprocess import (
+    PROBE_DPI, plan_page, crop_to_plan, binarize_fast, binarize_legacy
+)
+
+# ================= CONFIG =================
+PDF_PATH = sys.argv[1] if len(sys.argv) > 1 else os.path.join(BASE_DIR, "invoice.pdf")
+ENGINE = sys.argv[2] if len(sys.argv) > 2 else "pytesseract"
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, (time.perf_counter() - start) * 1000
+
+
+def legacy(engine, n):
+    img, t_render = timed(
+        convert_from_path, PDF_PATH, dpi=OCR_DPI,
+        first_page=n, last_page=n, poppler_path=POPPLER_PATH
+    )
+    binary, t_prep = timed(binarize_legacy, img[0])
+    text, t_ocr = timed(engine.recognize, binary, dpi=OCR_DPI)
+    return t_render, t_prep, t_ocr, binary.shape, OCR_DPI, text
+
+
+def fast(engine, n):
+    start = time.perf_counter()
+    probe = convert_from_path(
+        PDF_PATH, dpi=PROBE_DPI, grayscale=True,
+        first_page=n, last_page=n, poppler_path=POPPLER_PATH
+    )[0]
+    plan = plan_page(np.asarray(probe), PROBE_DPI)
+    if plan is None:
+        return (time.perf_counter() - start) * 1000, 0.0, 0.0, (0, 0), 0, ""
+    img = convert_from_path(
+        PDF_PATH, dpi=plan.dpi, grayscale=True,
+        first_page=n, last_page=n, poppler_path=POPPLER_PATH
+    )[0]
+    t_render = (time.perf_counter() - start) * 1000
+
+    binary, t_prep = timed(lambda: binarize_fast(crop_to_plan(np.asarray(img), plan), plan.dpi))
+    text, t_ocr = timed(engine.recognize, binary, dpi=plan.dpi)
+    return t_render, t_prep, t_ocr, binary.shape, plan.dpi, text
+
+
+# ================= RUN =================
+pages = pdfinfo_from_path(PDF_PATH, poppler_path=POPPLER_PATH)["Pages"]
+engine = create_engine(ENGINE)
+print(f"{PDF_PATH}: {pages} page(s), engine={ENGINE}\n")
+print(f"{'page':>4} {'mode':>6} {'dpi':>4} {'pixels':>11} {'render ms':>10} {'prep ms':>8} {'ocr ms':>8} {'chars':>6}")
+
+totals = {"legacy": [0.0, 0.0, 0.0], "fast": [0.0, 0.0, 0.0]}
+for n in range(1, pages + 1):
+    for mode, fn in (("legacy", legacy), ("fast", fast)):
+        t_render, t_prep, t_ocr, shape, dpi, text = fn(engine, n)
+        for i, t in enumerate((t_render, t_prep, t_ocr)):
+            totals[mode][i] += t
+        print(
+            f"{n:>4} {mode:>6} {dpi:>4} {shape[1]:>5}x{shape[0]:<5} "
+            f"{t_render:>10.1f} {t_prep:>8.1f} {t_ocr:>8.1f} {len(text.strip()):>6}"
+        )
+
+print()
+for mode, (t_render, t_prep, t_ocr) in totals.items():
+    print(
+        f"{mode:>6}: render {t_render / pages:.1f} ms/page, "
+        f"preprocess {t_prep / pages:.1f} ms/page, OCR {t_ocr / pages:.1f} ms/page"
+    )
+print(f"\n{engine.stats()}")
+engine.close()
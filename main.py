@@ -1,10 +1,17 @@
 import sys
 import os
-from PySide6.QtWidgets import QApplication
-from src.ui import MainWindow
+import multiprocessing
 from src.utils import setup_logger
 
 def main():
+    # Any arguments: headless CLI (src/cli.py), Qt is never imported
+    if len(sys.argv) > 1:
+        from src.cli import main as cli_main
+        sys.exit(cli_main(sys.argv[1:]))
+
+    from PySide6.QtWidgets import QApplication
+    from src.ui import MainWindow
+
     setup_logger()
     
     app = QApplication(sys.argv)
@@ -16,4 +23,6 @@ def main():
     sys.exit(app.exec())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Required for the batch process pool in frozen (Nuitka) builds
+    multiprocessing.freeze_support()
+    main()
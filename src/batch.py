@@ -0,0 +1,179 @@
+import os
+import signal
+import logging
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from .core import InvoicePipeline
+from .security import adopt_session, unlock_session
+from .utils import load_settings
+
+# Worker processes never configure handlers; the parent logs on their behalf
+logger = logging.getLogger("WilowApp")
+
+# timings: seconds per pipeline stage (InvoicePipeline.timings)
+BatchResult = namedtuple(
+    "BatchResult", ["index", "path", "data", "status", "error", "timings"], defaults=(None,)
+)
+
+# ---------------- WORKER PROCESS ----------------
+
+_pipeline = None
+
+
+def _init_worker(session=None):
+    global _pipeline
+    # Ctrl+C is the parent's to handle; it shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    adopt_session(session)
+    _pipeline = InvoicePipeline()
+
+
+def _run(pipeline, index, path):
+    try:
+        data = pipeline.process_invoice(path)
+        return BatchResult(index, path, data, "Processed", None, pipeline.timings)
+    except Exception as e:
+        return BatchResult(
+            index, path,
+            {"Filename": os.path.basename(path), "Vendor Name": "N/A"},
+            "Error", str(e), pipeline.timings
+        )
+
+
+def _process(index, path):
+    return _run(_pipeline, index, path)
+
+
+def _new_pool(workers):
+    # Derive the storage key once here instead of in every worker, and hand
+    # it over through initargs: never through the environment, which every
+    # subprocess the workers start would inherit
+    session = unlock_session(export=False)
+    return ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(session,))
+
+# ---------------- ENGINE ----------------
+
+class BatchEngine:
+    """
+    Runs InvoicePipeline over a list of files on a process pool.
+    Each process owns its own pipeline; results are yielded as soon as
+    they finish (not in input order) and carry their original index.
+
+    Each run() starts and stops its own pool. Long-lived callers (the hot
+    folder daemon) can keep one open instead, so workers and their
+    pipelines are only set up once:
+
+        with BatchEngine() as engine:
+            for files in batches:
+                results = list(engine.run(files))
+    """
+
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = load_settings().get("processing", {}).get("workers", 0)
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = None
+        self._pool_broken = False
+        self._pipeline = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        """Keeps a pool (or, with one worker, a pipeline) open until close()."""
+        if self.workers <= 1:
+            self._pipeline = self._pipeline or InvoicePipeline()
+        elif self._pool is None:
+            self._open_pool()
+
+    def _open_pool(self):
+        self._pool = _new_pool(self.workers)
+
+    def submit(self, path, index=0):
+        """
+        Queues one file on the pool (opened on first use, also for a single
+        worker) and returns a concurrent.futures.Future of its BatchResult.
+        """
+        if self._pool is None:
+            self._open_pool()
+        try:
+            return self._pool.submit(_process, index, path)
+        except BrokenProcessPool:
+            self.close()
+            self._open_pool()
+            return self._pool.submit(_process, index, path)
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+        if self._pipeline:
+            self._pipeline.close()
+        self._pool = self._pipeline = None
+
+    def run(self, files):
+        files = list(files)
+        if self._pool:
+            yield from self._run_pool(self._pool, files)
+            if self._pool_broken:
+                # A dead worker breaks the whole pool; the next run gets a new one
+                self.close()
+                self.start()
+            return
+        workers = min(self.workers, len(files))
+        if workers <= 1:
+            yield from self._run_inline(files)
+            return
+
+        pool = _new_pool(workers)
+        try:
+            yield from self._run_pool(pool, files)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _run_pool(self, pool, files):
+        futures = {
+            pool.submit(_process, i, path): (i, path)
+            for i, path in enumerate(files)
+        }
+        self._pool_broken = False
+        try:
+            for fut in as_completed(futures):
+                yield self.result(fut, *futures[fut])
+        finally:
+            for fut in futures:
+                fut.cancel()
+
+    def result(self, future, index, path):
+        """BatchResult of a finished submit() future, also when its worker died."""
+        try:
+            result = future.result()
+        except Exception as e:
+            # Worker died (OOM, crashed native lib) - report the file, keep going
+            if isinstance(e, BrokenProcessPool):
+                self._pool_broken = True
+            result = BatchResult(
+                index, path,
+                {"Filename": os.path.basename(path), "Vendor Name": "N/A"},
+                "Error", str(e)
+            )
+        return self._log(result)
+
+    def _run_inline(self, files):
+        pipeline = self._pipeline or InvoicePipeline()
+        try:
+            for i, path in enumerate(files):
+                yield self._log(_run(pipeline, i, path))
+        finally:
+            if pipeline is not self._pipeline:
+                pipeline.close()
+
+    def _log(self, result):
+        if result.error:
+            logger.error(f"Failed {result.path}: {result.error}")
+        return result
@@ -0,0 +1,127 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from .security import SecurityManager
+
+
+class ExtractionCache:
+    """
+    Persistent, size-bounded LRU cache of extraction results.
+
+    Entries are keyed by the PDF's SHA-256 plus the OCR config fingerprint,
+    so changing DPI/engine settings never serves stale text. Field dicts are
+    stored with the pipeline version that produced them; a version bump
+    re-runs field extraction over the cached text instead of the OCR.
+    """
+
+    def __init__(self, db_name="cache.db", max_mb=256):
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        project_root = os.path.dirname(base_dir)
+        data_dir = os.path.join(project_root, "data")
+        os.makedirs(data_dir, exist_ok=True)
+        self.db_path = os.path.join(data_dir, db_name)
+        self.max_bytes = int(max_mb * 1024 * 1024)
+
+        self.sec = SecurityManager()
+        self._lock = threading.Lock()
+        # Shared by every worker process on the box, hence WAL + busy timeout
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._init_db()
+
+    def _init_db(self):
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS extraction_cache (
+                cache_key TEXT PRIMARY KEY,
+                raw_text_enc BLOB,
+                method TEXT,
+                fields_enc BLOB,
+                fields_version TEXT,
+                size_bytes INTEGER,
+                last_access REAL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_cache_access ON extraction_cache(last_access)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(file_hash, fingerprint):
+        return hashlib.sha256(f"{file_hash}:{fingerprint}".encode()).hexdigest()
+
+    def get(self, key):
+        """Returns {raw_text, method, fields, fields_version} or None."""
+        with self._lock:
+            row = self._conn.execute("""
+                SELECT raw_text_enc, method, fields_enc, fields_version
+                FROM extraction_cache WHERE cache_key = ?
+            """, (key,)).fetchone()
+            if not row:
+                return None
+            self._conn.execute(
+                "UPDATE extraction_cache SET last_access = ? WHERE cache_key = ?",
+                (time.time(), key)
+            )
+            self._conn.commit()
+
+        raw_text_enc, method, fields_enc, fields_version = row
+        try:
+            return {
+                "raw_text": self._decrypt(raw_text_enc),
+                "method": method,
+                "fields": json.loads(self._decrypt(fields_enc)),
+                "fields_version": fields_version,
+            }
+        except ValueError:
+            # Unreadable entry (key rotated, truncated write) - treat as a miss
+            return None
+
+    def put(self, key, raw_text, method, fields, fields_version):
+        raw_text_enc = self.sec.encrypt_data(raw_text)
+        fields_enc = self.sec.encrypt_data(json.dumps(fields))
+        size = len(raw_text_enc) + len(fields_enc)
+
+        with self._lock:
+            self._conn.execute("""
+                INSERT OR REPLACE INTO extraction_cache (
+                    cache_key, raw_text_enc, method,
+                    fields_enc, fields_version,
+                    size_bytes, last_access
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (key, raw_text_enc, method, fields_enc, fields_version, size, time.time()))
+            self._evict()
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM extraction_cache")
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(size_bytes), 0) FROM extraction_cache"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+
+        victims = []
+        for cache_key, size in self._conn.execute(
+            "SELECT cache_key, size_bytes FROM extraction_cache ORDER BY last_access"
+        ):
+            victims.append((cache_key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+        self._conn.executemany("DELETE FROM extraction_cache WHERE cache_key = ?", victims)
+
+    def _decrypt(self, token):
+        if not token:
+            return ""
+        text = self.sec.decrypt_data(token)
+        if text == "[DECRYPTION_FAILED]":
+            raise ValueError("cache entry could not be decrypted")
+        return text
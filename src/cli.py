@@ -0,0 +1,366 @@
+"""
+Headless entry point, no Qt involved:
+
+    python main.py extract <dir|file|glob>... [--workers N] [--csv out.csv] ...
+    python main.py watch <dir> [--workers N]
+    python main.py serve [--port 8765] [--workers N]
+    python main.py queue enqueue|work|commit|status <shared dir> ...
+    python -m src.cli extract ...
+
+Exit codes: see EXIT_* below.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import logging
+import sqlite3
+import signal
+import threading
+import argparse
+import multiprocessing
+
+from . import export, service
+from .batch import BatchEngine
+from .sharedqueue import SharedQueue
+from .storage import StorageEngine, SAVED, DUPLICATE, NEAR_DUPLICATE
+from .utils import load_settings
+from .watcher import HotFolder, SETTLE_SECONDS, BATCH_WINDOW
+
+logger = logging.getLogger("WilowApp")
+
+# ---------------- CONFIG ----------------
+EXIT_OK = 0
+EXIT_FILE_ERRORS = 1      # ran to the end, but some files failed
+EXIT_USAGE = 2            # bad arguments (argparse)
+EXIT_NO_INPUT = 3         # no PDF matched the inputs
+EXIT_OUTPUT_ERROR = 4     # storing or exporting the results failed
+EXIT_INTERNAL_ERROR = 5   # unexpected error (a bug, a failed migration, ...)
+EXIT_INTERRUPTED = 130    # Ctrl+C
+
+# Results stored per save_invoices() transaction
+SAVE_BATCH = 200
+PROGRESS_EVERY = 100
+
+STAGES = ["hash", "cache", "text", "render", "ocr", "fields"]
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="wilow", description="Wilow Invoice Extractor (headless)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    extract = commands.add_parser(
+        "extract", help="extract invoices from PDFs",
+        description="Extracts every PDF on a worker pool, stores the results and "
+                    "optionally exports the invoices stored by this run."
+    )
+    extract.add_argument("inputs", nargs="+", help="PDF files, directories or glob patterns")
+    extract.add_argument("-r", "--recursive", action="store_true",
+                         help="also scan subdirectories of directory inputs")
+    extract.add_argument("-w", "--workers", type=int, default=None,
+                         help="worker processes (default: processing.workers)")
+    extract.add_argument("--db", default=None,
+                         help="database name under data/ (default: storage.db_name)")
+    extract.add_argument("--no-db", action="store_true",
+                         help="don't store results (no exports either)")
+    extract.add_argument("--csv", help="export this run's invoices to .csv / .csv.gz")
+    extract.add_argument("--excel", help="export this run's invoices to .xlsx")
+    extract.add_argument("--parquet", help="export this run's invoices to .parquet")
+    extract.add_argument("--raw-text", choices=["full", "truncate", "exclude"], default="exclude",
+                         help="Raw OCR Text column of the Excel export (default: exclude)")
+    extract.add_argument("--json", action="store_true",
+                         help="print the summary as JSON on stdout")
+    extract.add_argument("-q", "--quiet", action="store_true", help="no progress lines")
+    extract.set_defaults(run=cmd_extract)
+
+    watch = commands.add_parser(
+        "watch", help="ingest PDFs dropped into a folder",
+        description="Hot folder daemon: stores every PDF written into the directory "
+                    "within seconds. Stops on Ctrl+C / SIGTERM."
+    )
+    watch.add_argument("directory")
+    watch.add_argument("-w", "--workers", type=int, default=None,
+                       help="worker processes (default: processing.workers)")
+    watch.add_argument("--db", default=None,
+                       help="database name under data/ (default: storage.db_name)")
+    watch.add_argument("--mode", choices=["auto", "inotify", "polling"], default="auto",
+                       help="change detection (default: inotify, else polling)")
+    watch.add_argument("--settle", type=float, default=SETTLE_SECONDS,
+                       help="seconds a file must stay unchanged before it is read")
+    watch.add_argument("--window", type=float, default=BATCH_WINDOW,
+                       help="seconds to gather arrivals into one batch")
+    watch.set_defaults(run=cmd_watch)
+
+    serve = commands.add_parser(
+        "serve", help="run the local HTTP extraction service",
+        description="HTTP service on localhost: POST a PDF to /extract (see src/service.py)."
+    )
+    serve.add_argument("--host", default=service.HOST)
+    serve.add_argument("--port", type=int, default=service.PORT)
+    serve.add_argument("-w", "--workers", type=int, default=None,
+                       help="worker processes (default: processing.workers)")
+    serve.add_argument("--queue", type=int, default=None,
+                       help=f"files in flight before 429 (default: {service.QUEUE_PER_WORKER} per worker)")
+    serve.add_argument("--db", default=None,
+                       help="database for store=1 requests (default: storage.db_name)")
+    serve.set_defaults(run=cmd_serve)
+
+    queue = commands.add_parser(
+        "queue", help="share a batch between hosts through a shared directory",
+        description="Every host runs 'queue work' on the same shared directory; "
+                    "the host holding the database also commits (--commit, or 'queue commit')."
+    )
+    actions = queue.add_subparsers(dest="action", required=True)
+    enqueue = actions.add_parser("enqueue", help="add PDFs to the shared queue")
+    enqueue.add_argument("root", help="shared queue directory")
+    enqueue.add_argument("inputs", nargs="+", help="PDF files, directories or glob patterns")
+    enqueue.add_argument("-r", "--recursive", action="store_true")
+    work = actions.add_parser("work", help="process jobs from the shared queue")
+    work.add_argument("root", help="shared queue directory")
+    work.add_argument("-w", "--workers", type=int, default=None,
+                      help="worker processes (default: processing.workers)")
+    work.add_argument("--commit", action="store_true",
+                      help="also commit results into the database on this host")
+    work.add_argument("--idle-exit", type=float, default=None,
+                      help="exit after this many seconds without work (default: run until stopped)")
+    work.add_argument("--db", default=None, help="database for --commit (default: storage.db_name)")
+    commit = actions.add_parser("commit", help="store finished results in the database")
+    commit.add_argument("root", help="shared queue directory")
+    commit.add_argument("--db", default=None, help="database name under data/ (default: storage.db_name)")
+    status = actions.add_parser("status", help="job counts per state")
+    status.add_argument("root", help="shared queue directory")
+    queue.set_defaults(run=cmd_queue)
+    return parser
+
+
+def main(argv=None):
+    logging.basicConfig(
+        level=logging.INFO, stream=sys.stderr,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "extract" and args.no_db and (args.csv or args.excel or args.parquet):
+        parser.error("exports read the stored invoices; drop --no-db")
+    try:
+        return args.run(args)
+    except KeyboardInterrupt:
+        print("Interrupted", file=sys.stderr)
+        return EXIT_INTERRUPTED
+    except Exception:
+        logger.exception("Unexpected error")
+        return EXIT_INTERNAL_ERROR
+
+# ---------------- EXTRACT ----------------
+
+def find_pdfs(inputs, recursive=False):
+    """Files named by inputs (files, directories, globs), deduplicated, sorted."""
+    extensions = tuple(load_settings().get("app", {}).get("allowed_extensions", [".pdf"]))
+    found = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            if recursive:
+                for root, _, names in os.walk(item):
+                    found.update(os.path.join(root, n) for n in names)
+            else:
+                found.update(os.path.join(item, n) for n in os.listdir(item))
+        elif os.path.isfile(item):
+            found.add(item)
+        else:
+            found.update(glob.glob(item, recursive=True))
+    return sorted(
+        os.path.abspath(p) for p in found
+        if os.path.isfile(p) and p.lower().endswith(extensions)
+    )
+
+
+def cmd_extract(args):
+    files = find_pdfs(args.inputs, args.recursive)
+    if not files:
+        print("No PDF files found", file=sys.stderr)
+        return EXIT_NO_INPUT
+
+    try:
+        storage = None if args.no_db else _open_storage(args.db)
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Opening the database failed: {e}")
+        return EXIT_OUTPUT_ERROR
+    try:
+        return _extract(args, files, storage)
+    finally:
+        if storage:
+            storage.close()
+
+
+def _extract(args, files, storage):
+    engine = BatchEngine(args.workers)
+    summary = {
+        "files": len(files), "processed": 0, "failed": 0,
+        SAVED: 0, DUPLICATE: 0, NEAR_DUPLICATE: 0,
+        "workers": min(engine.workers, len(files)),
+    }
+    stage_totals = dict.fromkeys(STAGES, 0.0)
+    first_id = storage.max_id() if storage else 0
+    pending = []
+    start = time.perf_counter()
+
+    try:
+        for done, result in enumerate(engine.run(files), 1):
+            for stage, seconds in (result.timings or {}).items():
+                stage_totals[stage] = stage_totals.get(stage, 0.0) + seconds
+            if result.status == "Processed":
+                summary["processed"] += 1
+                if storage:
+                    data = result.data
+                    pending.append((data["Filename"], data["File Hash"], data))
+                    if len(pending) >= SAVE_BATCH:
+                        _store(storage, pending, summary)
+            else:
+                summary["failed"] += 1
+
+            if not args.quiet and (done % PROGRESS_EVERY == 0 or done == len(files)):
+                elapsed = time.perf_counter() - start
+                print(f"{done}/{len(files)} files, {done / elapsed:.2f} files/s, "
+                      f"{summary['failed']} failed", file=sys.stderr)
+        if pending:
+            _store(storage, pending, summary)
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Storing results failed: {e}")
+        return EXIT_OUTPUT_ERROR
+
+    summary["seconds"] = round(time.perf_counter() - start, 3)
+    summary["files_per_sec"] = round(len(files) / summary["seconds"], 3) if summary["seconds"] else 0.0
+    summary["stages"] = {
+        stage: {"seconds": round(total, 3), "ms_per_file": round(1000 * total / len(files), 1)}
+        for stage, total in stage_totals.items()
+    }
+
+    exports = {}
+    if storage and (summary[SAVED] or summary[NEAR_DUPLICATE]):
+        window = {"after_id": first_id, "max_id": storage.max_id()}
+        try:
+            exports = _export(args, storage, window)
+        except Exception as e:
+            logger.error(f"Export failed: {e}")
+            return EXIT_OUTPUT_ERROR
+    summary["exports"] = exports
+
+    _print_summary(summary, args.json)
+    return EXIT_FILE_ERRORS if summary["failed"] else EXIT_OK
+
+
+def _open_storage(db):
+    return StorageEngine(db or load_settings().get("storage", {}).get("db_name", "invoices.db"))
+
+
+def _store(storage, pending, summary):
+    for status in storage.save_invoices(pending):
+        summary[status] += 1
+    pending.clear()
+
+
+def _export(args, storage, window):
+    written = {}
+    if args.csv:
+        written[args.csv] = storage.export_to_csv(args.csv, **window)
+    if args.excel:
+        written[args.excel] = export.export_to_excel(
+            storage.iter_invoices(include_raw=args.raw_text != "exclude", **window),
+            args.excel, raw_text=args.raw_text
+        )
+    if args.parquet:
+        written[args.parquet] = export.export_to_parquet(storage, args.parquet, **window)
+    return written
+
+
+def _print_summary(summary, as_json):
+    if as_json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(f"Files:    {summary['files']} ({summary['processed']} processed, {summary['failed']} failed)")
+    print(f"Stored:   {summary[SAVED]} saved, {summary[DUPLICATE]} duplicates, "
+          f"{summary[NEAR_DUPLICATE]} near-duplicates (saved, flagged)")
+    print(f"Elapsed:  {summary['seconds']:.1f} s, {summary['files_per_sec']:.2f} files/s "
+          f"on {summary['workers']} workers")
+    print(f"{'stage':<8} {'total s':>10} {'ms/file':>10}")
+    for stage, t in summary["stages"].items():
+        print(f"{stage:<8} {t['seconds']:>10.2f} {t['ms_per_file']:>10.1f}")
+    for path, rows in summary["exports"].items():
+        print(f"Exported: {rows} invoices to {path}")
+
+# ---------------- WATCH ----------------
+
+def cmd_watch(args):
+    if not os.path.isdir(args.directory):
+        print(f"Not a directory: {args.directory}", file=sys.stderr)
+        return EXIT_NO_INPUT
+
+    storage = _open_storage(args.db)
+    folder = HotFolder(
+        args.directory, storage, workers=args.workers, mode=args.mode,
+        settle=args.settle, window=args.window
+    )
+    # Finish the batch in hand, then exit cleanly
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: folder.stop())
+    try:
+        folder.run()
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Hot folder stopped: {e}")
+        return EXIT_OUTPUT_ERROR
+    finally:
+        storage.close()
+    logger.info(f"Stopped: {folder.stats}")
+    return EXIT_OK
+
+# ---------------- SERVE ----------------
+
+def cmd_serve(args):
+    try:
+        service.serve(
+            args.host, args.port, workers=args.workers, max_queue=args.queue, db_name=args.db
+        )
+    except OSError as e:
+        # Port taken, address not available
+        logger.error(f"Cannot serve on {args.host}:{args.port}: {e}")
+        return EXIT_OUTPUT_ERROR
+    return EXIT_OK
+
+# ---------------- SHARED QUEUE ----------------
+
+def cmd_queue(args):
+    shared = SharedQueue(args.root)
+    if args.action == "enqueue":
+        files = find_pdfs(args.inputs, args.recursive)
+        if not files:
+            print("No PDF files found", file=sys.stderr)
+            return EXIT_NO_INPUT
+        print(f"Queued {shared.enqueue(files)} of {len(files)} files")
+    elif args.action == "status":
+        print(json.dumps(shared.status()))
+    elif args.action == "commit":
+        storage = _open_storage(args.db)
+        try:
+            print(json.dumps(shared.commit(storage)))
+        finally:
+            storage.close()
+    else:
+        storage = _open_storage(args.db) if args.commit else None
+        stop = threading.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: stop.set())
+        try:
+            with BatchEngine(args.workers) as engine:
+                processed = shared.work(engine, stop, args.idle_exit, storage)
+        finally:
+            if storage:
+                storage.close()
+        logger.info(f"Processed {processed} jobs as {shared.owner}")
+    return EXIT_OK
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
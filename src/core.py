@@ -1,25 +1,41 @@
-import re
-import cv2
 import numpy as np
 import pdfplumber
-import pytesseract
 from pdf2image import convert_from_path
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
 import os
-import pandas as pd
+import time
+import logging
+
+from . import export as excel_export
+from .cache import ExtractionCache
+from .fields import FieldExtractor, LineIndex
+from .ocr import OCR_CONFIG, create_engine
+from .preprocess import (
+    PROBE_DPI, plan_page, crop_to_plan, binarize_fast, apply_variant
+)
+from .security import SecurityManager
+from .utils import load_settings, load_ocr_profile, tool_path
+
+logger = logging.getLogger("WilowApp")
 
 # ---------------- CONFIG ----------------
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
-POPPLER_PATH = r"C:\poppler-25.12.0\Library\bin"
+# None: pdftoppm/pdfinfo from PATH
+POPPLER_PATH = tool_path("poppler_path")
+
+OCR_DPI = 300
 
-OCR_CONFIG = r"--oem 3 --psm 6"
+# Scanned pages are rasterized PAGE_WINDOW at a time and OCR'd on
+# OCR_THREADS threads while the next window renders
+PAGE_WINDOW = 4
+OCR_THREADS = 2
 
-AMOUNT_REGEX = r"(\d{1,3}(?:,\d{3})*\.\d{2})"
-GST_REGEX = r"\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z]"
-DATE_REGEX = r"\d{2}[/-]\d{2}[/-]\d{4}"
-PAN_REGEX = r"[A-Z]{5}[0-9]{4}[A-Z]"
-IFSC_REGEX = r"[A-Z]{4}0[A-Z0-9]{6}"
-ACCOUNT_REGEX = r"\b\d{9,18}\b"
+# Pages whose text layer is shorter than this are treated as scanned
+MIN_PAGE_TEXT = 50
+
+# Bump when field extraction changes so cached fields are recomputed
+PIPELINE_VERSION = "2"
 
 
 class InvoicePipeline:
@@ -28,18 +44,98 @@ class InvoicePipeline:
     and returns a flat dict ready for Excel export.
     """
 
+    def __init__(self, page_window=None, ocr_threads=None, cache=None, ocr_engine=None,
+                 fast_preprocess=None, doc_class=None):
+        """
+        cache: an ExtractionCache, False to disable, or None to build one
+        from settings.yaml.
+        ocr_engine: OCR backend for scanned pages, "pytesseract", "tesserocr"
+        or "paddleocr"; defaults to settings.yaml.
+        fast_preprocess: grayscale render, auto-crop and auto-DPI for scanned
+        pages; defaults to settings.yaml.
+        doc_class: document class tuned by src/tuning.py; its profile sets
+        the DPI and preprocessing variant for scanned pages on the legacy
+        path, and the detection settings of the paddleocr backend. Defaults
+        to ocr.profile in settings.yaml (none: OCR_DPI and the adaptive
+        threshold). A profile tuned for another engine than the selected
+        one is ignored, with a warning.
+        """
+        settings = load_settings()
+        cfg = settings.get("processing", {})
+        self.page_window = page_window or cfg.get("page_window") or PAGE_WINDOW
+        self.ocr_threads = ocr_threads or cfg.get("ocr_threads") or OCR_THREADS
+        self.fields = FieldExtractor()
+        ocr_cfg = settings.get("ocr", {})
+        if fast_preprocess is None:
+            fast_preprocess = ocr_cfg.get("preprocess", "legacy") == "fast"
+        self.fast_preprocess = fast_preprocess
+        engine_name = ocr_engine or ocr_cfg.get("engine", "pytesseract")
+        doc_class = doc_class or ocr_cfg.get("profile")
+        self.profile = load_ocr_profile(doc_class) or {}
+        tuned_for = self.profile.get("engine", engine_name)
+        if tuned_for != engine_name:
+            # Its DPI and preprocessing were scored on a different engine
+            logger.warning(
+                f"OCR profile '{doc_class}' was tuned for {tuned_for}, not {engine_name}; ignoring it"
+            )
+            self.profile = {}
+        self.engine = create_engine(engine_name, self.profile)
+        self.ocr_dpi = self.profile.get("dpi", OCR_DPI)
+        self.variant = self.profile.get("preprocess", "adaptive_threshold")
+
+        if cache is None:
+            cache_cfg = settings.get("cache", {})
+            cache = cache_cfg.get("enabled", True) and ExtractionCache(
+                db_name=cache_cfg.get("db_name", "cache.db"),
+                max_mb=cache_cfg.get("max_mb", 256)
+            )
+        self.cache = cache or None
+        # Seconds per stage of the last process_invoice() call
+        self.timings = {}
+        # OCR threads live as long as the pipeline, so per-thread backend
+        # state (tesserocr's TessBaseAPI) is built once, not per document
+        self._ocr_pool = None
+
+    def close(self):
+        """Stops the OCR threads and releases the OCR backend."""
+        if self._ocr_pool:
+            self._ocr_pool.shutdown(wait=True, cancel_futures=True)
+            self._ocr_pool = None
+        self.engine.close()
+
     # ================= PUBLIC =================
     def process_invoice(self, pdf_path):
+        """
+        Field dict of one PDF. Afterwards self.timings holds the seconds
+        spent per stage: hash, cache, text (text layer), render, ocr (busy
+        time of the OCR backend, summed over OCR threads) and fields.
+        """
+        self.timings = {}
         filename = os.path.basename(pdf_path)
-
-        raw_text, method = self._extract_text(pdf_path)
-        lines = [l.strip() for l in raw_text.split("\n") if l.strip()]
-
-        # ---- FIX SGST RATE (table OCR issue) ----
-        cgst_rate = self._find_percent(lines, "CGST")
-        sgst_rate = self._find_percent(lines, "SGST")
-        if not sgst_rate and cgst_rate:
-            sgst_rate = cgst_rate
+        with self._stage("hash"):
+            file_hash = SecurityManager.get_file_hash(pdf_path)
+
+        key = hit = None
+        if self.cache:
+            with self._stage("cache"):
+                key = ExtractionCache.make_key(file_hash, self._ocr_fingerprint())
+                hit = self.cache.get(key)
+
+        if hit and hit["fields_version"] == PIPELINE_VERSION:
+            raw_text, method, fields = hit["raw_text"], hit["method"], hit["fields"]
+        else:
+            if hit:
+                raw_text, method = hit["raw_text"], hit["method"]
+            else:
+                ocr_busy = self.engine.seconds
+                raw_text, method = self._extract_text(pdf_path)
+                if self.engine.seconds > ocr_busy:
+                    self.timings["ocr"] = self.engine.seconds - ocr_busy
+            with self._stage("fields"):
+                fields = self._extract_fields(raw_text)
+            if self.cache:
+                with self._stage("cache"):
+                    self.cache.put(key, raw_text, method, fields, PIPELINE_VERSION)
 
         return {
             # -------- File / Status --------
@@ -47,81 +143,160 @@ class InvoicePipeline:
             "Status": "PROCESSED",
             "Processed On": datetime.now().strftime("%d-%m-%Y %H:%M"),
             "OCR Method": method,
+            "File Hash": file_hash,
 
-            # -------- Invoice Header --------
-            "Invoice Type": self._find_contains(lines, ["TAX INVOICE"]),
-            "Invoice No": self._label_value(raw_text, ["Invoice No"]),
-            "Invoice Date": self._first_match(DATE_REGEX, raw_text),
-            "Due Date": self._label_value(raw_text, ["Due Date"]),
-            "Place of Supply": self._label_value(raw_text, ["Place of Supply"]),
-            "Currency": "INR",
-
-            # -------- Vendor --------
-            "Vendor Name": self._vendor_name(lines),
-            "Vendor Address": self._vendor_address(lines),
-            "Vendor GSTIN": self._first_match(GST_REGEX, raw_text),
-            "Vendor PAN": self._first_match(PAN_REGEX, raw_text),
-            "Vendor Email": self._label_value(raw_text, ["Email"]),
-
-            # -------- Buyer --------
-            "Buyer Name": self._buyer_name(lines),
-            "Buyer Address": self._buyer_address(lines),
-            "Buyer GSTIN": self._buyer_gstin(lines),
-
-            # -------- Line Items --------
-            **self._extract_items(lines),
-
-            # -------- Taxes --------
-            "CGST Rate (%)": cgst_rate,
-            "CGST Amount": self._find_amount(lines, "CGST"),
-            "SGST Rate (%)": sgst_rate,
-            "SGST Amount": self._find_amount(lines, "SGST"),
-            "Total Tax": self._find_amount(lines, "Tax"),
-
-            # -------- Totals --------
-            "Subtotal": self._find_amount(lines, "Sub Total"),
-            "Grand Total": self._find_amount(lines, "Grand Total"),
-            "Amount in Words": self._label_value(raw_text, ["Amount in Words"]),
-
-            # -------- Bank --------
-            "Bank Name": self._label_value(raw_text, ["Bank"]),
-            "Account Name": self._label_value(raw_text, ["Account Name"]),
-            "Account Number": self._first_match(ACCOUNT_REGEX, raw_text),
-            "IFSC Code": self._first_match(IFSC_REGEX, raw_text),
-            "Branch": self._label_value(raw_text, ["Branch"]),
+            **fields,
 
             # -------- Raw Backup --------
             "Raw OCR Text": raw_text
         }
 
+    @contextmanager
+    def _stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def _ocr_fingerprint(self):
+        # Everything that changes the text _extract_text would produce
+        prep = "fast" if self.fast_preprocess else "legacy"
+        if self.profile and not self.fast_preprocess:
+            prep = f"{prep}:{self.variant}"
+        return f"{self.engine.fingerprint()}|{OCR_CONFIG}|{self.ocr_dpi}|{prep}|{MIN_PAGE_TEXT}"
+
+    # ================= FIELDS =================
+    def _extract_fields(self, raw_text):
+        lines = [l.strip() for l in raw_text.split("\n") if l.strip()]
+        return self.fields.extract(raw_text, LineIndex(lines))
+
     # ================= EXTRACTION =================
     def _extract_text(self, path):
-        text = ""
-        method = "TEXT"
-
-        with pdfplumber.open(path) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                if page_text:
-                    text += page_text + "\n"
-
-        if len(text.strip()) < 50:
-            method = "OCR"
-            images = convert_from_path(path, dpi=300, poppler_path=POPPLER_PATH)
-            for img in images:
-                text += self._ocr(img) + "\n"
-
-        return self._normalize(text), method
-
-    def _ocr(self, img):
-        img = np.array(img)
-        gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
-        gray = cv2.adaptiveThreshold(
-            gray, 255,
-            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-            cv2.THRESH_BINARY, 31, 2
+        """
+        Routes every page on its own: pages with a usable text layer keep
+        it, only the rest are rasterized and OCR'd.
+        """
+        with self._stage("text"), pdfplumber.open(path) as pdf:
+            page_texts = [page.extract_text() or "" for page in pdf.pages]
+
+        scanned = [
+            n for n, t in enumerate(page_texts, 1)
+            if len(t.strip()) < MIN_PAGE_TEXT
+        ]
+        if scanned:
+            for n, ocr_text in zip(scanned, self._ocr_pages(path, scanned)):
+                page_texts[n - 1] = ocr_text
+
+        text = "".join(t + "\n" for t in page_texts if t)
+        return self._normalize(text), self._method_summary(len(page_texts), scanned)
+
+    def _method_summary(self, page_count, scanned):
+        if not scanned:
+            return "TEXT"
+        if len(scanned) == page_count:
+            return "OCR"
+        ocr_pages = set(scanned)
+        digital = [n for n in range(1, page_count + 1) if n not in ocr_pages]
+        return f"MIXED (TEXT p{_page_ranges(digital)}; OCR p{_page_ranges(scanned)})"
+
+    def _page_windows(self, page_numbers):
+        # Contiguous runs of at most page_window pages, one render call each
+        window = []
+        for n in page_numbers:
+            if window and (n != window[-1] + 1 or len(window) == self.page_window):
+                yield window
+                window = []
+            window.append(n)
+        if window:
+            yield window
+
+    def _ocr_pages(self, path, page_numbers):
+        """
+        Rasterizes pages in windows of `page_window` and OCRs each window on
+        a thread pool while the next one renders. Only two windows of bitmaps
+        are alive at a time, so memory stays flat regardless of page count.
+        Batched backends get a whole window per call, the others one page.
+        Returns the page texts in the order of `page_numbers`.
+        """
+        page_numbers = list(page_numbers)
+        texts = {}
+        previous = current = []
+
+        if self._ocr_pool is None:
+            self._ocr_pool = ThreadPoolExecutor(max_workers=self.ocr_threads)
+        try:
+            for window in self._page_windows(page_numbers):
+                with self._stage("render"):
+                    pages = self._render_window(path, window)
+                chunks = [pages] if self.engine.batched else [[p] for p in pages]
+                current = [(chunk, self._ocr_pool.submit(self._ocr, chunk)) for chunk in chunks]
+                del pages, chunks
+
+                for chunk, fut in previous:
+                    texts.update(zip((n for n, _, _ in chunk), fut.result()))
+                previous = current
+
+            for chunk, fut in previous:
+                texts.update(zip((n for n, _, _ in chunk), fut.result()))
+        except BaseException:
+            # The pool outlives this document; don't leave its pages queued
+            for _, fut in previous + current:
+                fut.cancel()
+            raise
+
+        return [texts[n] for n in page_numbers]
+
+    def _render_window(self, path, window):
+        """
+        Returns (page_no, image, plan) for a contiguous run of pages.
+        Legacy mode renders RGB at the profile DPI (OCR_DPI by default).
+        Fast mode renders a grayscale probe at PROBE_DPI, plans crop box and
+        DPI from it, and renders each page straight to grayscale at its own
+        DPI (blank pages are skipped).
+        """
+        if not self.fast_preprocess:
+            images = convert_from_path(
+                path, dpi=self.ocr_dpi,
+                first_page=window[0], last_page=window[-1],
+                poppler_path=POPPLER_PATH
+            )
+            return [(n, img, None) for n, img in zip(window, images)]
+
+        probes = convert_from_path(
+            path, dpi=PROBE_DPI, grayscale=True,
+            first_page=window[0], last_page=window[-1],
+            poppler_path=POPPLER_PATH
         )
-        return pytesseract.image_to_string(gray, config=OCR_CONFIG)
+        pages = []
+        for n, probe in zip(window, probes):
+            plan = plan_page(np.asarray(probe), PROBE_DPI)
+            img = None
+            if plan:
+                img = convert_from_path(
+                    path, dpi=plan.dpi, grayscale=True,
+                    first_page=n, last_page=n,
+                    poppler_path=POPPLER_PATH
+                )[0]
+            pages.append((n, img, plan))
+        return pages
+
+    def _ocr(self, pages):
+        """Texts for (page_no, image, plan) entries; blank pages read as ""."""
+        images, dpis = [], []
+        for _, img, plan in pages:
+            if img is None:
+                continue
+            if plan is None:
+                images.append(apply_variant(img, self.variant))
+                dpis.append(self.ocr_dpi)
+            else:
+                roi = crop_to_plan(np.asarray(img), plan)
+                images.append(binarize_fast(roi, plan.dpi))
+                dpis.append(plan.dpi)
+
+        texts = iter(self.engine.recognize_batch(images, dpis) if images else [])
+        return ["" if img is None else next(texts) for _, img, _ in pages]
 
     def _normalize(self, text):
         return (
@@ -131,114 +306,24 @@ class InvoicePipeline:
                 .replace("â‚¹", "INR ")
         )
 
-    # ================= ITEMS =================
-    def _extract_items(self, lines):
-        sr, desc, hsn, qty, rate, amt = [], [], [], [], [], []
-
-        for l in lines:
-            if re.search(r"\d+\s+.*\d{2}\.\d{2}$", l):
-                numbers = re.findall(AMOUNT_REGEX, l)
-                if numbers:
-                    amt.append(numbers[-1].replace(",", ""))
-                    rate.append(numbers[-1].replace(",", ""))
-                desc.append(l)
-                sr.append(str(len(sr) + 1))
-                qty.append("1")
-                hsn.append("")
-
-        return {
-            "Item Sr Nos": "|".join(sr),
-            "Item Descriptions": "|".join(desc),
-            "HSN/SAC Codes": "|".join(hsn),
-            "Quantities": "|".join(qty),
-            "Rates": "|".join(rate),
-            "Item Amounts": "|".join(amt)
-        }
 
-    # ================= HELPERS =================
-    def _find_amount(self, lines, keyword):
-        for l in lines:
-            if keyword.lower() in l.lower():
-                m = re.findall(AMOUNT_REGEX, l)
-                if m:
-                    return m[-1].replace(",", "")
-        return ""
-
-    def _find_percent(self, lines, keyword):
-        for l in lines:
-            if keyword.lower() in l.lower() and "%" in l:
-                m = re.search(r"(\d+)%", l)
-                if m:
-                    return m.group(1)
-        return ""
-
-    def _label_value(self, text, labels):
-        for label in labels:
-            m = re.search(rf"{label}\s*[:\-]?\s*(.+)", text, re.I)
-            if m:
-                return m.group(1).split("\n")[0].strip()
-        return ""
-
-    def _first_match(self, regex, text):
-        m = re.search(regex, text)
-        return m.group() if m else ""
-
-    def _find_contains(self, lines, keys):
-        for l in lines:
-            for k in keys:
-                if k in l.upper():
-                    return k
-        return ""
-
-    def _vendor_name(self, lines):
-        for l in lines:
-            if any(x in l.upper() for x in ["PVT", "LTD", "PRIVATE"]):
-                return l
-        return ""
-
-    def _vendor_address(self, lines):
-        return " ".join(lines[1:6])
-
-    def _buyer_name(self, lines):
-        for i, l in enumerate(lines):
-            if any(x in l.lower() for x in ["invoice to", "bill to"]):
-                return lines[i + 1]
-        return ""
-
-    def _buyer_address(self, lines):
-        for i, l in enumerate(lines):
-            if any(x in l.lower() for x in ["invoice to", "bill to"]):
-                return " ".join(lines[i + 2:i + 6])
-        return ""
-
-    def _buyer_gstin(self, lines):
-        for l in lines:
-            if re.search(GST_REGEX, l):
-                return l
-        return ""
+def _page_ranges(numbers):
+    """[1, 2, 3, 5] -> '1-3,5'"""
+    parts = []
+    start = prev = numbers[0]
+    for n in numbers[1:] + [None]:
+        if n is not None and n == prev + 1:
+            prev = n
+            continue
+        parts.append(str(start) if start == prev else f"{start}-{prev}")
+        start = prev = n
+    return ",".join(parts)
 
 
 # ================= EXCEL EXPORT =================
-def export_to_excel(rows, output_path):
+def export_to_excel(rows, output_path, raw_text="full"):
     """
-    rows: list of dicts returned by InvoicePipeline.process_invoice()
+    rows: list (or any iterable) of dicts returned by
+    InvoicePipeline.process_invoice(). Streams through export.py.
     """
-
-    if not rows:
-        raise ValueError("No data to export")
-
-    df = pd.DataFrame(rows)
-
-    with pd.ExcelWriter(output_path, engine="openpyxl") as writer:
-        df.to_excel(writer, index=False, sheet_name="Invoices")
-
-        ws = writer.sheets["Invoices"]
-
-        for i, col in enumerate(df.columns, 1):
-            max_len = max(
-                df[col].astype(str).map(len).max(),
-                len(col)
-            )
-            col_letter = chr(64 + i) if i <= 26 else None
-            if col_letter:
-                ws.column_dimensions[col_letter].width = min(max_len + 2, 60)
+    return excel_export.export_to_excel(rows, output_path, raw_text=raw_text)
@@ -0,0 +1,381 @@
+import os
+import shutil
+import itertools
+from contextlib import suppress
+from datetime import date, datetime
+import xlsxwriter
+
+# ---------------- CONFIG ----------------
+# Column order of InvoicePipeline.process_invoice(); keys outside it are
+# appended after these when the rows come as a list
+EXPORT_COLUMNS = [
+    "Filename", "Status", "Processed On", "OCR Method", "File Hash",
+    "Invoice Type", "Invoice No", "Invoice Date", "Due Date", "Place of Supply", "Currency",
+    "Vendor Name", "Vendor Address", "Vendor GSTIN", "Vendor PAN", "Vendor Email",
+    "Buyer Name", "Buyer Address", "Buyer GSTIN",
+    "Item Sr Nos", "Item Descriptions", "HSN/SAC Codes", "Quantities", "Rates", "Item Amounts",
+    "CGST Rate (%)", "CGST Amount", "SGST Rate (%)", "SGST Amount", "Total Tax",
+    "Subtotal", "Grand Total", "Amount in Words",
+    "Bank Name", "Account Name", "Account Number", "IFSC Code", "Branch",
+    "Raw OCR Text",
+]
+RAW_TEXT_COLUMN = "Raw OCR Text"
+
+# raw_text modes: "full" (up to the cell limit), "truncate", "exclude"
+RAW_TEXT_MODES = ("full", "truncate", "exclude")
+RAW_TEXT_PREVIEW = 1000
+EXCEL_CELL_LIMIT = 32767
+
+MAX_COLUMN_WIDTH = 60
+SHEET_NAME = "Invoices"
+
+# Rows per Parquet row group (= rows read from the database per chunk)
+PARQUET_ROW_GROUP_ROWS = 50000
+
+# Exploded line items, one row per item, keyed by invoice id
+PARQUET_ITEM_TYPES = [
+    ("invoice_id", "int64"),
+    ("line_no", "int32"),
+    ("description", "string"),
+    ("hsn_sac", "string"),
+    ("quantity", "float64"),
+    ("rate", "float64"),
+    ("amount", "float64"),
+]
+
+# Structured fields that don't fit a cell (the items are in the flat
+# "Item ..." columns already)
+NESTED_FIELDS = {"Line Items"}
+
+# Invoice header columns (StorageEngine QUERY_COLUMNS) and their Arrow types
+PARQUET_HEADER_TYPES = [
+    ("id", "int64"),
+    ("filename", "string"),
+    ("upload_date", "timestamp"),
+    ("invoice_number", "string"),
+    ("invoice_date", "string"),
+    ("invoice_date_iso", "date"),
+    ("vendor_name", "string"),
+    ("vendor_gstin", "string"),
+    ("buyer_name", "string"),
+    ("cgst_num", "float64"),
+    ("sgst_num", "float64"),
+    ("grand_total_num", "float64"),
+    ("currency", "string"),
+    ("status", "string"),
+    ("duplicate_of", "int64"),
+    ("duplicate_similarity", "float64"),
+]
+
+
+def export_to_excel(rows, output_path, raw_text="full", columns=None):
+    """
+    Streams invoice dicts into an .xlsx file with xlsxwriter's constant
+    memory mode: each row is flushed to disk once written, so only the
+    current row is held, whatever the row count.
+
+    rows: any iterable of dicts - InvoicePipeline.process_invoice()
+    results, or StorageEngine.iter_invoices(include_raw=...).
+    raw_text: "full", "truncate" (first RAW_TEXT_PREVIEW chars) or
+    "exclude" the Raw OCR Text column.
+    columns: explicit column list; defaults to EXPORT_COLUMNS.
+
+    Column widths are tracked as rows pass through and applied at the end.
+    Returns the number of rows written.
+    """
+    if raw_text not in RAW_TEXT_MODES:
+        raise ValueError(f"Unknown raw_text mode: {raw_text}")
+
+    if isinstance(rows, list):
+        if not rows:
+            raise ValueError("No data to export")
+        if columns is None:
+            columns = _columns_of(rows)
+    else:
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            raise ValueError("No data to export")
+        rows = itertools.chain([first], rows)
+        columns = columns or list(EXPORT_COLUMNS)
+    if raw_text == "exclude":
+        columns = [c for c in columns if c != RAW_TEXT_COLUMN]
+
+    workbook = xlsxwriter.Workbook(output_path, {
+        "constant_memory": True,
+        # Cell text is data, never a formula/number/link
+        "strings_to_formulas": False,
+        "strings_to_numbers": False,
+        "strings_to_urls": False,
+    })
+    try:
+        ws = workbook.add_worksheet(SHEET_NAME)
+        header = workbook.add_format({"bold": True, "border": 1})
+        widths = [len(c) for c in columns]
+        for col, name in enumerate(columns):
+            ws.write_string(0, col, name, header)
+
+        count = 0
+        for row in rows:
+            count += 1
+            for col, name in enumerate(columns):
+                value = row.get(name)
+                if value is None:
+                    continue
+                text = _cell_text(value, name, raw_text)
+                ws.write_string(count, col, text)
+                if len(text) > widths[col]:
+                    widths[col] = len(text)
+
+        for col, width in enumerate(widths):
+            ws.set_column(col, col, min(width + 2, MAX_COLUMN_WIDTH))
+    except Exception:
+        # Keep the original error: the file may never have been created
+        with suppress(Exception):
+            workbook.close()
+        with suppress(FileNotFoundError):
+            os.remove(output_path)
+        raise
+    workbook.close()
+    return count
+
+
+def _columns_of(rows):
+    # Keys are cheap to scan; keep every field the rows carry
+    columns = list(EXPORT_COLUMNS)
+    known = set(columns)
+    for row in rows:
+        for key in row:
+            if key not in known and key not in NESTED_FIELDS:
+                known.add(key)
+                columns.append(key)
+    return columns
+
+
+def _cell_text(value, name, raw_text):
+    text = value if isinstance(value, str) else str(value)
+    if name == RAW_TEXT_COLUMN and raw_text == "truncate":
+        return text[:RAW_TEXT_PREVIEW]
+    return text[:EXCEL_CELL_LIMIT]
+
+
+# ---------------- PARQUET ----------------
+
+def _schema(pa, column_types):
+    types = {
+        "int32": pa.int32(), "int64": pa.int64(), "string": pa.string(),
+        "float64": pa.float64(), "date": pa.date32(), "timestamp": pa.timestamp("s"),
+    }
+    return pa.schema([(name, types[t]) for name, t in column_types])
+
+
+def _batch(pa, schema, rows):
+    return pa.RecordBatch.from_arrays(
+        [pa.array([row[i] for row in rows], type=field.type) for i, field in enumerate(schema)],
+        schema=schema
+    )
+
+
+def items_path_for(output_path):
+    """Where the items table goes next to a header file/dataset: a.parquet -> a.items.parquet"""
+    head, tail = os.path.split(output_path.rstrip("/\\"))
+    stem = tail[:-len(".parquet")] if tail.lower().endswith(".parquet") else tail
+    return os.path.join(head, f"{stem}.items.parquet")
+
+
+def _typed(value, kind):
+    if value is None:
+        return None
+    try:
+        if kind == "date":
+            return date.fromisoformat(value)
+        if kind == "timestamp":
+            return datetime.strptime(value, "%Y-%m-%d %H:%M")
+    except ValueError:
+        return None
+    return value
+
+
+def export_to_parquet(storage, output_path, items_path=None,
+                      chunk_size=PARQUET_ROW_GROUP_ROWS, **filters):
+    """
+    Streams invoices out of a StorageEngine into two Parquet files:
+
+    - output_path: header table with typed columns (amounts as float64,
+      invoice date as date32), read without decrypting anything
+    - items_path (default items_path_for(output_path)): line items, one
+      row per item keyed by invoice_id, from the invoice_items table;
+      items_path=False skips it
+
+    Both are written one row group of chunk_size rows at a time, so
+    memory is bounded by a row group. filters: same as
+    StorageEngine.query(). Returns the number of invoices written; no
+    files are created for 0 invoices.
+    """
+    import pyarrow as pa
+
+    header_schema = _schema(pa, PARQUET_HEADER_TYPES)
+    kinds = [kind for _, kind in PARQUET_HEADER_TYPES]
+    headers = (
+        [tuple(_typed(value, kind) for value, kind in zip(row, kinds)) for row in rows]
+        for rows in storage.iter_header_chunks(chunk_size, **filters)
+    )
+    outputs = [output_path]
+    if items_path is not False:
+        outputs.append(items_path or items_path_for(output_path))
+
+    # Both tables go to temp files and are renamed together at the end
+    tmp_paths = [path + ".tmp" for path in outputs]
+    try:
+        written = _write_parquet(pa, tmp_paths[0], header_schema, headers)
+        if written and len(outputs) > 1:
+            items = storage.iter_item_chunks(chunk_size, **filters)
+            _write_parquet(pa, tmp_paths[1], _schema(pa, PARQUET_ITEM_TYPES), items, empty_ok=True)
+    except Exception:
+        for tmp in tmp_paths:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        raise
+
+    if written:
+        for tmp, path in zip(tmp_paths, outputs):
+            os.replace(tmp, path)
+    return written
+
+
+def _write_parquet(pa, path, schema, chunks, empty_ok=False):
+    """
+    Writes each chunk of row tuples as a row group; returns the row count.
+    Nothing is written for no rows, unless empty_ok (schema-only file).
+    """
+    import pyarrow.parquet as pq
+
+    written = 0
+    writer = None
+    try:
+        for rows in chunks:
+            if writer is None:
+                writer = pq.ParquetWriter(path, schema, compression="zstd")
+            writer.write_batch(_batch(pa, schema, rows))
+            written += len(rows)
+        if writer is None and empty_ok:
+            writer = pq.ParquetWriter(path, schema, compression="zstd")
+    finally:
+        if writer:
+            writer.close()
+    return written
+
+
+# ---------------- INCREMENTAL ----------------
+
+def export_format(output_path):
+    lower = output_path.lower().rstrip("/\\")
+    if lower.endswith((".csv", ".csv.gz")):
+        return "csv"
+    if lower.endswith(".xlsx"):
+        return "xlsx"
+    if lower.endswith(".parquet"):
+        return "parquet"
+    raise ValueError(f"Unsupported export format: {output_path}")
+
+
+def export_incremental(storage, target, output_path, append=True, **filters):
+    """
+    Exports only the invoices stored since the last export to `target`
+    (a name, e.g. "erp-nightly"), then moves the target's watermark.
+
+    The run is bounded by the highest invoice id at its start, so invoices
+    saved while it runs go to the next one. The watermark only moves after
+    the file is completely written; a failed run is repeated in full.
+
+    append: CSV (.csv / .csv.gz) rows are added to the existing file, and
+    Parquet output_path ("x.parquet") is a dataset directory that gets one
+    part file per run (line items likewise under "x.items.parquet").
+    Without append, or for .xlsx, output_path is replaced by a file
+    holding just the new invoices; with none, the previous file is
+    removed, so it is never mistaken for the latest increment.
+    filters: same as StorageEngine.query().
+    Returns the number of invoices written.
+    """
+    fmt = export_format(output_path)
+    replaces = fmt == "xlsx" or not append
+    since = storage.get_watermark(target)
+    until = storage.max_id()
+    if until <= since:
+        if replaces:
+            _remove_outputs(fmt, output_path)
+        return 0
+    window = dict(filters, after_id=since, max_id=until)
+
+    if fmt == "csv":
+        written = _append_csv(storage, output_path, window) if append else \
+            _replace(output_path, lambda tmp: storage.export_to_csv(
+                tmp, compress=output_path.lower().endswith(".gz"), **window
+            ))
+    elif fmt == "xlsx":
+        written = _replace(output_path, lambda tmp: _excel_or_zero(
+            storage.iter_invoices(**window), tmp
+        ))
+    elif append:
+        items_dir = items_path_for(output_path)
+        os.makedirs(output_path, exist_ok=True)
+        os.makedirs(items_dir, exist_ok=True)
+        part = f"part-{since + 1:010d}-{until:010d}.parquet"
+        written = export_to_parquet(
+            storage, os.path.join(output_path, part), os.path.join(items_dir, part), **window
+        )
+    else:
+        written = export_to_parquet(storage, output_path, **window)
+
+    if replaces and not written:
+        _remove_outputs(fmt, output_path)
+    # Only reached once the output is fully written (or removed)
+    storage.set_watermark(target, until, written)
+    return written
+
+
+def _remove_outputs(fmt, output_path):
+    paths = [output_path]
+    if fmt == "parquet":
+        paths.append(items_path_for(output_path))
+    for path in paths:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def _append_csv(storage, output_path, window):
+    # On failure cut the file back so a half-written run is never kept
+    size = os.path.getsize(output_path) if os.path.exists(output_path) else None
+    try:
+        return storage.export_to_csv(output_path, append=True, **window)
+    except Exception:
+        if size is None:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+        else:
+            with open(output_path, "r+b") as f:
+                f.truncate(size)
+        raise
+
+
+def _replace(output_path, write):
+    tmp_path = output_path + ".tmp"
+    try:
+        written = write(tmp_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if written:
+        os.replace(tmp_path, output_path)
+    return written
+
+
+def _excel_or_zero(rows, output_path):
+    rows = iter(rows)
+    first = next(rows, None)
+    if first is None:
+        return 0
+    return export_to_excel(itertools.chain([first], rows), output_path)
@@ -0,0 +1,328 @@
+import re
+
+AMOUNT_REGEX = r"(\d{1,3}(?:,\d{3})*\.\d{2})"
+GST_REGEX = r"\d{2}[A-Z]{5}\d{4}[A-Z][1-9A-Z]Z[0-9A-Z]"
+DATE_REGEX = r"\d{2}[/-]\d{2}[/-]\d{4}"
+PAN_REGEX = r"[A-Z]{5}[0-9]{4}[A-Z]"
+IFSC_REGEX = r"[A-Z]{4}0[A-Z0-9]{6}"
+ACCOUNT_REGEX = r"\b\d{9,18}\b"
+ITEM_REGEX = r"\d+\s+.*\d{2}\.\d{2}$"
+PERCENT_REGEX = r"(\d+)%"
+HSN_REGEX = r"\b(?:HSN|SAC)\b\s*(?:/\s*SAC\b)?\s*[:\-]?\s*(\d{4,8})\b"
+
+# Fields read straight off the raw text: "Label: value" lookups (case
+# insensitive, value may start on the next line) and first-match IDs
+LABEL_FIELDS = [
+    ("Invoice No", "Invoice No"),
+    ("Due Date", "Due Date"),
+    ("Place of Supply", "Place of Supply"),
+    ("Vendor Email", "Email"),
+    ("Amount in Words", "Amount in Words"),
+    ("Bank Name", "Bank"),
+    ("Account Name", "Account Name"),
+    ("Branch", "Branch"),
+]
+ID_FIELDS = [
+    ("Invoice Date", DATE_REGEX),
+    ("Vendor GSTIN", GST_REGEX),
+    ("Vendor PAN", PAN_REGEX),
+    ("Account Number", ACCOUNT_REGEX),
+    ("IFSC Code", IFSC_REGEX),
+]
+
+# Line fields: last amount / first "NN%" on the first line mentioning the keyword
+AMOUNT_FIELDS = [
+    ("CGST Amount", "CGST"),
+    ("SGST Amount", "SGST"),
+    ("Total Tax", "Tax"),
+    ("Subtotal", "Sub Total"),
+    ("Grand Total", "Grand Total"),
+]
+PERCENT_FIELDS = [
+    ("CGST Rate (%)", "CGST"),
+    ("SGST Rate (%)", "SGST"),
+]
+INVOICE_TYPES = ["TAX INVOICE"]
+VENDOR_MARKERS = ["PVT", "LTD", "PRIVATE"]
+BUYER_MARKERS = ["invoice to", "bill to"]
+
+
+# Pipe-joined item columns of the flat invoice dict
+ITEM_FIELDS = [
+    ("Item Sr Nos", "line_no"),
+    ("Item Descriptions", "description"),
+    ("HSN/SAC Codes", "hsn_sac"),
+    ("Quantities", "quantity"),
+    ("Rates", "rate"),
+    ("Item Amounts", "amount"),
+]
+
+
+def join_items(items):
+    """Structured items -> the flat "|"-joined fields (no amount: skipped)."""
+    return {
+        field: "|".join(str(item[key]) for item in items if item[key] is not None)
+        for field, key in ITEM_FIELDS
+    }
+
+
+def split_items(data):
+    """
+    Structured items of an invoice dict: its "Line Items" when present,
+    otherwise rebuilt from the "|"-joined fields (older results).
+    """
+    if data.get("Line Items") is not None:
+        return data["Line Items"]
+    parts = {key: (data.get(field) or "").split("|") for field, key in ITEM_FIELDS}
+    count = len(parts["description"]) if data.get("Item Descriptions") else 0
+    return [
+        dict(
+            {key: (vals[i] if i < len(vals) and vals[i] != "" else None) for key, vals in parts.items()},
+            line_no=i + 1
+        )
+        for i in range(count)
+    ]
+
+
+# Case-insensitive matching treats these as i/s; lowercasing alone does not
+_FOLD = str.maketrans({"\u0131": "i", "\u017f": "s"})
+
+
+class LineIndex:
+    """
+    Per-document index over the stripped lines of an invoice.
+
+    Lowercased (and, on demand, uppercased) lines are cached once, and every
+    lowercase whitespace-separated token maps to the line numbers it occurs
+    on. Keyword lookups
+    keep the substring semantics of `keyword.lower() in line.lower()` but
+    only verify the lines whose tokens can contain the keyword, and each
+    keyword is resolved once per document.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.lower = [l.lower() for l in lines]
+        self._upper = None
+        self._postings = {}
+        for i, lo in enumerate(self.lower):
+            for tok in set(lo.split()):
+                self._postings.setdefault(tok, []).append(i)
+        self._hits = {}
+
+    @property
+    def upper(self):
+        if self._upper is None:
+            self._upper = [l.upper() for l in self.lines]
+        return self._upper
+
+    def find(self, keyword):
+        """Sorted line numbers whose lowercased text contains `keyword`."""
+        keyword = keyword.lower()
+        if keyword not in self._hits:
+            self._hits[keyword] = [i for i in self._candidates(keyword) if keyword in self.lower[i]]
+        return self._hits[keyword]
+
+    def first(self, keyword):
+        hits = self.find(keyword)
+        return hits[0] if hits else None
+
+    def first_upper(self, keywords):
+        """First line whose uppercased text contains any of `keywords`."""
+        for i, up in enumerate(self.upper):
+            if any(k in up for k in keywords):
+                return i
+        return None
+
+    def _candidates(self, keyword):
+        # A whitespace-free run of the keyword always sits inside one line
+        # token, so lines holding a token that contains the longest run are
+        # a superset of the matches
+        parts = keyword.split()
+        if not parts:
+            return range(len(self.lines))
+        part = max(parts, key=len)
+        lines = set()
+        for tok, postings in self._postings.items():
+            if part in tok:
+                lines.update(postings)
+        return sorted(lines)
+
+
+class FieldExtractor:
+    """
+    Collects every invoice field in one scan of the raw text plus lookups
+    against a LineIndex, instead of a separate scan per field.
+
+    All patterns are compiled once. Labels are found with a single combined
+    matcher over the case-folded text; the exact per-field regexes only run
+    where it flags a hit. Keyword lookups go through the document's index.
+    Output is identical to running each lookup on its own.
+    """
+
+    def __init__(self):
+        self._label_res = [
+            (field, re.compile(rf"{re.escape(label)}\s*[:\-]?\s*(.+)", re.I))
+            for field, label in LABEL_FIELDS
+        ]
+        self._id_res = [(field, re.compile(regex)) for field, regex in ID_FIELDS]
+
+        # Zero-width so labels that overlap each other are all seen
+        labels = "|".join(re.escape(label.lower()) for _, label in LABEL_FIELDS)
+        self._label_trigger = re.compile(rf"(?={labels})")
+
+        self._gst_re = re.compile(GST_REGEX)
+        self._amount_re = re.compile(AMOUNT_REGEX)
+        self._percent_re = re.compile(PERCENT_REGEX)
+        self._item_re = re.compile(ITEM_REGEX)
+        self._hsn_re = re.compile(HSN_REGEX, re.I)
+
+    # ================= PUBLIC =================
+    def extract(self, raw_text, index):
+        text_fields = self._scan_text(raw_text)
+        lines = index.lines
+
+        # ---- FIX SGST RATE (table OCR issue) ----
+        cgst_rate = self._find_percent(index, "CGST")
+        sgst_rate = self._find_percent(index, "SGST")
+        if not sgst_rate and cgst_rate:
+            sgst_rate = cgst_rate
+
+        # "invoice to" / "bill to" is looked up once for both buyer fields
+        buyer_at = self._buyer_line(index)
+        items = self._extract_items(index)
+
+        return {
+            # -------- Invoice Header --------
+            "Invoice Type": self._invoice_type(index),
+            "Invoice No": text_fields["Invoice No"],
+            "Invoice Date": text_fields["Invoice Date"],
+            "Due Date": text_fields["Due Date"],
+            "Place of Supply": text_fields["Place of Supply"],
+            "Currency": "INR",
+
+            # -------- Vendor --------
+            "Vendor Name": self._vendor_name(index),
+            "Vendor Address": " ".join(lines[1:6]),
+            "Vendor GSTIN": text_fields["Vendor GSTIN"],
+            "Vendor PAN": text_fields["Vendor PAN"],
+            "Vendor Email": text_fields["Vendor Email"],
+
+            # -------- Buyer --------
+            "Buyer Name": lines[buyer_at + 1] if buyer_at is not None else "",
+            "Buyer Address": " ".join(lines[buyer_at + 2:buyer_at + 6]) if buyer_at is not None else "",
+            "Buyer GSTIN": self._buyer_gstin(index),
+
+            # -------- Line Items --------
+            **join_items(items),
+            "Line Items": items,
+
+            # -------- Taxes --------
+            "CGST Rate (%)": cgst_rate,
+            "CGST Amount": self._find_amount(index, "CGST"),
+            "SGST Rate (%)": sgst_rate,
+            "SGST Amount": self._find_amount(index, "SGST"),
+            "Total Tax": self._find_amount(index, "Tax"),
+
+            # -------- Totals --------
+            "Subtotal": self._find_amount(index, "Sub Total"),
+            "Grand Total": self._find_amount(index, "Grand Total"),
+            "Amount in Words": text_fields["Amount in Words"],
+
+            # -------- Bank --------
+            "Bank Name": text_fields["Bank Name"],
+            "Account Name": text_fields["Account Name"],
+            "Account Number": text_fields["Account Number"],
+            "IFSC Code": text_fields["IFSC Code"],
+            "Branch": text_fields["Branch"],
+        }
+
+    # ================= TEXT SCAN =================
+    def _scan_text(self, text):
+        found = {field: "" for field, _ in LABEL_FIELDS + ID_FIELDS}
+
+        for field, regex in self._id_res:
+            m = regex.search(text)
+            if m:
+                found[field] = m.group()
+
+        folded = text.lower()
+        if len(folded) != len(text):
+            # Something lowercased to several chars ('İ'); offsets no longer line up
+            for field, regex in self._label_res:
+                m = regex.search(text)
+                if m:
+                    found[field] = m.group(1).split("\n")[0].strip()
+            return found
+
+        pending = list(self._label_res)
+        for hit in self._label_trigger.finditer(folded.translate(_FOLD)):
+            pos = hit.start()
+            for entry in pending[:]:
+                m = entry[1].match(text, pos)
+                if m:
+                    found[entry[0]] = m.group(1).split("\n")[0].strip()
+                    pending.remove(entry)
+            if not pending:
+                break
+
+        return found
+
+    # ================= ITEMS =================
+    def _extract_items(self, index):
+        """One dict per item row: line_no, description, hsn_sac, quantity, rate, amount."""
+        items = []
+
+        for l in index.lines:
+            # Item rows end in "dd.dd"; skip the backtracking regex otherwise
+            if l[-3:-2] == "." and self._item_re.search(l):
+                numbers = self._amount_re.findall(l)
+                amount = numbers[-1].replace(",", "") if numbers else None
+                hsn = self._hsn_re.search(l)
+                items.append({
+                    "line_no": len(items) + 1,
+                    "description": l,
+                    "hsn_sac": hsn.group(1) if hsn else "",
+                    "quantity": "1",
+                    "rate": amount,
+                    "amount": amount,
+                })
+
+        return items
+
+    # ================= HELPERS =================
+    def _find_amount(self, index, keyword):
+        for i in index.find(keyword):
+            m = self._amount_re.findall(index.lines[i])
+            if m:
+                return m[-1].replace(",", "")
+        return ""
+
+    def _find_percent(self, index, keyword):
+        for i in index.find(keyword):
+            l = index.lines[i]
+            if "%" in l:
+                m = self._percent_re.search(l)
+                if m:
+                    return m.group(1)
+        return ""
+
+    def _invoice_type(self, index):
+        i = index.first_upper(INVOICE_TYPES)
+        if i is None:
+            return ""
+        return next(k for k in INVOICE_TYPES if k in index.upper[i])
+
+    def _vendor_name(self, index):
+        i = index.first_upper(VENDOR_MARKERS)
+        return index.lines[i] if i is not None else ""
+
+    def _buyer_line(self, index):
+        hits = [i for i in (index.first(m) for m in BUYER_MARKERS) if i is not None]
+        return min(hits) if hits else None
+
+    def _buyer_gstin(self, index):
+        for l in index.lines:
+            if self._gst_re.search(l):
+                return l
+        return ""
@@ -0,0 +1,334 @@
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, wait
+from contextlib import contextmanager
+
+# ---------------- CONFIG ----------------
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# A running job whose lease is not renewed within LEASE_SECONDS belongs to a
+# dead process and is handed out again; owners renew every HEARTBEAT_SECONDS
+LEASE_SECONDS = 120.0
+HEARTBEAT_SECONDS = 30.0
+
+# Attempts per file (a crash mid-file counts); retry n waits
+# BACKOFF_SECONDS * 2 ** (n - 1)
+MAX_ATTEMPTS = 3
+BACKOFF_SECONDS = 30.0
+
+# Files kept in flight per worker process (claimed and submitted)
+CLAIM_PER_WORKER = 2
+
+Job = namedtuple("Job", ["id", "batch_id", "position", "path", "attempts"])
+
+
+def _owner_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class JobQueue:
+    """
+    Crash-safe batch queue, stored next to the invoices (same database).
+
+    Every file of a batch is a job: pending -> running (leased to one
+    process, kept alive by heartbeats) -> done, or back to pending with a
+    backoff after an error, until MAX_ATTEMPTS make it failed. A job is
+    marked done in the same transaction that stores its invoice, so after a
+    crash a batch resumes with exactly the files that were not finished.
+    """
+
+    def __init__(self, storage, max_attempts=MAX_ATTEMPTS, backoff=BACKOFF_SECONDS,
+                 lease=LEASE_SECONDS):
+        self.storage = storage
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.lease = lease
+        self.owner = _owner_id()
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            storage.db_path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._init_db()
+
+    def _init_db(self):
+        cur = self._conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS job_batches (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                label TEXT,
+                created_at REAL
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                batch_id INTEGER REFERENCES job_batches(id),
+                position INTEGER,
+                path TEXT,
+                state TEXT,
+                attempts INTEGER DEFAULT 0,
+                next_attempt REAL DEFAULT 0,
+                owner TEXT,
+                lease_expires REAL,
+                file_hash TEXT,
+                outcome TEXT,
+                error TEXT,
+                updated_at REAL
+            )
+        """)
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS idx_jobs_batch_state ON jobs(batch_id, state, next_attempt)"
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_jobs_owner ON jobs(owner, state)")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                yield cur
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+    # ---------------- BATCHES ----------------
+    def create_batch(self, files, label=None):
+        """Queues the files (in this order) as a new batch; returns its id."""
+        now = time.time()
+        with self._transaction() as cur:
+            cur.execute("INSERT INTO job_batches (label, created_at) VALUES (?, ?)", (label, now))
+            batch_id = cur.lastrowid
+            cur.executemany(
+                "INSERT INTO jobs (batch_id, position, path, state, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(batch_id, i, path, PENDING, now) for i, path in enumerate(files)]
+            )
+        return batch_id
+
+    def unfinished_batches(self):
+        """Batches with pending or running jobs, oldest first, with per-state counts."""
+        with self._lock:
+            rows = self._conn.execute(f"""
+                SELECT b.id, b.label, b.created_at, COUNT(*),
+                       SUM(j.state = '{DONE}'), SUM(j.state = '{FAILED}')
+                FROM job_batches b JOIN jobs j ON j.batch_id = b.id
+                GROUP BY b.id
+                HAVING SUM(j.state IN ('{PENDING}', '{RUNNING}')) > 0
+                ORDER BY b.id
+            """).fetchall()
+        return [
+            {"id": i, "label": label, "created_at": created, "total": total,
+             DONE: done, FAILED: failed, "remaining": total - done - failed}
+            for i, label, created, total, done, failed in rows
+        ]
+
+    def finished_jobs(self, batch_id):
+        """(position, path, state, outcome, file_hash, error) of the done and failed jobs."""
+        with self._lock:
+            return self._conn.execute(f"""
+                SELECT position, path, state, outcome, file_hash, error FROM jobs
+                WHERE batch_id = ? AND state IN ('{DONE}', '{FAILED}') ORDER BY position
+            """, (batch_id,)).fetchall()
+
+    def cancel_batch(self, batch_id):
+        """Fails every job of the batch that has not finished."""
+        with self._transaction() as cur:
+            cur.execute(f"""
+                UPDATE jobs SET state = '{FAILED}', error = 'cancelled', owner = NULL, updated_at = ?
+                WHERE batch_id = ? AND state IN ('{PENDING}', '{RUNNING}')
+            """, (time.time(), batch_id))
+
+    def fail_missing(self, batch_id):
+        """Fails the unfinished jobs whose file no longer exists; returns how many."""
+        with self._lock:
+            rows = self._conn.execute(f"""
+                SELECT id, path FROM jobs
+                WHERE batch_id = ? AND state IN ('{PENDING}', '{RUNNING}')
+            """, (batch_id,)).fetchall()
+        now = time.time()
+        missing = [(now, job_id) for job_id, path in rows if not os.path.exists(path)]
+        with self._transaction() as cur:
+            cur.executemany(f"""
+                UPDATE jobs SET state = '{FAILED}', error = 'file no longer exists',
+                    owner = NULL, updated_at = ?
+                WHERE id = ? AND state IN ('{PENDING}', '{RUNNING}')
+            """, missing)
+        return len(missing)
+
+    # ---------------- LEASES ----------------
+    def claim(self, batch_id, limit):
+        """
+        Leases up to `limit` runnable jobs of the batch to this queue's
+        owner: pending ones whose backoff is over, and running ones whose
+        lease expired. Expired jobs out of attempts are failed instead.
+        """
+        now = time.time()
+        with self._transaction() as cur:
+            cur.execute(f"""
+                UPDATE jobs SET state = '{FAILED}', owner = NULL, updated_at = ?,
+                    error = COALESCE(error, 'worker died while processing')
+                WHERE batch_id = ? AND state = '{RUNNING}' AND lease_expires < ? AND attempts >= ?
+            """, (now, batch_id, now, self.max_attempts))
+            rows = cur.execute(f"""
+                SELECT id, batch_id, position, path, attempts FROM jobs
+                WHERE batch_id = ? AND (
+                    (state = '{PENDING}' AND next_attempt <= ?)
+                    OR (state = '{RUNNING}' AND lease_expires < ?)
+                )
+                ORDER BY position LIMIT ?
+            """, (batch_id, now, now, limit)).fetchall()
+            cur.executemany(f"""
+                UPDATE jobs SET state = '{RUNNING}', owner = ?, lease_expires = ?,
+                    attempts = attempts + 1, updated_at = ?
+                WHERE id = ?
+            """, [(self.owner, now + self.lease, now, row[0]) for row in rows])
+        return [Job(i, b, pos, path, attempts + 1) for i, b, pos, path, attempts in rows]
+
+    def heartbeat(self):
+        """Renews the lease of every job this owner is running."""
+        now = time.time()
+        with self._transaction() as cur:
+            cur.execute(f"""
+                UPDATE jobs SET lease_expires = ?, updated_at = ?
+                WHERE owner = ? AND state = '{RUNNING}'
+            """, (now + self.lease, now, self.owner))
+
+    @contextmanager
+    def heartbeats(self, interval=None):
+        """
+        Renews this owner's leases from a background thread while open,
+        every HEARTBEAT_SECONDS (or a quarter of a shorter lease).
+        """
+        interval = interval or min(HEARTBEAT_SECONDS, self.lease / 4)
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(interval):
+                try:
+                    self.heartbeat()
+                except sqlite3.Error:
+                    pass   # next beat retries; the lease has room for a few misses
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def next_wake(self, batch_id):
+        """
+        Seconds until a job of the batch becomes claimable (0 if one is),
+        or None when nothing is left to run.
+        """
+        with self._lock:
+            row = self._conn.execute(f"""
+                SELECT MIN(CASE state WHEN '{PENDING}' THEN next_attempt ELSE lease_expires END)
+                FROM jobs WHERE batch_id = ? AND state IN ('{PENDING}', '{RUNNING}')
+            """, (batch_id,)).fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    # ---------------- RESULTS ----------------
+    def complete(self, job, data):
+        """
+        Stores the invoice and marks the job done in one transaction.
+        Returns the storage status (SAVED, DUPLICATE, NEAR_DUPLICATE), or
+        None if this attempt lost its lease - nothing is stored then, the
+        attempt that holds it now finishes the job.
+        """
+        def mark_done(cur, statuses):
+            cur.execute(f"""
+                UPDATE jobs SET state = '{DONE}', owner = NULL, file_hash = ?, outcome = ?,
+                    error = NULL, updated_at = ?
+                WHERE id = ? AND state = '{RUNNING}' AND owner = ? AND attempts = ?
+            """, (data["File Hash"], statuses[0], time.time(), job.id, self.owner, job.attempts))
+            if cur.rowcount == 0:
+                raise _LeaseLost()
+
+        try:
+            return self.storage.save_invoices(
+                [(data["Filename"], data["File Hash"], data)], on_commit=mark_done
+            )[0]
+        except _LeaseLost:
+            return None
+
+    def fail(self, job, error):
+        """
+        Records a failed attempt: back to pending after a backoff, or
+        failed for good once the job is out of attempts. Returns the new
+        state, or None if this attempt lost its lease.
+        """
+        now = time.time()
+        retry = job.attempts < self.max_attempts
+        with self._transaction() as cur:
+            cur.execute(f"""
+                UPDATE jobs SET state = ?, owner = NULL, error = ?, next_attempt = ?, updated_at = ?
+                WHERE id = ? AND state = '{RUNNING}' AND owner = ? AND attempts = ?
+            """, (
+                PENDING if retry else FAILED, error,
+                now + self.backoff * 2 ** (job.attempts - 1), now, job.id,
+                self.owner, job.attempts
+            ))
+            if cur.rowcount == 0:
+                return None
+        return PENDING if retry else FAILED
+
+    def drain(self, batch_id, engine, stop=None):
+        """
+        Runs the batch to the end on `engine` (a BatchEngine), waiting out
+        backoffs. About workers * CLAIM_PER_WORKER jobs are kept in flight:
+        a new one is claimed each time one finishes, so a slow file never
+        leaves the other workers idle. Yields (job, BatchResult, storage
+        status) for every job that finishes - status None for jobs that
+        failed for good; retried attempts, and attempts that lost their
+        lease, are not yielded. stop: a
+        threading.Event; no more jobs are claimed once it is set, and the
+        run ends when those in flight are done.
+        """
+        stop = stop or threading.Event()
+        target = max(1, engine.workers * CLAIM_PER_WORKER)
+        running = {}
+        with self.heartbeats():
+            while True:
+                if not stop.is_set() and len(running) < target:
+                    for job in self.claim(batch_id, target - len(running)):
+                        running[engine.submit(job.path, job.position)] = job
+                if not running:
+                    wake = None if stop.is_set() else self.next_wake(batch_id)
+                    if wake is None:
+                        return
+                    stop.wait(min(wake, HEARTBEAT_SECONDS) or 0.1)
+                    continue
+
+                # Wake up now and then to pick up jobs whose backoff ran out
+                done, _ = wait(running, timeout=HEARTBEAT_SECONDS, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    job = running.pop(fut)
+                    result = engine.result(fut, job.position, job.path)
+                    if result.status == "Processed":
+                        stored = self.complete(job, result.data)
+                        if stored is not None:
+                            yield job, result, stored
+                    elif self.fail(job, result.error) == FAILED:
+                        yield job, result, None
+
+
+class _LeaseLost(Exception):
+    pass
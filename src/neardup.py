@@ -0,0 +1,147 @@
+import re
+import zlib
+import hashlib
+from collections import namedtuple
+import numpy as np
+
+# ---------------- CONFIG ----------------
+# MinHash over character shingles of the raw OCR text. NUM_PERM = BANDS * ROWS;
+# with 16 bands of 8 rows, pairs at 0.8 similarity share a bucket ~95% of
+# the time (0.9: >99%) and pairs at 0.5 only ~6%. A re-scan with 1% of
+# characters misread scores ~0.9.
+SHINGLE_SIZE = 5
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+MIN_SIMILARITY = 0.8
+
+# Texts with fewer distinct shingles (blank or failed OCR) get no signature;
+# they would all look alike
+MIN_SHINGLES = 50
+
+# Stored signatures are only comparable under the same permutations:
+# changing the seed or NUM_PERM means re-running the backfill
+SEED = 20260101
+
+# Most candidates looked at per lookup; a template shared by many invoices
+# must not turn one save into a scan of the vendor's history
+CANDIDATE_LIMIT = 256
+
+# Shingles hashed per step: NUM_PERM x SIGNATURE_CHUNK uint64 is 4 MB, however
+# long the text
+SIGNATURE_CHUNK = 4096
+
+_rng = np.random.default_rng(SEED)
+# Multiply-shift hashing: (a * x + b) >> 32 with a odd, wrapping in uint64
+_A = _rng.integers(1, 2 ** 63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_B = _rng.integers(0, 2 ** 63, NUM_PERM, dtype=np.uint64)
+
+_NON_WORD = re.compile(r"[^0-9a-z]+")
+_KEY_JUNK = re.compile(r"[^0-9A-Z]")
+_MISSING = {"", "N/A", "NA", "UNKNOWN", "NONE"}
+
+# key: normalized (GSTIN, invoice number, total) or None; signature: uint32
+# MinHash or None; buckets: one LSH bucket id per band
+Fingerprint = namedtuple("Fingerprint", ["key", "signature", "buckets"])
+
+
+def invoice_key(vendor_gstin, invoice_number, grand_total):
+    """
+    'GSTIN|NUMBER|TOTAL' with separators, case and spacing removed and the
+    total in paise, or None if any part is missing.
+    """
+    gstin = _KEY_JUNK.sub("", str(vendor_gstin or "").upper())
+    number = _KEY_JUNK.sub("", str(invoice_number or "").upper())
+    if gstin in _MISSING or number in _MISSING or not grand_total:
+        return None
+    return f"{gstin}|{number}|{round(grand_total * 100)}"
+
+
+def signature(text):
+    """MinHash signature (NUM_PERM uint32) of the text, or None if too short."""
+    text = _NON_WORD.sub(" ", (text or "").lower()).strip()
+    shingles = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    x = np.fromiter((zlib.crc32(s.encode()) for s in shingles), np.uint64, len(shingles))
+    sig = np.full(NUM_PERM, np.iinfo(np.uint64).max, dtype=np.uint64)
+    for start in range(0, len(x), SIGNATURE_CHUNK):
+        chunk = x[None, start:start + SIGNATURE_CHUNK]
+        hashed = (_A[:, None] * chunk + _B[:, None]) >> np.uint64(32)
+        np.minimum(sig, hashed.min(axis=1), out=sig)
+    return sig.astype(np.uint32)
+
+
+def buckets(sig):
+    """LSH bucket ids (signed 64-bit, one per band) of a signature."""
+    if sig is None:
+        return []
+    return [
+        int.from_bytes(
+            hashlib.blake2b(bytes([band]) + sig[band * ROWS:(band + 1) * ROWS].tobytes(),
+                            digest_size=8).digest(),
+            "big", signed=True
+        )
+        for band in range(BANDS)
+    ]
+
+
+def fingerprint(vendor_gstin, invoice_number, grand_total, raw_text):
+    sig = signature(raw_text)
+    return Fingerprint(invoice_key(vendor_gstin, invoice_number, grand_total), sig, buckets(sig))
+
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of the texts behind two signatures."""
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+
+def to_blob(sig):
+    return sig.tobytes()
+
+
+def from_blob(blob):
+    return np.frombuffer(blob, dtype=np.uint32)
+
+
+def text_match(fp, other_key, other_sig):
+    """
+    Similarity if the texts match closely enough to be one invoice, else
+    None. Two invoices that both carry a key but different ones are never
+    a text match: same template, different invoice.
+    """
+    if fp.signature is None or other_sig is None:
+        return None
+    if fp.key and other_key and fp.key != other_key:
+        return None
+    score = similarity(fp.signature, other_sig)
+    return score if score >= MIN_SIMILARITY else None
+
+
+class BatchIndex:
+    """
+    In-memory counterpart of the stored index, for rows of one save batch.
+    match() returns {file_hash, match, similarity} like StorageEngine
+    find_duplicates (key match first, else the closest text match) or None.
+    """
+
+    def __init__(self):
+        self.keys = {}
+        self.by_bucket = {}
+
+    def add(self, fp, file_hash):
+        if fp.key:
+            self.keys.setdefault(fp.key, file_hash)
+        for bucket in fp.buckets:
+            self.by_bucket.setdefault(bucket, []).append((fp, file_hash))
+
+    def match(self, fp):
+        if fp.key and fp.key in self.keys:
+            return {"file_hash": self.keys[fp.key], "match": "key", "similarity": None}
+        best = None
+        candidates = {h: c for b in fp.buckets for c, h in self.by_bucket.get(b, ())}
+        for file_hash, c in candidates.items():
+            score = text_match(fp, c.key, c.signature)
+            if score is not None and (best is None or score > best["similarity"]):
+                best = {"file_hash": file_hash, "match": "text", "similarity": score}
+        return best
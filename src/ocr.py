@@ -0,0 +1,240 @@
+import time
+import threading
+import cv2
+import numpy as np
+import pytesseract
+
+from .utils import tool_path
+
+# ---------------- CONFIG ----------------
+# Unset: pytesseract runs `tesseract` from PATH, tesserocr uses its built-in tessdata
+if tool_path("tesseract_cmd"):
+    pytesseract.pytesseract.tesseract_cmd = tool_path("tesseract_cmd")
+TESSDATA_PATH = tool_path("tessdata_path")
+
+OCR_LANG = "eng"
+OCR_CONFIG = r"--oem 3 --psm 6"
+
+# PaddleOCR on CPU: larger images trip oneDNN errors
+CPU_MAX_SIDE = 2000
+
+
+def resize_for_cpu(img, max_side=CPU_MAX_SIDE):
+    h, w = img.shape[:2]
+    scale = min(max_side / h, max_side / w, 1.0)
+    if scale < 1.0:
+        img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    return img
+
+
+class OCRBackend:
+    """
+    Common interface of the OCR engines. The pipeline hands over preprocessed
+    page images (with the DPI they were rendered at) through recognize_batch;
+    `batched` backends get a whole page window per call, the others one page.
+
+    Every backend counts the pages it read and the time spent inside its
+    recognize calls; stats() reports pages/sec over that busy time (summed
+    across OCR threads).
+    """
+    name = None
+    batched = False
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self.pages = 0
+        self.seconds = 0.0
+
+    @classmethod
+    def from_profile(cls, profile):
+        """Build from a tuned OCR profile (config/ocr_profiles.yaml)."""
+        return cls()
+
+    def fingerprint(self):
+        """Everything about the backend that changes its output."""
+        return self.name
+
+    def recognize(self, img, dpi=None):
+        return self.recognize_batch([img], [dpi])[0]
+
+    def recognize_batch(self, images, dpis=None):
+        dpis = dpis or [None] * len(images)
+        start = time.perf_counter()
+        texts = self._recognize_batch(images, dpis)
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self.pages += len(images)
+            self.seconds += elapsed
+        return texts
+
+    def stats(self):
+        with self._stats_lock:
+            pages, seconds = self.pages, self.seconds
+        return {
+            "backend": self.name,
+            "pages": pages,
+            "seconds": round(seconds, 3),
+            "pages_per_sec": round(pages / seconds, 2) if seconds else 0.0,
+        }
+
+    def close(self):
+        pass
+
+    def _recognize_batch(self, images, dpis):
+        return [self._recognize(img, dpi) for img, dpi in zip(images, dpis)]
+
+    def _recognize(self, img, dpi):
+        raise NotImplementedError
+
+
+class PytesseractEngine(OCRBackend):
+    """
+    Shells out to the tesseract binary for every page (temp image on disk,
+    traineddata reloaded each call). Always available; the default.
+    """
+    name = "pytesseract"
+
+    def _recognize(self, gray, dpi):
+        config = OCR_CONFIG if not dpi else f"{OCR_CONFIG} --dpi {dpi}"
+        return pytesseract.image_to_string(gray, lang=OCR_LANG, config=config)
+
+
+class TesserocrEngine(OCRBackend):
+    """
+    Long-lived Tesseract via the C API (tesserocr). Each OCR thread gets its
+    own TessBaseAPI - the API is not thread safe - which is initialised once
+    and reused for every page that thread sees. Pages are passed as raw
+    grayscale buffers, so nothing is written to disk or re-parsed.
+    """
+    name = "tesserocr"
+
+    def __init__(self, path=TESSDATA_PATH, lang=OCR_LANG):
+        import tesserocr  # optional, see requirements.txt
+
+        super().__init__()
+        self._tesserocr = tesserocr
+        self.path = path
+        self.lang = lang
+        self._local = threading.local()
+        self._apis = []
+        self._lock = threading.Lock()
+
+    def _api(self):
+        api = getattr(self._local, "api", None)
+        if api is None:
+            # Same engine/layout as OCR_CONFIG: --oem 3 --psm 6
+            location = {"path": self.path} if self.path else {}
+            api = self._tesserocr.PyTessBaseAPI(
+                **location, lang=self.lang,
+                psm=self._tesserocr.PSM.SINGLE_BLOCK,
+                oem=self._tesserocr.OEM.DEFAULT
+            )
+            self._local.api = api
+            with self._lock:
+                self._apis.append(api)
+        return api
+
+    def _recognize(self, gray, dpi):
+        gray = np.ascontiguousarray(gray, dtype=np.uint8)
+        h, w = gray.shape[:2]
+        # Tuned profiles may hand over an RGB variant instead of a binary page
+        bpp = gray.shape[2] if gray.ndim == 3 else 1
+        api = self._api()
+        api.SetImageBytes(gray.tobytes(), w, h, bpp, w * bpp)
+        if dpi:
+            api.SetSourceResolution(dpi)
+        return api.GetUTF8Text()
+
+    def close(self):
+        with self._lock:
+            for api in self._apis:
+                api.End()
+            self._apis.clear()
+        self._local = threading.local()
+
+
+class PaddleEngine(OCRBackend):
+    """
+    PaddleOCR, loaded once per engine (so once per worker process) on first
+    use. Pages arrive a window at a time and go through a single predict()
+    call, which is where PaddleOCR's CPU throughput comes from. predict is
+    not thread safe, so OCR threads take turns on the model.
+    """
+    name = "paddleocr"
+    batched = True
+
+    def __init__(self, device=None, use_textline_orientation=False,
+                 text_det_thresh=None, text_det_box_thresh=None, lang="en"):
+        super().__init__()
+        if device is None:
+            device = "gpu" if cv2.cuda.getCudaEnabledDeviceCount() > 0 else "cpu"
+        self.device = device
+        self.use_textline_orientation = use_textline_orientation
+        self.text_det_thresh = text_det_thresh
+        self.text_det_box_thresh = text_det_box_thresh
+        self.lang = lang
+        self._ocr = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_profile(cls, profile):
+        keys = ("use_textline_orientation", "text_det_thresh", "text_det_box_thresh")
+        return cls(**{k: profile[k] for k in keys if k in profile})
+
+    def fingerprint(self):
+        return (
+            f"{self.name}:{self.lang}:{int(self.use_textline_orientation)}"
+            f":{self.text_det_thresh}:{self.text_det_box_thresh}"
+        )
+
+    def model(self):
+        if self._ocr is None:
+            from paddleocr import PaddleOCR  # optional, see requirements.txt
+
+            self._ocr = PaddleOCR(
+                device=self.device,
+                use_textline_orientation=self.use_textline_orientation,
+                lang=self.lang
+            )
+        return self._ocr
+
+    def recognize_batch(self, images, dpis=None):
+        # Model load is not OCR time
+        with self._lock:
+            self.model()
+        return super().recognize_batch(images, dpis)
+
+    def predict(self, images, text_det_thresh=None, text_det_box_thresh=None):
+        """One predict() over all images; returns one text per image."""
+        batch = []
+        for img in images:
+            img = np.asarray(img)
+            if img.ndim == 2:
+                img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+            if self.device == "cpu":
+                img = resize_for_cpu(img)
+            batch.append(img)
+
+        with self._lock:
+            results = self.model().predict(
+                input=batch,
+                text_det_thresh=text_det_thresh,
+                text_det_box_thresh=text_det_box_thresh
+            )
+        return ["\n".join(res["rec_texts"]) for res in results]
+
+    def _recognize_batch(self, images, dpis):
+        return self.predict(images, self.text_det_thresh, self.text_det_box_thresh)
+
+
+ENGINES = {
+    PytesseractEngine.name: PytesseractEngine,
+    TesserocrEngine.name: TesserocrEngine,
+    PaddleEngine.name: PaddleEngine,
+}
+
+
+def create_engine(name="pytesseract", profile=None):
+    if name not in ENGINES:
+        raise ValueError(f"Unknown OCR engine: {name}")
+    return ENGINES[name].from_profile(profile or {})
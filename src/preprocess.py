@@ -0,0 +1,131 @@
+from collections import namedtuple
+import cv2
+import numpy as np
+
+# ---------------- CONFIG ----------------
+# Fast path: a cheap low-DPI grayscale probe decides the crop box and the
+# DPI the page is rendered at for OCR
+PROBE_DPI = 100
+MIN_DPI = 150
+MAX_DPI = 400
+
+# Median glyph height (px) Tesseract is most comfortable with - roughly the
+# x-height of 10pt body text at 300 DPI
+TARGET_GLYPH_HEIGHT = 22
+
+INK_LEVEL = 200          # gray levels below this count as ink
+CROP_MARGIN = 0.02       # fraction of page size kept around the content
+
+# Adaptive threshold window is 31px at 300 DPI and scales with the DPI
+BLOCK_AT_300 = 31
+THRESH_C = 2
+
+# dpi for the OCR render; bbox as (x0, y0, x1, y1) fractions of the page
+PagePlan = namedtuple("PagePlan", ["dpi", "bbox"])
+
+
+def binarize_legacy(img):
+    """Original path: full RGB page, 31x31 Gaussian adaptive threshold."""
+    img = np.array(img)
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    return cv2.adaptiveThreshold(
+        gray, 255,
+        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY, BLOCK_AT_300, THRESH_C
+    )
+
+
+def content_bbox(gray):
+    """(x0, y0, x1, y1) in pixels around all ink, or None for a blank page."""
+    ink = gray < INK_LEVEL
+    rows = np.flatnonzero(ink.any(axis=1))
+    if not rows.size:
+        return None
+    cols = np.flatnonzero(ink.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+def glyph_height(gray):
+    """Median height of glyph-sized connected components, or None."""
+    ink = (gray < INK_LEVEL).astype(np.uint8)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    w = stats[1:, cv2.CC_STAT_WIDTH]
+    h = stats[1:, cv2.CC_STAT_HEIGHT]
+    # Drop specks, rules and table borders
+    glyphs = h[(h >= 3) & (h <= 0.1 * gray.shape[0]) & (w <= 3 * h)]
+    if not glyphs.size:
+        return None
+    return float(np.median(glyphs))
+
+
+def plan_page(probe, probe_dpi=PROBE_DPI):
+    """
+    probe: grayscale page rendered at probe_dpi.
+    Returns the PagePlan for the OCR render, or None if the page is blank.
+    """
+    box = content_bbox(probe)
+    if box is None:
+        return None
+
+    x0, y0, x1, y1 = box
+    height = glyph_height(probe[y0:y1, x0:x1])
+    if height:
+        dpi = probe_dpi * TARGET_GLYPH_HEIGHT / height
+        dpi = int(min(MAX_DPI, max(MIN_DPI, round(dpi / 25) * 25)))
+    else:
+        dpi = 300
+
+    ph, pw = probe.shape[:2]
+    bbox = (
+        max(0.0, x0 / pw - CROP_MARGIN), max(0.0, y0 / ph - CROP_MARGIN),
+        min(1.0, x1 / pw + CROP_MARGIN), min(1.0, y1 / ph + CROP_MARGIN),
+    )
+    return PagePlan(dpi, bbox)
+
+
+def crop_to_plan(gray, plan):
+    h, w = gray.shape[:2]
+    x0, y0, x1, y1 = plan.bbox
+    return gray[int(y0 * h):int(np.ceil(y1 * h)), int(x0 * w):int(np.ceil(x1 * w))]
+
+
+def binarize_fast(gray, dpi):
+    """
+    Mean adaptive threshold on an already-cropped grayscale region: a box
+    filter (constant cost per pixel) and one vectorized comparison, instead
+    of a 31x31 Gaussian over the full RGB page.
+    """
+    block = max(3, int(round(BLOCK_AT_300 * dpi / 300)) | 1)
+    mean = cv2.blur(gray, (block, block), borderType=cv2.BORDER_REPLICATE)
+    return np.where(
+        gray.astype(np.int16) > mean.astype(np.int16) - THRESH_C, 255, 0
+    ).astype(np.uint8)
+
+
+# ---------------- VARIANTS ----------------
+# Named preprocessing variants (from the PaddleOCR tuning grid). Each takes
+# an RGB page and returns an RGB or single-channel image.
+
+def _sharpen(gray):
+    kernel = np.array([[0, -1, 0], [-1, 5, -1], [0, -1, 0]])
+    return cv2.filter2D(gray, -1, kernel)
+
+
+VARIANTS = {
+    "original": lambda rgb, gray: rgb,
+    "grayscale": lambda rgb, gray: gray,
+    "adaptive_threshold": lambda rgb, gray: cv2.adaptiveThreshold(
+        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, BLOCK_AT_300, THRESH_C
+    ),
+    "gaussian_blur": lambda rgb, gray: cv2.GaussianBlur(gray, (5, 5), 0),
+    "bilateral_filter": lambda rgb, gray: cv2.bilateralFilter(gray, 9, 75, 75),
+    "clahe": lambda rgb, gray: cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(gray),
+    "median_blur": lambda rgb, gray: cv2.medianBlur(gray, 3),
+    "sharpen": lambda rgb, gray: _sharpen(gray),
+}
+
+
+def apply_variant(img, name):
+    rgb = np.asarray(img)
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    return VARIANTS[name](rgb, gray)
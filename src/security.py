@@ -1,25 +1,140 @@
 import hashlib
 import os
 import base64
+import threading
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
+from .utils import load_settings
+
+# ---------------- KEY DERIVATION ----------------
+KDF_PASSWORD = b"WilowLocalSecureKey"
+KDF_SALT = b'static_salt_change_in_prod'
+KDF_ITERATIONS = 480000
+
+# security.key_cache in settings.yaml:
+#   "process" - derive once per process (default)
+#   "session" - unlock_session() also exports the key through SESSION_ENV
+#               for child processes started afterwards (BatchEngine pools
+#               never need this: their workers get it through adopt_session)
+#   "keyring" - keep the derived key in the OS keyring (optional `keyring`
+#               package), so every later process and CLI run skips PBKDF2
+SESSION_ENV = "WILOW_SESSION_KEY"
+KEYRING_SERVICE = "WilowInvoice"
+
+_keys = {}
+_keys_lock = threading.Lock()
+
+
+def _key_cache_mode():
+    return load_settings().get("security", {}).get("key_cache", "process")
+
+
+def _params_tag(salt, iterations):
+    # Ties a session/keyring key to the KDF parameters it was derived with
+    return hashlib.sha256(salt + str(iterations).encode()).hexdigest()[:16]
+
+
+def _derive(password, salt, iterations):
+    kdf = PBKDF2HMAC(
+        algorithm=hashes.SHA256(),
+        length=32,
+        salt=salt,
+        iterations=iterations,
+    )
+    return base64.urlsafe_b64encode(kdf.derive(password))
+
+
+def _from_session(tag):
+    value = os.environ.get(SESSION_ENV, "")
+    session_tag, _, key = value.partition(":")
+    return key.encode() if session_tag == tag and key else None
+
+
+def _keyring():
+    try:
+        import keyring  # optional, see requirements.txt
+    except ImportError:
+        return None
+    return keyring
+
+
+def get_key(password=KDF_PASSWORD, salt=KDF_SALT, iterations=KDF_ITERATIONS):
+    """
+    Fernet key for the given KDF parameters, derived at most once per
+    process and shared by every SecurityManager. An unlocked session or the
+    OS keyring (see security.key_cache) can supply it without deriving.
+    """
+    cache_key = (password, salt, iterations)
+    with _keys_lock:
+        key = _keys.get(cache_key)
+        if key:
+            return key
+
+        tag = _params_tag(salt, iterations)
+        key = _from_session(tag)
+
+        mode = _key_cache_mode()
+        kr = _keyring() if mode == "keyring" and not key else None
+        if kr:
+            stored = kr.get_password(KEYRING_SERVICE, tag)
+            key = stored.encode() if stored else None
+
+        if not key:
+            key = _derive(password, salt, iterations)
+            if kr:
+                kr.set_password(KEYRING_SERVICE, tag, key.decode())
+
+        _keys[cache_key] = key
+        return key
+
+
+def unlock_session(export=None):
+    """
+    Derives the key now (once) so later SecurityManagers in this process
+    start instantly, and returns it as a session token for adopt_session()
+    in worker processes. export: also put the token in the environment for
+    every child process started afterwards (default: key_cache "session").
+    """
+    token = f"{_params_tag(KDF_SALT, KDF_ITERATIONS)}:{get_key().decode()}"
+    if export is None:
+        export = _key_cache_mode() == "session"
+    if export:
+        os.environ[SESSION_ENV] = token
+    return token
+
+
+def adopt_session(token):
+    """
+    Installs a key handed over by unlock_session() in another process, and
+    withdraws SESSION_ENV so this process's own children (tesseract,
+    poppler) don't inherit it.
+    """
+    os.environ.pop(SESSION_ENV, None)
+    tag, _, key = (token or "").partition(":")
+    if key and tag == _params_tag(KDF_SALT, KDF_ITERATIONS):
+        with _keys_lock:
+            _keys[(KDF_PASSWORD, KDF_SALT, KDF_ITERATIONS)] = key.encode()
+
+
+def lock_session():
+    """Forgets cached keys and withdraws the session key from the environment."""
+    os.environ.pop(SESSION_ENV, None)
+    with _keys_lock:
+        _keys.clear()
+
+
 class SecurityManager:
     def __init__(self):
-        self._key = self._generate_key() 
-        self._cipher = Fernet(self._key)
-
-    def _generate_key(self):
-        password = b"WilowLocalSecureKey"
-        salt = b'static_salt_change_in_prod' 
-        kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA256(),
-            length=32,
-            salt=salt,
-            iterations=480000,
-        )
-        return base64.urlsafe_b64encode(kdf.derive(password))
+        # The key is only needed on first encrypt/decrypt
+        self._cipher_obj = None
+
+    @property
+    def _cipher(self):
+        if self._cipher_obj is None:
+            self._cipher_obj = Fernet(get_key())
+        return self._cipher_obj
 
     def encrypt_data(self, data: str) -> bytes:
         if not data: return b""
@@ -32,6 +147,18 @@ class SecurityManager:
         except Exception:
             return "[DECRYPTION_FAILED]"
 
+    def encrypt_bytes(self, data: bytes) -> bytes:
+        if not data: return b""
+        return self._cipher.encrypt(data)
+
+    def decrypt_bytes(self, token: bytes):
+        """Plain bytes, or None if the token can't be decrypted."""
+        if not token: return b""
+        try:
+            return self._cipher.decrypt(token)
+        except Exception:
+            return None
+
     @staticmethod
     def get_file_hash(file_path):
         sha256 = hashlib.sha256()
@@ -44,4 +171,4 @@ class SecurityManager:
     def sanitize_input(text):
         if text and str(text).startswith(('=', '+', '-', '@')):
             return f"'{text}"
-        return text
\ No newline at end of file
+        return text
@@ -0,0 +1,345 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import tempfile
+from collections import deque
+from urllib.parse import urlsplit, parse_qs
+
+from .batch import BatchEngine
+from .storage import StorageEngine
+from .utils import load_settings, get_safe_path
+
+logger = logging.getLogger("WilowApp")
+
+# ---------------- CONFIG ----------------
+HOST = "127.0.0.1"
+PORT = 8765
+
+# Files accepted but not finished, per worker process; beyond that uploads
+# get 429 with the queue depth instead of piling up in memory
+QUEUE_PER_WORKER = 4
+
+# Sync requests wait this long, then get a job id to poll instead
+SYNC_TIMEOUT = 120.0
+RETRY_AFTER = 2
+
+# Finished async jobs are kept for JOB_TTL seconds (at most MAX_JOBS)
+JOB_TTL = 600.0
+MAX_JOBS = 10000
+
+LATENCY_WINDOW = 1000
+MAX_HEADER_BYTES = 16 * 1024
+# Rejected uploads are read off the socket in chunks this size and dropped
+DISCARD_CHUNK = 64 * 1024
+PDF_MAGIC = b"%PDF-"
+RAW_TEXT_KEY = "Raw OCR Text"
+
+STATUS_TEXT = {
+    200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found",
+    405: "Method Not Allowed", 411: "Length Required", 413: "Payload Too Large",
+    415: "Unsupported Media Type", 422: "Unprocessable Entity", 429: "Too Many Requests",
+    500: "Internal Server Error",
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ExtractionService:
+    """
+    Local HTTP front end for InvoicePipeline (stdlib asyncio, no web
+    framework). Uploads run on a bounded BatchEngine process pool.
+
+        POST /extract[?mode=async][&store=1][&raw=0][&filename=x.pdf]
+             body: the PDF bytes (Content-Length required)
+             sync (default): 200 with the field dict (422 if extraction
+             failed); past SYNC_TIMEOUT, 202 with a job id instead
+             async: 202 {"job": id} at once
+             429 + Retry-After when max_queue files are in flight,
+             before the body is read (with Expect: 100-continue, it is
+             never sent)
+        GET  /jobs/<id>   job status, and the result once done
+        GET  /metrics     queue depth, counters, latency percentiles
+        GET  /health
+    """
+
+    def __init__(self, workers=None, max_queue=None, db_name=None, max_file_mb=None):
+        settings = load_settings()
+        self.engine = BatchEngine(workers)
+        self.max_queue = max_queue or self.engine.workers * QUEUE_PER_WORKER
+        max_file_mb = max_file_mb or settings.get("security", {}).get("max_file_size_mb", 20)
+        self.max_bytes = int(max_file_mb * 1024 * 1024)
+        self.db_name = db_name or settings.get("storage", {}).get("db_name", "invoices.db")
+        self._storage = None
+
+        self.in_flight = 0
+        self.jobs = {}
+        self._tasks = set()
+        self.started = time.time()
+        self.counters = {"accepted": 0, "rejected": 0, "completed": 0, "failed": 0}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.stage_totals = {}
+
+    @property
+    def storage(self):
+        # Only opened if a request asks for store=1
+        if self._storage is None:
+            self._storage = StorageEngine(self.db_name)
+        return self._storage
+
+    async def start(self, host=HOST, port=PORT):
+        """Starts listening (port 0: any free port, see self.port) and returns the server."""
+        server = await asyncio.start_server(self._handle, host, port)
+        self.port = server.sockets[0].getsockname()[1]
+        logger.info(f"Serving on http://{host}:{self.port} ({self.engine.workers} workers, queue {self.max_queue})")
+        return server
+
+    async def serve(self, host=HOST, port=PORT):
+        server = await self.start(host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        self.engine.close()
+        if self._storage:
+            self._storage.close()
+
+    # ---------------- HTTP ----------------
+    async def _handle(self, reader, writer):
+        try:
+            method, target, headers = await self._read_head(reader)
+            status, payload, extra = await self._route(method, target, headers, reader, writer)
+        except HttpError as e:
+            status, payload, extra = e.status, {"error": str(e)}, {}
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        except Exception as e:
+            logger.error(f"Request failed: {e}")
+            status, payload, extra = 500, {"error": "internal error"}, {}
+
+        body = json.dumps(payload).encode()
+        head = [
+            f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+            "Content-Type: application/json",
+            f"Content-Length: {len(body)}",
+            "Connection: close",
+        ] + [f"{k}: {v}" for k, v in extra.items()]
+        try:
+            writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _read_head(self, reader):
+        try:
+            raw = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.LimitOverrunError:
+            raise HttpError(400, "headers too large")
+        if len(raw) > MAX_HEADER_BYTES:
+            raise HttpError(400, "headers too large")
+        lines = raw.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "bad request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        return method, target, headers
+
+    def _content_length(self, headers):
+        if "content-length" not in headers:
+            raise HttpError(411, "Content-Length required")
+        try:
+            length = int(headers["content-length"])
+        except ValueError:
+            raise HttpError(400, "bad Content-Length")
+        if length < 0:
+            raise HttpError(400, "bad Content-Length")
+        if length > self.max_bytes:
+            raise HttpError(413, f"file larger than {self.max_bytes} bytes")
+        return length
+
+    async def _read_body(self, reader, writer, headers, length):
+        if headers.get("expect", "").lower() == "100-continue":
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+            await writer.drain()
+        return await reader.readexactly(length)
+
+    async def _discard_body(self, reader, headers, length):
+        # A client waiting on 100-continue sends nothing; others get to
+        # finish sending (so they see the response) without us keeping it
+        if headers.get("expect", "").lower() == "100-continue":
+            return
+        while length > 0:
+            chunk = await reader.read(min(length, DISCARD_CHUNK))
+            if not chunk:
+                return
+            length -= len(chunk)
+
+    async def _route(self, method, target, headers, reader, writer):
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        path = url.path.rstrip("/")
+
+        if path == "/extract":
+            if method != "POST":
+                raise HttpError(405, "use POST")
+            return await self._extract(reader, writer, query, headers)
+        if method != "GET":
+            raise HttpError(405, "use GET")
+        if path == "/health":
+            return 200, {"status": "ok"}, {}
+        if path == "/metrics":
+            return 200, self.metrics(), {}
+        if path.startswith("/jobs/"):
+            job = self.jobs.get(path[len("/jobs/"):])
+            if not job:
+                raise HttpError(404, "unknown job")
+            return 200, self._job_view(job), {}
+        raise HttpError(404, "not found")
+
+    # ---------------- JOBS ----------------
+    async def _extract(self, reader, writer, query, headers):
+        length = self._content_length(headers)
+        # Checked before the body is read: a saturated server buffers nothing
+        if self.in_flight >= self.max_queue:
+            self.counters["rejected"] += 1
+            await self._discard_body(reader, headers, length)
+            return 429, {
+                "error": "busy", "queue_depth": self.in_flight, "capacity": self.max_queue
+            }, {"Retry-After": str(RETRY_AFTER)}
+        # The slot is taken while the body arrives, so concurrent uploads
+        # can't all pass the check above
+        self.in_flight += 1
+        try:
+            body = await self._read_body(reader, writer, headers, length)
+            if not body.startswith(PDF_MAGIC):
+                raise HttpError(415, "body is not a PDF")
+        except BaseException:
+            self.in_flight -= 1
+            raise
+
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "queued",
+            "filename": get_safe_path(query.get("filename") or headers.get("x-filename") or "upload.pdf"),
+            "store": query.get("store") == "1",
+            "raw": query.get("raw", "1") != "0",
+            "submitted": time.time(),
+            "finished": None,
+            "result": None,
+            "error": None,
+        }
+        self._prune_jobs()
+        self.jobs[job["id"]] = job
+        self.counters["accepted"] += 1
+        task = asyncio.ensure_future(self._run_job(job, body))
+        # The loop only holds weak references to tasks
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+        if query.get("mode") == "async":
+            return 202, {"job": job["id"], "queue_depth": self.in_flight}, {}
+        try:
+            await asyncio.wait_for(asyncio.shield(task), SYNC_TIMEOUT)
+        except asyncio.TimeoutError:
+            return 202, {"job": job["id"], "status": job["status"]}, {}
+        return (200 if job["status"] == "done" else 422), self._job_view(job), {}
+
+    async def _run_job(self, job, body):
+        start = time.perf_counter()
+        fd, path = tempfile.mkstemp(suffix=".pdf")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(body)
+            result = await asyncio.wrap_future(self.engine.submit(path))
+            if result.status != "Processed":
+                raise RuntimeError(result.error or "extraction failed")
+
+            data = dict(result.data, Filename=job["filename"])
+            if job["store"]:
+                statuses = await asyncio.to_thread(
+                    self.storage.save_invoices, [(data["Filename"], data["File Hash"], data)]
+                )
+                job["stored"] = statuses[0]
+            if not job["raw"]:
+                data.pop(RAW_TEXT_KEY, None)
+            job["result"] = data
+            job["status"] = "done"
+            self.counters["completed"] += 1
+            for stage, seconds in (result.timings or {}).items():
+                self.stage_totals[stage] = self.stage_totals.get(stage, 0.0) + seconds
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+            self.counters["failed"] += 1
+            logger.error(f"Job {job['id']} ({job['filename']}) failed: {e}")
+        finally:
+            os.remove(path)
+            self.in_flight -= 1
+            job["finished"] = time.time()
+            self.latencies.append(time.perf_counter() - start)
+
+    def _job_view(self, job):
+        view = {k: job[k] for k in ("id", "status", "filename", "submitted", "finished")}
+        if "stored" in job:
+            view["stored"] = job["stored"]
+        if job["status"] == "done":
+            view["result"] = job["result"]
+        elif job["status"] == "failed":
+            view["error"] = job["error"]
+        return view
+
+    def _prune_jobs(self):
+        cutoff = time.time() - JOB_TTL
+        for job_id, job in list(self.jobs.items()):
+            if job["finished"] and (job["finished"] < cutoff or len(self.jobs) >= MAX_JOBS):
+                del self.jobs[job_id]
+
+    # ---------------- METRICS ----------------
+    def metrics(self):
+        latencies = sorted(self.latencies)
+        done = self.counters["completed"]
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "workers": self.engine.workers,
+            "queue_depth": self.in_flight,
+            "capacity": self.max_queue,
+            **self.counters,
+            "latency_s": {
+                "count": len(latencies),
+                "mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+                "p50": _percentile(latencies, 0.50),
+                "p95": _percentile(latencies, 0.95),
+                "p99": _percentile(latencies, 0.99),
+            },
+            "stage_ms_per_file": {
+                stage: round(1000 * total / done, 1) for stage, total in self.stage_totals.items()
+            } if done else {},
+        }
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+
+
+def serve(host=HOST, port=PORT, **kwargs):
+    """Runs an ExtractionService until interrupted."""
+    asyncio.run(ExtractionService(**kwargs).serve(host, port))
@@ -0,0 +1,348 @@
+import os
+import json
+import time
+import uuid
+import random
+import shutil
+import socket
+import sqlite3
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from .security import SecurityManager
+from .storage import DUPLICATE
+
+logger = logging.getLogger("WilowApp")
+
+# ---------------- CONFIG ----------------
+# Queue directory (on a share every host mounts), one job per input PDF,
+# named by its SHA-256:
+#
+#   incoming/               enqueue's temp copies
+#   pending/<job>.<n>.pdf   waiting, n attempts so far
+#   leased/<job>.<n>.<owner>.pdf
+#                           claimed by rename; the mtime is the heartbeat
+#   results/<job>.json      encrypted field dict, waiting to be committed
+#   done/<job>              committed into the database
+#   failed/<job>.pdf + <job>.json (last error)
+STATES = ("incoming", "pending", "leased", "results", "done", "failed")
+
+# A lease whose file was not touched for LEASE_SECONDS is expired and put
+# back; holders touch it every HEARTBEAT_SECONDS (or a quarter of a shorter
+# lease). Leave room for clock skew between hosts.
+LEASE_SECONDS = 180.0
+HEARTBEAT_SECONDS = 30.0
+MAX_ATTEMPTS = 3
+
+# How often an idle worker looks for work (and reaps expired leases)
+IDLE_SECONDS = 2.0
+
+Lease = namedtuple("Lease", ["job", "attempt", "path"])
+
+
+def _owner_id():
+    # No dots: they separate the parts of a leased file name
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}".replace(".", "_")
+
+
+class SharedQueue:
+    """
+    Work sharing between hosts through a shared directory, no server.
+
+    Claims are atomic renames out of pending/ (exactly one host wins),
+    leases are kept alive by touching the leased file and expired ones are
+    renamed back by whoever notices. A host that lost its lease may still
+    finish; results are keyed by job, so that only rewrites the same file.
+    commit() moves results into a StorageEngine exactly once: each job is
+    recorded in shared_commits in the same transaction as its invoice.
+    """
+
+    def __init__(self, root, owner=None, lease=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.root = os.path.abspath(root)
+        self.owner = owner or _owner_id()
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.sec = SecurityManager()
+        for state in STATES:
+            os.makedirs(self._dir(state), exist_ok=True)
+
+    def _dir(self, state, name=""):
+        return os.path.join(self.root, state, name)
+
+    def _queued(self):
+        """Jobs waiting in or leased out of pending/, from one listing of each."""
+        return {
+            name.split(".", 1)[0]
+            for state in ("pending", "leased") for name in os.listdir(self._dir(state))
+        }
+
+    def _known(self, job, queued):
+        for state, name in (("done", job), ("results", f"{job}.json"), ("failed", f"{job}.pdf")):
+            if os.path.exists(self._dir(state, name)):
+                return True
+        return job in queued
+
+    # ---------------- PRODUCER ----------------
+    def enqueue(self, paths):
+        """
+        Copies PDFs into the queue; files already queued or done are
+        skipped. Returns the number added.
+        """
+        added = 0
+        queued = self._queued()
+        for path in paths:
+            job = SecurityManager.get_file_hash(path)
+            if self._known(job, queued):
+                continue
+            queued.add(job)
+            tmp = self._dir("incoming", f"{job}.{self.owner}.pdf")
+            shutil.copyfile(path, tmp)
+            # Remember the original name for the stored invoice
+            with open(tmp + ".name", "w", encoding="utf-8") as f:
+                f.write(os.path.basename(path))
+            os.replace(tmp + ".name", self._dir("pending", f"{job}.name"))
+            os.replace(tmp, self._dir("pending", f"{job}.0.pdf"))
+            added += 1
+        return added
+
+    # ---------------- LEASES ----------------
+    def claim(self, limit=1):
+        """Leases up to `limit` pending jobs to this owner."""
+        names = [n for n in os.listdir(self._dir("pending")) if n.endswith(".pdf")]
+        # Hosts start at different places instead of all fighting over the first file
+        random.shuffle(names)
+        leases = []
+        for name in names:
+            try:
+                job, attempts, _ = name.split(".")
+                attempt = int(attempts) + 1
+            except ValueError:
+                continue   # not a queue file
+            target = self._dir("leased", f"{job}.{attempt}.{self.owner}.pdf")
+            try:
+                os.rename(self._dir("pending", name), target)
+            except FileNotFoundError:
+                continue   # another host won it
+            if os.path.exists(self._dir("done", job)) or os.path.exists(self._dir("results", f"{job}.json")):
+                # Finished by a host whose lease had expired
+                os.remove(target)
+                continue
+            # A fresh mtime starts the lease
+            os.utime(target)
+            leases.append(Lease(job, attempt, target))
+            if len(leases) >= limit:
+                break
+        return leases
+
+    def heartbeat(self, leases):
+        """Renews leases; returns the ones this owner no longer holds."""
+        lost = []
+        for lease in leases:
+            try:
+                os.utime(lease.path)
+            except FileNotFoundError:
+                lost.append(lease)
+        return lost
+
+    def reap(self):
+        """Puts expired leases back to pending (or failed once out of attempts)."""
+        cutoff = time.time() - self.lease
+        reaped = 0
+        for name in os.listdir(self._dir("leased")):
+            path = self._dir("leased", name)
+            try:
+                if os.stat(path).st_mtime >= cutoff:
+                    continue
+                job, attempt, _, _ = name.split(".")
+                self._release(job, int(attempt), path, "lease expired (worker died)")
+                reaped += 1
+            except (FileNotFoundError, ValueError):
+                continue
+        return reaped
+
+    def _release(self, job, attempt, path, error):
+        if attempt >= self.max_attempts:
+            os.rename(path, self._dir("failed", f"{job}.pdf"))
+            self._write_json(self._dir("failed", f"{job}.json"), {"error": error, "attempts": attempt})
+        else:
+            os.rename(path, self._dir("pending", f"{job}.{attempt}.pdf"))
+
+    # ---------------- RESULTS ----------------
+    def complete(self, lease, data):
+        """Publishes the result of a leased job and drops the lease."""
+        name_path = self._dir("pending", f"{lease.job}.name")
+        if os.path.exists(name_path):
+            with open(name_path, encoding="utf-8") as f:
+                data = dict(data, Filename=f.read())
+        token = self.sec.encrypt_data(json.dumps(data))
+        tmp = self._dir("results", f"{lease.job}.{self.owner}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(token)
+        os.replace(tmp, self._dir("results", f"{lease.job}.json"))
+        try:
+            os.remove(lease.path)
+        except FileNotFoundError:
+            pass   # reaped meanwhile; the result stands either way
+
+    def fail(self, lease, error):
+        try:
+            self._release(lease.job, lease.attempt, lease.path, error)
+        except FileNotFoundError:
+            pass
+
+    def commit(self, storage):
+        """
+        Stores every published result in `storage`, each exactly once, and
+        marks its job done. Safe to run from several processes and to
+        re-run after a crash. Returns {storage status: count}.
+        """
+        conn = sqlite3.connect(storage.db_path, timeout=30)
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS shared_commits (
+                    job TEXT PRIMARY KEY,
+                    status TEXT,
+                    committed_at TEXT
+                )
+            """)
+            conn.commit()
+            counts = {}
+            for name in sorted(os.listdir(self._dir("results"))):
+                if not name.endswith(".json"):
+                    continue
+                job = name[:-len(".json")]
+                path = self._dir("results", name)
+                committed = conn.execute(
+                    "SELECT status FROM shared_commits WHERE job = ?", (job,)
+                ).fetchone()
+                status = committed[0] if committed else self._commit_one(storage, job, path)
+                if status is None:
+                    continue
+                if not committed:
+                    counts[status] = counts.get(status, 0) + 1
+                self._finish(job, path)
+            return counts
+        finally:
+            conn.close()
+
+    def _commit_one(self, storage, job, path):
+        try:
+            with open(path, "rb") as f:
+                data = json.loads(self.sec.decrypt_data(f.read()))
+        except (OSError, ValueError) as e:
+            logger.error(f"Unreadable result {path}: {e}")
+            return None
+
+        def record(cur, statuses):
+            cur.execute(
+                "INSERT OR IGNORE INTO shared_commits (job, status, committed_at) VALUES (?, ?, ?)",
+                (job, statuses[0], time.strftime("%Y-%m-%d %H:%M"))
+            )
+            if cur.rowcount == 0:
+                # Another committer got there first: let its transaction stand alone
+                raise _AlreadyCommitted()
+
+        try:
+            return storage.save_invoices(
+                [(data["Filename"], data["File Hash"], data)], on_commit=record
+            )[0]
+        except _AlreadyCommitted:
+            return DUPLICATE
+
+    def _finish(self, job, path):
+        open(self._dir("done", job), "w").close()
+        for leftover in (path, self._dir("pending", f"{job}.name")):
+            try:
+                os.remove(leftover)
+            except FileNotFoundError:
+                pass
+
+    def status(self):
+        """Job count per state."""
+        counts = {}
+        for state in STATES[1:]:
+            names = os.listdir(self._dir(state))
+            if state in ("pending", "leased", "failed"):
+                names = [n for n in names if n.endswith(".pdf")]
+            elif state == "results":
+                names = [n for n in names if n.endswith(".json")]
+            counts[state] = len(names)
+        return counts
+
+    def _write_json(self, path, payload):
+        tmp = f"{path}.{self.owner}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f)
+        os.replace(tmp, path)
+
+    # ---------------- WORKER ----------------
+    def work(self, engine, stop=None, idle_exit=None, storage=None):
+        """
+        Drains the queue on `engine` (an open BatchEngine) until stop is
+        set, or until it has been idle for idle_exit seconds. About
+        engine.workers jobs are leased at a time, and a new one is claimed
+        each time one finishes. With storage this node also commits
+        results as they come in. Once stop is set no more jobs are claimed
+        and the run ends when those in flight are done. Returns the number
+        of jobs this node processed.
+        """
+        stop = stop or threading.Event()
+        finished = threading.Event()
+        held = []
+        held_lock = threading.Lock()
+
+        def beat():
+            while not finished.wait(min(HEARTBEAT_SECONDS, self.lease / 4)):
+                with held_lock:
+                    current = list(held)
+                for lease in self.heartbeat(current):
+                    logger.warning(f"Lost lease on {lease.job}")
+
+        beater = threading.Thread(target=beat, daemon=True)
+        beater.start()
+        target = max(1, engine.workers)
+        running = {}
+        processed, idle_since = 0, time.monotonic()
+        try:
+            while True:
+                if not stop.is_set() and len(running) < target:
+                    self.reap()
+                    for lease in self.claim(target - len(running)):
+                        running[engine.submit(lease.path)] = lease
+                    with held_lock:
+                        held[:] = running.values()
+                if not running:
+                    if storage:
+                        self.commit(storage)
+                    if stop.is_set():
+                        break
+                    if idle_exit is not None and time.monotonic() - idle_since >= idle_exit:
+                        break
+                    stop.wait(IDLE_SECONDS)
+                    continue
+
+                # Wake up now and then to claim jobs other hosts put back
+                done, _ = wait(running, timeout=IDLE_SECONDS, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    lease = running.pop(fut)
+                    result = engine.result(fut, 0, lease.path)
+                    if result.status == "Processed":
+                        self.complete(lease, result.data)
+                    else:
+                        self.fail(lease, result.error)
+                    processed += 1
+                with held_lock:
+                    held[:] = running.values()
+                if done and storage:
+                    self.commit(storage)
+                idle_since = time.monotonic()
+        finally:
+            finished.set()
+            beater.join()
+        return processed
+
+
+class _AlreadyCommitted(Exception):
+    pass
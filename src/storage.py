@@ -1,11 +1,221 @@
 import os
+import csv
+import gzip
 import sqlite3
-import pandas as pd
 import json
+import re
+import threading
+import zstandard as zstd
 from datetime import datetime
+from .fields import split_items
+from .neardup import (
+    BatchIndex, Fingerprint, CANDIDATE_LIMIT,
+    buckets, fingerprint, from_blob, invoice_key, signature, text_match, to_blob
+)
 from .security import SecurityManager
 
+# Per-row results of save_invoices()
+SAVED = "saved"
+# Not stored: same file hash, or same (GSTIN, number, total) key as a stored
+# invoice (see neardup.py)
+DUPLICATE = "duplicate"
+# Stored, but the raw text closely matches another invoice; the row records
+# which one in duplicate_of / duplicate_similarity
+NEAR_DUPLICATE = "near_duplicate"
+STORED = (SAVED, NEAR_DUPLICATE)
+
+# SQLite caps bound parameters per statement (999 on older builds)
+HASH_LOOKUP_CHUNK = 500
+
+# Payloads are zstd-compressed before Fernet; rows written before that hold
+# plain JSON, told apart by the zstd frame magic
+ZSTD_LEVEL = 3
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+DECRYPTION_FAILED = "[DECRYPTION_FAILED]"
+
+# Kept out of json_data_enc and stored in invoice_raw_text / invoice_items
+RAW_TEXT_KEY = "Raw OCR Text"
+ITEMS_KEY = "Line Items"
+PAYLOAD_EXCLUDED = (RAW_TEXT_KEY, ITEMS_KEY)
+
+# Bumped with every entry added to _migrate (stored in PRAGMA user_version)
+SCHEMA_VERSION = 5
+
+# Typed copies of the free-form TEXT columns, filled on save; query() filters
+# and sorts on these
+SHADOW_COLUMNS = [
+    ("grand_total_num", "REAL", "parse_amount(grand_total)"),
+    ("cgst_num", "REAL", "parse_amount(cgst)"),
+    ("sgst_num", "REAL", "parse_amount(sgst)"),
+    ("invoice_date_iso", "TEXT", "parse_date_iso(invoice_date)"),
+]
+
+# Columns save_invoice() fills, and the key InvoicePipeline.process_invoice()
+# uses for each, so pipeline dicts can be stored as they are
+PIPELINE_KEYS = {
+    'invoice_number': 'Invoice No',
+    'invoice_date': 'Invoice Date',
+    'vendor_name': 'Vendor Name',
+    'vendor_gstin': 'Vendor GSTIN',
+    'buyer_name': 'Buyer Name',
+    'cgst': 'CGST Amount',
+    'sgst': 'SGST Amount',
+    'grand_total': 'Grand Total',
+    'currency': 'Currency',
+}
+
+INSERT_ITEM = """
+    INSERT INTO invoice_items (invoice_id, line_no, description, hsn_sac, quantity, rate, amount)
+    SELECT id, ?, ?, ?, ?, ?, ? FROM invoices WHERE file_hash = ?
+"""
+
+INSERT_INVOICE = """
+    INSERT INTO invoices (
+        file_hash, filename, upload_date,
+        invoice_number, invoice_date,
+        vendor_name, vendor_gstin,
+        buyer_name,
+        cgst, sgst, grand_total, currency,
+        json_data_enc, status,
+        grand_total_num, cgst_num, sgst_num, invoice_date_iso,
+        dedup_key
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+INSERT_SIGNATURE = """
+    INSERT OR IGNORE INTO invoice_minhash (invoice_id, signature)
+    SELECT id, ? FROM invoices WHERE file_hash = ?
+"""
+
+INSERT_BUCKET = """
+    INSERT OR IGNORE INTO invoice_lsh (bucket, keyed, invoice_id)
+    SELECT ?, ?, id FROM invoices WHERE file_hash = ?
+"""
+
+MARK_NEAR_DUPLICATE = """
+    UPDATE invoices SET duplicate_of = ?, duplicate_similarity = ? WHERE file_hash = ?
+"""
+
+# Rows per step when backfilling items and fingerprints of older invoices
+BACKFILL_CHUNK_ROWS = 1000
+
+# ---------------- QUERY ----------------
+QUERY_COLUMNS = [
+    "id", "filename", "upload_date",
+    "invoice_number", "invoice_date", "invoice_date_iso",
+    "vendor_name", "vendor_gstin", "buyer_name",
+    "cgst_num", "sgst_num", "grand_total_num", "currency", "status",
+    "duplicate_of", "duplicate_similarity",
+]
+
+# query() filter -> SQL condition (one bound parameter each)
+QUERY_FILTERS = {
+    "vendor_gstin": "vendor_gstin = ?",
+    "invoice_number": "invoice_number = ?",
+    "status": "status = ?",
+    "date_from": "invoice_date_iso >= ?",
+    "date_to": "invoice_date_iso <= ?",
+    "min_total": "grand_total_num >= ?",
+    "max_total": "grand_total_num <= ?",
+    "vendor_name_like": "vendor_name LIKE ?",
+    # Row id window, used by incremental exports
+    "after_id": "id > ?",
+    "max_id": "id <= ?",
+}
+
+ITEM_COLUMNS = ["invoice_id", "line_no", "description", "hsn_sac", "quantity", "rate", "amount"]
+
+# item_totals() group -> SQL expression
+ITEM_GROUPS = {
+    "hsn_sac": "invoice_items.hsn_sac",
+    "vendor_gstin": "invoices.vendor_gstin",
+    "month": "substr(invoices.invoice_date_iso, 1, 7)",
+    "invoice_id": "invoice_items.invoice_id",
+}
+
+QUERY_SORTS = {
+    "id": "id",
+    "invoice_date": "invoice_date_iso",
+    "grand_total": "grand_total_num",
+    "invoice_number": "invoice_number",
+    "vendor_name": "vendor_name",
+    "upload_date": "upload_date",
+}
+
+# ---------------- CSV EXPORT ----------------
+# Header -> column, in file order
+CSV_COLUMNS = [
+    ("Filename", "filename"),
+    ("Invoice No", "invoice_number"),
+    ("Invoice Date", "invoice_date"),
+    ("Vendor Name", "vendor_name"),
+    ("Vendor GSTIN", "vendor_gstin"),
+    ("Buyer Name", "buyer_name"),
+    ("CGST", "cgst"),
+    ("SGST", "sgst"),
+    ("Grand Total", "grand_total"),
+    ("Currency", "currency"),
+    ("Status", "status"),
+    ("Processed On", "upload_date"),
+]
+EXPORT_CHUNK_ROWS = 5000
+
+# First number in the text: the dot of a "Rs." prefix is not a decimal point
+_AMOUNT = re.compile(r"-?\d[\d,]*(?:\.\d+)?")
+_DATE_DMY = re.compile(r"(\d{1,2})[/\-.](\d{1,2})[/\-.](\d{4})")
+_DATE_ISO = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+
+
+def parse_amount(value):
+    """'1,20,000.00' / 'INR 450.5' / 'Rs. 500' -> float; None if there is no number."""
+    if value is None:
+        return None
+    m = _AMOUNT.search(str(value))
+    return float(m.group().replace(",", "")) if m else None
+
+
+def parse_date_iso(value):
+    """'12-01-2026' / '12/01/2026' (day first) -> '2026-01-12'; None otherwise."""
+    if not value:
+        return None
+    value = str(value)
+    m = _DATE_ISO.search(value)
+    if m:
+        y, mo, d = m.groups()
+    else:
+        m = _DATE_DMY.search(value)
+        if not m:
+            return None
+        d, mo, y = m.groups()
+    try:
+        return datetime(int(y), int(mo), int(d)).strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def _field(data, column, default):
+    if column in data:
+        return data[column]
+    value = data.get(PIPELINE_KEYS[column])
+    return value if value else default
+
+
 class StorageEngine:
+    """
+    Invoice store. One long-lived connection per engine in WAL mode with
+    synchronous=NORMAL: commits append to the WAL without an fsync each, and
+    readers never block the writer. Bulk saves go through save_invoices,
+    one transaction per batch.
+
+    Encrypted payloads are compressed first. The raw OCR text - most of the
+    bytes - lives in its own table and is only read on request.
+
+    Saves skip exact copies and invoices whose normalized (GSTIN, number,
+    total) key is already stored. Invoices whose raw text closely matches a
+    stored one (MinHash/LSH, see neardup.py) are stored and point at it
+    through duplicate_of.
+    """
+
     def __init__(self, db_name="invoices.db"):
         base_dir = os.path.dirname(os.path.abspath(__file__)) 
         project_root = os.path.dirname(base_dir)              
@@ -14,11 +224,17 @@ class StorageEngine:
         self.db_path = os.path.join(data_dir, db_name)
         
         self.sec = SecurityManager()
+        self._lock = threading.Lock()
+        # Autocommit mode: transactions are opened explicitly (BEGIN IMMEDIATE)
+        self._conn = sqlite3.connect(
+            self.db_path, timeout=30, check_same_thread=False, isolation_level=None
+        )
         self._init_db()
 
     def _init_db(self):
-        conn = sqlite3.connect(self.db_path)
-        cur = conn.cursor()
+        cur = self._conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
         
         cur.execute("""
             CREATE TABLE IF NOT EXISTS invoices (
@@ -42,69 +258,689 @@ class StorageEngine:
                 status TEXT
             )
         """)
-        conn.commit()
-        conn.close()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS invoice_raw_text (
+                invoice_id INTEGER PRIMARY KEY REFERENCES invoices(id),
+                raw_text_enc BLOB
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS invoice_items (
+                invoice_id INTEGER REFERENCES invoices(id),
+                line_no INTEGER,
+                description TEXT,
+                hsn_sac TEXT,
+                quantity REAL,
+                rate REAL,
+                amount REAL,
+                PRIMARY KEY (invoice_id, line_no)
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_items_hsn ON invoice_items(hsn_sac)")
+        # Near-duplicate index: MinHash signature per invoice, and one row per
+        # LSH band bucket. keyed (invoice has a dedup_key) is in the primary
+        # key so keyed lookups skip keyed candidates without reading them
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS invoice_minhash (
+                invoice_id INTEGER PRIMARY KEY REFERENCES invoices(id),
+                signature BLOB
+            )
+        """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS invoice_lsh (
+                bucket INTEGER,
+                keyed INTEGER,
+                invoice_id INTEGER REFERENCES invoices(id),
+                PRIMARY KEY (bucket, keyed, invoice_id)
+            ) WITHOUT ROWID
+        """)
+        # Incremental exports: highest invoice id already handed to each target
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS export_watermarks (
+                target TEXT PRIMARY KEY,
+                last_id INTEGER,
+                exported_at TEXT,
+                rows_exported INTEGER
+            )
+        """)
+        self._migrate(cur)
+
+    def _migrate(self, cur):
+        """Brings older databases up to SCHEMA_VERSION and backfills what it adds."""
+        version = cur.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+
+        self._conn.create_function("parse_amount", 1, parse_amount, deterministic=True)
+        self._conn.create_function("parse_date_iso", 1, parse_date_iso, deterministic=True)
+        self._conn.create_function("invoice_key", 3, invoice_key, deterministic=True)
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while this one waited for the lock
+            version = cur.execute("PRAGMA user_version").fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                cur.execute("COMMIT")
+                return
+
+            if version < 1:
+                existing = {row[1] for row in cur.execute("PRAGMA table_info(invoices)")}
+                for name, sql_type, _ in SHADOW_COLUMNS:
+                    if name not in existing:
+                        cur.execute(f"ALTER TABLE invoices ADD COLUMN {name} {sql_type}")
+                cur.execute("UPDATE invoices SET " + ", ".join(
+                    f"{name} = {expr}" for name, _, expr in SHADOW_COLUMNS
+                ))
+                # GSTIN first: "this vendor, this quarter" is a single range scan
+                cur.execute("""
+                    CREATE INDEX IF NOT EXISTS idx_invoices_gstin_date
+                    ON invoices(vendor_gstin, invoice_date_iso)
+                """)
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_invoices_number ON invoices(invoice_number)")
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_invoices_date ON invoices(invoice_date_iso)")
+
+            if version < 2:
+                self._backfill_items(cur)
+
+            if version < 3:
+                existing = {row[1] for row in cur.execute("PRAGMA table_info(invoices)")}
+                if "dedup_key" not in existing:
+                    cur.execute("ALTER TABLE invoices ADD COLUMN dedup_key TEXT")
+                cur.execute("CREATE INDEX IF NOT EXISTS idx_invoices_dedup_key ON invoices(dedup_key)")
+                self._backfill_fingerprints(cur)
+
+            if version < 4:
+                existing = {row[1] for row in cur.execute("PRAGMA table_info(invoices)")}
+                for name, sql_type in (("duplicate_of", "INTEGER"), ("duplicate_similarity", "REAL")):
+                    if name not in existing:
+                        cur.execute(f"ALTER TABLE invoices ADD COLUMN {name} {sql_type}")
+
+            if version < 5:
+                # Typed columns and keys filled by the old parse_amount, which
+                # read "Rs. 500" as 0.5
+                cur.execute("UPDATE invoices SET " + ", ".join(
+                    f"{name} = {expr}" for name, _, expr in SHADOW_COLUMNS
+                ))
+                cur.execute("""
+                    UPDATE invoices
+                    SET dedup_key = invoice_key(vendor_gstin, invoice_number, grand_total_num)
+                """)
+
+            cur.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            cur.execute("COMMIT")
+        except Exception:
+            cur.execute("ROLLBACK")
+            raise
+
+    def _backfill_items(self, cur):
+        # Items of rows saved before invoice_items existed live in their
+        # payload (with the raw text, on old rows); walk by id so only one
+        # chunk of payloads is in memory at a time
+        last_id = 0
+        while True:
+            rows = cur.execute("""
+                SELECT id, file_hash, json_data_enc FROM invoices
+                WHERE id > ? AND NOT EXISTS (
+                    SELECT 1 FROM invoice_items WHERE invoice_items.invoice_id = invoices.id
+                )
+                ORDER BY id LIMIT ?
+            """, (last_id, BACKFILL_CHUNK_ROWS)).fetchall()
+            if not rows:
+                break
+            for _, file_hash, payload_enc in rows:
+                payload = self._unpack(payload_enc)
+                if payload and payload != DECRYPTION_FAILED:
+                    cur.executemany(INSERT_ITEM, self._item_rows(file_hash, json.loads(payload)))
+            last_id = rows[-1][0]
+
+    def _backfill_fingerprints(self, cur):
+        # Walk by id so the raw texts are never all in memory at once
+        last_id = 0
+        while True:
+            rows = cur.execute("""
+                SELECT invoices.id, file_hash, vendor_gstin, invoice_number, grand_total_num,
+                       raw_text_enc, json_data_enc
+                FROM invoices
+                LEFT JOIN invoice_raw_text ON invoice_raw_text.invoice_id = invoices.id
+                WHERE invoices.id > ? ORDER BY invoices.id LIMIT ?
+            """, (last_id, BACKFILL_CHUNK_ROWS)).fetchall()
+            if not rows:
+                break
+            for invoice_id, file_hash, gstin, number, total, raw_enc, payload_enc in rows:
+                if raw_enc:
+                    raw = self._unpack(raw_enc)
+                else:
+                    # Rows saved before the split still carry the text inline
+                    payload = self._unpack(payload_enc)
+                    raw = json.loads(payload).get(RAW_TEXT_KEY) \
+                        if payload and payload != DECRYPTION_FAILED else None
+                if raw == DECRYPTION_FAILED:
+                    raw = None
+                fp = fingerprint(gstin, number, total, raw)
+                cur.execute("UPDATE invoices SET dedup_key = ? WHERE id = ?", (fp.key, invoice_id))
+                signatures, bucket_rows = self._fingerprint_rows(file_hash, fp)
+                cur.executemany(INSERT_SIGNATURE, signatures)
+                cur.executemany(INSERT_BUCKET, bucket_rows)
+            last_id = rows[-1][0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
 
     def save_invoice(self, filename, file_hash, data):
-        json_enc = self.sec.encrypt_data(json.dumps(data))
-        
-        conn = sqlite3.connect(self.db_path)
-        cur = conn.cursor()
+        """Single-row save; False if the invoice is already stored (hash or key)."""
+        return self.save_invoices([(filename, file_hash, data)])[0] in STORED
+
+    def save_invoices(self, items, on_commit=None):
+        """
+        items: (filename, file_hash, data) tuples.
+        Inserts every new invoice in one transaction and returns a status per
+        item, in order: SAVED; DUPLICATE (not stored) when the hash or the
+        invoice key is already stored or appeared earlier in the same batch;
+        NEAR_DUPLICATE (stored, with duplicate_of set) when only the raw text
+        matches another invoice (see find_duplicates).
+
+        on_commit(cursor, statuses) runs inside that transaction just before
+        COMMIT, so bookkeeping in the same database (the job queue) commits
+        or rolls back together with the invoices.
+        """
+        items = list(items)
+        # Compress + encrypt + MinHash before taking the write lock; they
+        # dominate the cost
+        rows, raw_texts, item_rows, fingerprints = [], [], [], []
+        for filename, file_hash, data in items:
+            row = self._row(filename, file_hash, data)
+            sig = signature(data.get(RAW_TEXT_KEY))
+            rows.append(row)
+            raw_texts.append(self._pack(data.get(RAW_TEXT_KEY) or ""))
+            item_rows.append(self._item_rows(file_hash, data))
+            # The row ends with its dedup_key
+            fingerprints.append(Fingerprint(row[-1], sig, buckets(sig)))
+        statuses = []
+
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                seen = self._existing_hashes(cur, {row[0] for row in rows})
+                batch = BatchIndex()
+                new_rows, new_raw, new_items, new_sigs, new_buckets = [], [], [], [], []
+                near = []
+                for row, raw_enc, invoice_items, fp in zip(rows, raw_texts, item_rows, fingerprints):
+                    if row[0] in seen:
+                        statuses.append(DUPLICATE)
+                        continue
+                    matches = self._matches(cur, fp, first_only=True)
+                    in_batch = batch.match(fp)
+                    if in_batch:
+                        matches.insert(0, in_batch)
+                    # A key match wins over a text match
+                    match = min(matches, key=lambda m: m["match"] != "key", default=None)
+                    if match and match["match"] == "key":
+                        statuses.append(DUPLICATE)
+                        continue
+                    if match:
+                        near.append((match, row[0]))
+                        statuses.append(NEAR_DUPLICATE)
+                    else:
+                        statuses.append(SAVED)
+                    seen.add(row[0])
+                    batch.add(fp, row[0])
+                    new_rows.append(row)
+                    new_raw.append((raw_enc, row[0]))
+                    new_items.extend(invoice_items)
+                    signatures, bucket_rows = self._fingerprint_rows(row[0], fp)
+                    new_sigs.extend(signatures)
+                    new_buckets.extend(bucket_rows)
+                cur.executemany(INSERT_INVOICE, new_rows)
+                # In-batch matches only have an id once inserted
+                cur.executemany(MARK_NEAR_DUPLICATE, [
+                    (match.get("id") or self._id_of(cur, match["file_hash"]),
+                     match["similarity"], file_hash)
+                    for match, file_hash in near
+                ])
+                cur.executemany("""
+                    INSERT INTO invoice_raw_text (invoice_id, raw_text_enc)
+                    SELECT id, ? FROM invoices WHERE file_hash = ?
+                """, new_raw)
+                cur.executemany(INSERT_ITEM, new_items)
+                cur.executemany(INSERT_SIGNATURE, new_sigs)
+                cur.executemany(INSERT_BUCKET, new_buckets)
+                if on_commit:
+                    on_commit(cur, statuses)
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+        return statuses
+
+    def find_duplicates(self, data):
+        """
+        Stored invoices that are the same invoice as `data` (a pipeline dict
+        with its raw OCR text), found through indexes only:
+
+        - "key": same normalized (vendor GSTIN, invoice number, grand total)
+        - "text": raw text MinHash similarity >= neardup.MIN_SIMILARITY,
+          unless both invoices have a key and the keys differ
+
+        Returns dicts {id, filename, match, similarity}, key matches first.
+        """
+        total = parse_amount(_field(data, 'grand_total', '0'))
+        fp = fingerprint(
+            _field(data, 'vendor_gstin', 'N/A'), _field(data, 'invoice_number', 'N/A'),
+            total, data.get(RAW_TEXT_KEY)
+        )
+        with self._lock:
+            return self._matches(self._conn.cursor(), fp)
+
+    def _matches(self, cur, fp, first_only=False):
+        found = []
+        if fp.key:
+            cur.execute(
+                "SELECT id, filename FROM invoices WHERE dedup_key = ? LIMIT ?",
+                (fp.key, 1 if first_only else CANDIDATE_LIMIT)
+            )
+            found = [
+                {"id": i, "filename": name, "match": "key", "similarity": None}
+                for i, name in cur.fetchall()
+            ]
+            if found and first_only:
+                return found
+        if not fp.buckets:
+            return found
+
+        # A keyed invoice can only text-match unkeyed ones (text_match)
+        marks = ",".join("?" * len(fp.buckets))
+        keyed = " AND invoice_lsh.keyed = 0" if fp.key else ""
+        cur.execute(f"""
+            SELECT invoices.id, invoices.filename, invoices.dedup_key, invoice_minhash.signature
+            FROM invoices JOIN invoice_minhash ON invoice_minhash.invoice_id = invoices.id
+            WHERE invoices.id IN (
+                SELECT DISTINCT invoice_id FROM invoice_lsh
+                WHERE bucket IN ({marks}){keyed} LIMIT ?
+            )
+        """, [*fp.buckets, CANDIDATE_LIMIT])
+        text = []
+        for invoice_id, name, key, blob in cur.fetchall():
+            score = text_match(fp, key, from_blob(blob))
+            if score is not None:
+                text.append({"id": invoice_id, "filename": name, "match": "text", "similarity": score})
+                if first_only:
+                    break
+        return found + sorted(text, key=lambda m: -m["similarity"])
+
+    def _fingerprint_rows(self, file_hash, fp):
+        """INSERT_SIGNATURE and INSERT_BUCKET parameters of one invoice."""
+        if fp.signature is None:
+            return [], []
+        keyed = 1 if fp.key else 0
+        return (
+            [(to_blob(fp.signature), file_hash)],
+            [(bucket, keyed, file_hash) for bucket in fp.buckets]
+        )
+
+    def _id_of(self, cur, file_hash):
+        return cur.execute("SELECT id FROM invoices WHERE file_hash = ?", (file_hash,)).fetchone()[0]
+
+    def find_by_hash(self, file_hash):
+        """Id of the invoice stored for this file hash, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM invoices WHERE file_hash = ?", (file_hash,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def known_hashes(self, hashes):
+        """The subset of the given file hashes that is already stored."""
+        with self._lock:
+            return self._existing_hashes(self._conn.cursor(), hashes)
+
+    def _existing_hashes(self, cur, hashes):
+        hashes = list(hashes)
+        found = set()
+        for i in range(0, len(hashes), HASH_LOOKUP_CHUNK):
+            chunk = hashes[i:i + HASH_LOOKUP_CHUNK]
+            marks = ",".join("?" * len(chunk))
+            cur.execute(f"SELECT file_hash FROM invoices WHERE file_hash IN ({marks})", chunk)
+            found.update(h for (h,) in cur.fetchall())
+        return found
+
+    def _row(self, filename, file_hash, data):
+        invoice_date = _field(data, 'invoice_date', 'N/A')
+        cgst = str(_field(data, 'cgst', '0'))
+        sgst = str(_field(data, 'sgst', '0'))
+        grand_total = str(_field(data, 'grand_total', '0'))
+        grand_total_num = parse_amount(grand_total)
+        vendor_gstin = _field(data, 'vendor_gstin', 'N/A')
+        invoice_number = _field(data, 'invoice_number', 'N/A')
+        return (
+            file_hash, 
+            filename, 
+            datetime.now().strftime("%Y-%m-%d %H:%M"),
+            invoice_number,
+            invoice_date,
+            _field(data, 'vendor_name', 'Unknown'),
+            vendor_gstin,
+            _field(data, 'buyer_name', 'Unknown'),
+            cgst,
+            sgst,
+            grand_total,
+            _field(data, 'currency', 'INR'),
+            self._pack(json.dumps({k: v for k, v in data.items() if k not in PAYLOAD_EXCLUDED})),
+            "PROCESSED",
+            grand_total_num,
+            parse_amount(cgst),
+            parse_amount(sgst),
+            parse_date_iso(invoice_date),
+            invoice_key(vendor_gstin, invoice_number, grand_total_num)
+        )
+
+    def _item_rows(self, file_hash, data):
+        return [
+            (
+                int(item["line_no"]), item["description"], item["hsn_sac"] or None,
+                parse_amount(item["quantity"]), parse_amount(item["rate"]),
+                parse_amount(item["amount"]), file_hash
+            )
+            for item in split_items(data)
+        ]
+
+    # ---------------- QUERIES ----------------
+    def query(self, order_by="invoice_date", descending=False, limit=100, offset=0, **filters):
+        """
+        Header rows (no decryption) matching all given filters, as dicts.
+
+        filters: vendor_gstin, invoice_number, status, vendor_name_like
+        (SQL LIKE pattern), date_from / date_to (ISO 'YYYY-MM-DD', date or
+        datetime, inclusive), min_total / max_total (grand total).
+        order_by: one of QUERY_SORTS; ties break on id so pages are stable.
+        limit=None returns every match.
+        """
+        if order_by not in QUERY_SORTS:
+            raise ValueError(f"Cannot sort by: {order_by}")
+        where, params = self._where(filters)
+        direction = "DESC" if descending else "ASC"
+        sql = (
+            f"SELECT {', '.join(QUERY_COLUMNS)} FROM invoices{where} "
+            f"ORDER BY {QUERY_SORTS[order_by]} {direction}, id {direction}"
+        )
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [int(limit), int(offset)]
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(zip(QUERY_COLUMNS, row)) for row in rows]
+
+    def count(self, **filters):
+        """Number of invoices query() would page through for these filters."""
+        where, params = self._where(filters)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM invoices{where}", params).fetchone()[0]
+
+    def get_items(self, invoice_id):
+        """Line items of one invoice as dicts, in line order."""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(ITEM_COLUMNS)} FROM invoice_items "
+                "WHERE invoice_id = ? ORDER BY line_no", (invoice_id,)
+            ).fetchall()
+        return [dict(zip(ITEM_COLUMNS, row)) for row in rows]
+
+    def item_totals(self, group_by="hsn_sac", hsn_sac=None, limit=None, **filters):
+        """
+        Line items aggregated in SQL: one dict per group (see ITEM_GROUPS)
+        with item count, summed quantity and summed amount, largest amount
+        first. hsn_sac narrows to one code; filters (same as query()) apply
+        to the invoices the items belong to.
+
+            storage.item_totals(hsn_sac="7308")  # total spend on HSN 7308
+        """
+        if group_by not in ITEM_GROUPS:
+            raise ValueError(f"Cannot group items by: {group_by}")
+        where, params = self._where(filters)
+        if hsn_sac is not None:
+            where += (" AND " if where else " WHERE ") + "invoice_items.hsn_sac = ?"
+            params.append(hsn_sac)
+        sql = f"""
+            SELECT {ITEM_GROUPS[group_by]}, COUNT(*), SUM(quantity), SUM(amount)
+            FROM invoice_items JOIN invoices ON invoices.id = invoice_items.invoice_id
+            {where}
+            GROUP BY 1 ORDER BY 4 DESC
+        """
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [
+            {group_by: key, "items": n, "quantity": qty, "amount": amount}
+            for key, n, qty, amount in rows
+        ]
+
+    def _where(self, filters):
+        clauses, params = [], []
+        for name, value in filters.items():
+            if name not in QUERY_FILTERS:
+                raise ValueError(f"Unknown filter: {name}")
+            if value is None:
+                continue
+            if name in ("date_from", "date_to") and not isinstance(value, str):
+                value = value.strftime("%Y-%m-%d")
+            clauses.append(QUERY_FILTERS[name])
+            params.append(value)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    # ---------------- PAYLOADS ----------------
+    def _pack(self, text):
+        if not text:
+            return b""
+        return self.sec.encrypt_bytes(zstd.ZstdCompressor(level=ZSTD_LEVEL).compress(text.encode()))
+
+    def _unpack(self, token):
+        data = self.sec.decrypt_bytes(token)
+        if data is None:
+            return DECRYPTION_FAILED
+        if data.startswith(ZSTD_MAGIC):
+            data = zstd.ZstdDecompressor().decompress(data)
+        return data.decode()
+
+    def get_invoice(self, invoice_id, include_raw=False):
+        """
+        The stored field dict of one invoice, or None. The raw OCR text is
+        only fetched and decrypted with include_raw.
+        """
+        data = self._load_payload(invoice_id)
+        if data is None:
+            return None
+        # Rows saved before the split still carry the text inline
+        legacy_raw = data.pop(RAW_TEXT_KEY, None)
+        if include_raw:
+            raw = legacy_raw if legacy_raw is not None else self._load_raw_text(invoice_id)
+            data[RAW_TEXT_KEY] = raw or ""
+        return data
+
+    def get_raw_text(self, invoice_id):
+        """Raw OCR text of one invoice, or None if the invoice doesn't exist."""
+        raw = self._load_raw_text(invoice_id)
+        if raw is not None:
+            return raw
+        data = self._load_payload(invoice_id)
+        return None if data is None else data.get(RAW_TEXT_KEY, "")
+
+    def _load_payload(self, invoice_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT json_data_enc FROM invoices WHERE id = ?", (invoice_id,)
+            ).fetchone()
+        if not row:
+            return None
+        payload = self._unpack(row[0])
+        if payload == DECRYPTION_FAILED:
+            return None
+        return json.loads(payload) if payload else {}
+
+    def _load_raw_text(self, invoice_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT raw_text_enc FROM invoice_raw_text WHERE invoice_id = ?", (invoice_id,)
+            ).fetchone()
+        return self._unpack(row[0]) if row else None
+
+    def iter_invoices(self, include_raw=False, chunk_size=EXPORT_CHUNK_ROWS, with_ids=False,
+                      **filters):
+        """
+        Decrypted field dicts of matching invoices in id order, read
+        chunk_size rows at a time (same filters as query()). The raw OCR
+        text is only fetched and decrypted with include_raw. with_ids
+        yields (invoice_id, dict) pairs instead.
+        """
+        where, params = self._where(filters)
+        conn = sqlite3.connect(self.db_path, timeout=30)
         try:
-            cur.execute("""
-                INSERT INTO invoices (
-                    file_hash, filename, upload_date,
-                    invoice_number, invoice_date,
-                    vendor_name, vendor_gstin,
-                    buyer_name,
-                    cgst, sgst, grand_total, currency,
-                    json_data_enc, status
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                file_hash, 
-                filename, 
-                datetime.now().strftime("%Y-%m-%d %H:%M"),
-                data.get('invoice_number', 'N/A'),
-                data.get('invoice_date', 'N/A'),
-                data.get('vendor_name', 'Unknown'),
-                data.get('vendor_gstin', 'N/A'),
-                data.get('buyer_name', 'Unknown'),
-                str(data.get('cgst', '0')),
-                str(data.get('sgst', '0')),
-                str(data.get('grand_total', '0')),
-                data.get('currency', 'INR'),
-                json_enc,
-                "PROCESSED"
-            ))
-            conn.commit()
-            return True
-        except sqlite3.IntegrityError:
-            return False 
+            if include_raw:
+                sql = f"""
+                    SELECT invoices.id, json_data_enc, raw_text_enc FROM invoices
+                    LEFT JOIN invoice_raw_text ON invoice_raw_text.invoice_id = invoices.id
+                    {where} ORDER BY invoices.id
+                """
+            else:
+                sql = f"SELECT id, json_data_enc, NULL FROM invoices{where} ORDER BY id"
+            cur = conn.execute(sql, params)
+
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for invoice_id, payload_enc, raw_enc in rows:
+                    payload = self._unpack(payload_enc)
+                    if payload == DECRYPTION_FAILED:
+                        continue
+                    data = json.loads(payload) if payload else {}
+                    legacy_raw = data.pop(RAW_TEXT_KEY, None)
+                    if include_raw:
+                        raw = self._unpack(raw_enc) if raw_enc else None
+                        data[RAW_TEXT_KEY] = raw if raw is not None else (legacy_raw or "")
+                    yield (invoice_id, data) if with_ids else data
         finally:
             conn.close()
 
-    def export_to_csv(self, output_path):
-        conn = sqlite3.connect(self.db_path)
-        df = pd.read_sql_query("""
-            SELECT 
-                filename as 'Filename',
-                invoice_number as 'Invoice No',
-                invoice_date as 'Invoice Date',
-                vendor_name as 'Vendor Name',
-                vendor_gstin as 'Vendor GSTIN',
-                buyer_name as 'Buyer Name',
-                cgst as 'CGST',
-                sgst as 'SGST',
-                grand_total as 'Grand Total',
-                currency as 'Currency',
-                status as 'Status',
-                upload_date as 'Processed On'
-            FROM invoices
-        """, conn)
-        conn.close()
-        
-        if df.empty:
-            return 0
-        
-        df.to_csv(output_path, index=False)
-        return len(df)
\ No newline at end of file
+    # ---------------- WATERMARKS ----------------
+    def max_id(self):
+        with self._lock:
+            return self._conn.execute("SELECT MAX(id) FROM invoices").fetchone()[0] or 0
+
+    def get_watermark(self, target):
+        """Last invoice id exported to target (0 if never exported)."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT last_id FROM export_watermarks WHERE target = ?", (target,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def set_watermark(self, target, last_id, rows_exported):
+        with self._lock:
+            self._conn.execute("""
+                INSERT OR REPLACE INTO export_watermarks (target, last_id, exported_at, rows_exported)
+                VALUES (?, ?, ?, ?)
+            """, (target, last_id, datetime.now().strftime("%Y-%m-%d %H:%M"), rows_exported))
+
+    def reset_watermark(self, target):
+        """The next incremental export to target starts from the first invoice."""
+        with self._lock:
+            self._conn.execute("DELETE FROM export_watermarks WHERE target = ?", (target,))
+
+    def iter_header_chunks(self, chunk_size=EXPORT_CHUNK_ROWS, **filters):
+        """QUERY_COLUMNS tuples of matching invoices in id order, chunk_size per list."""
+        where, params = self._where(filters)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            cur = conn.execute(
+                f"SELECT {', '.join(QUERY_COLUMNS)} FROM invoices{where} ORDER BY id", params
+            )
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
+    def iter_item_chunks(self, chunk_size=EXPORT_CHUNK_ROWS, **filters):
+        """ITEM_COLUMNS tuples of the items of matching invoices, chunk_size per list."""
+        where, params = self._where(filters)
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            cur = conn.execute(f"""
+                SELECT {', '.join('invoice_items.' + c for c in ITEM_COLUMNS)}
+                FROM invoice_items JOIN invoices ON invoices.id = invoice_items.invoice_id
+                {where} ORDER BY invoice_items.invoice_id, invoice_items.line_no
+            """, params)
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            conn.close()
+
+    def export_to_csv(self, output_path, columns=None, compress=None, progress=None,
+                      chunk_size=EXPORT_CHUNK_ROWS, append=False, **filters):
+        """
+        Streams matching invoices into a CSV file, chunk_size rows at a time,
+        so memory stays flat whatever the table size.
+
+        columns: headers from CSV_COLUMNS to write (default: all, in order).
+        compress: gzip the file; defaults to output_path ending in ".gz".
+        progress: called as progress(rows_written, total_rows) per chunk.
+        append: add rows to an existing file (same columns) without a
+        second header line; gzip files get a new gzip member.
+        filters: same as query().
+        Returns the number of rows written; nothing is written for 0 rows.
+        """
+        available = dict(CSV_COLUMNS)
+        columns = list(columns or available)
+        unknown = [c for c in columns if c not in available]
+        if unknown:
+            raise ValueError(f"Unknown export columns: {unknown}")
+        if compress is None:
+            compress = output_path.lower().endswith(".gz")
+
+        where, params = self._where(filters)
+        select = ", ".join(available[c] for c in columns)
+
+        # Own connection: a WAL reader sees one snapshot and never blocks saves
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            total = None
+            if progress:
+                total = conn.execute(f"SELECT COUNT(*) FROM invoices{where}", params).fetchone()[0]
+            cur = conn.execute(f"SELECT {select} FROM invoices{where} ORDER BY id", params)
+
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                return 0
+
+            opener = gzip.open if compress else open
+            has_header = append and os.path.exists(output_path) and os.path.getsize(output_path) > 0
+            if has_header:
+                with opener(output_path, "rt", newline="", encoding="utf-8") as f:
+                    existing = next(csv.reader(f), [])
+                if existing != columns:
+                    raise ValueError(f"Cannot append: {output_path} has columns {existing}")
+
+            written = 0
+            with opener(output_path, "at" if append else "wt", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                if not has_header:
+                    writer.writerow(columns)
+                while rows:
+                    writer.writerows(rows)
+                    written += len(rows)
+                    if progress:
+                        progress(written, total)
+                    rows = cur.fetchmany(chunk_size)
+            return written
+        finally:
+            conn.close()
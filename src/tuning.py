@@ -0,0 +1,241 @@
+"""
+PaddleOCR autotuner.
+
+Searches DPI x preprocessing variant x textline orientation x detection
+thresholds for each document class and writes the winner per class to
+config/ocr_profiles.yaml; InvoicePipeline(doc_class=...) picks its class up
+through utils.load_ocr_profile.
+
+    python -m src.tuning samples/            # one sub-folder per document class
+
+- every sample page is rendered once per DPI and each preprocessing
+  variant is cached on disk (data/tuning_cache), so re-runs skip both
+- combos are scored on a process pool; each worker keeps one PaddleEngine
+  (src/ocr.py) per model config, only varies the predict-time thresholds
+  and reads a rung's pages in one batched predict call
+- successive halving: all combos see the first page, only the best third
+  go on to twice as many pages, and so on
+"""
+
+import os
+import re
+import sys
+import glob
+import math
+import warnings
+import itertools
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+import yaml
+from pdf2image import convert_from_path
+
+from .core import POPPLER_PATH
+from .ocr import PaddleEngine, resize_for_cpu
+from .preprocess import VARIANTS, apply_variant
+from .security import SecurityManager
+
+# ================= CONFIG =================
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROFILE_PATH = os.path.join(BASE_DIR, "config", "ocr_profiles.yaml")
+CACHE_DIR = os.path.join(BASE_DIR, "data", "tuning_cache")
+
+DPI_OPTIONS = [200, 300, 400]
+TEXTLINE_OPTIONS = [True, False]
+TEXT_DET_THRESH_OPTIONS = [0.3, 0.5, 0.7]
+BOX_THRESH_OPTIONS = [0.3, 0.5, 0.7]
+
+# Fraction of combos that survive each halving rung
+KEEP_FRACTION = 1 / 3
+
+# Same "valid text" heuristic paddleocrbestpick.py scores with
+VALID_CHARS = re.compile(r"[a-zA-Z0-9\s.,%$-]")
+
+Combo = namedtuple("Combo", [
+    "dpi", "preprocess", "use_textline_orientation",
+    "text_det_thresh", "text_det_box_thresh"
+])
+
+
+def score_text(text):
+    num_valid = len(VALID_CHARS.findall(text))
+    return len(text.split()) + num_valid - (len(text) - num_valid)
+
+
+# ================= RENDER CACHE =================
+
+def _variant_path(cache_dir, file_hash, page_no, dpi, variant):
+    return os.path.join(cache_dir, f"{file_hash}_p{page_no}_d{dpi}_{variant}.npy")
+
+
+def render_samples(pdf_paths, cache_dir=CACHE_DIR, device="cpu"):
+    """
+    Renders each PDF once per DPI and stores every preprocessing variant
+    of every page as .npy. Returns the sample pages as (file_hash, page_no),
+    interleaved across documents so early rungs see several of them.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    per_doc = []
+
+    for pdf in pdf_paths:
+        file_hash = SecurityManager.get_file_hash(pdf)
+        page_count = None
+        for dpi in DPI_OPTIONS:
+            marker = _variant_path(cache_dir, file_hash, 1, dpi, "original")
+            if os.path.exists(marker):
+                if page_count is None:
+                    page_count = len(glob.glob(_variant_path(cache_dir, file_hash, "*", dpi, "original")))
+                continue
+
+            pages = convert_from_path(pdf, dpi=dpi, poppler_path=POPPLER_PATH, use_pdftocairo=True)
+            page_count = len(pages)
+            for page_no, page in enumerate(pages, 1):
+                for variant in VARIANTS:
+                    img = apply_variant(page, variant)
+                    if device == "cpu":
+                        img = resize_for_cpu(img)
+                    np.save(_variant_path(cache_dir, file_hash, page_no, dpi, variant), img)
+            del pages
+
+        per_doc.append([(file_hash, n) for n in range(1, (page_count or 0) + 1)])
+
+    samples = []
+    for group in itertools.zip_longest(*per_doc):
+        samples.extend(s for s in group if s)
+    return samples
+
+# ================= WORKER PROCESS =================
+
+_engines = {}
+
+
+def _engine(use_textline_orientation, device):
+    key = (use_textline_orientation, device)
+    if key not in _engines:
+        _engines[key] = PaddleEngine(device, use_textline_orientation)
+    return _engines[key]
+
+
+def _evaluate(combo, image_paths, device):
+    engine = _engine(combo.use_textline_orientation, device)
+    images = [np.load(path) for path in image_paths]
+    thresholds = (combo.text_det_thresh, combo.text_det_box_thresh)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        try:
+            texts = engine.predict(images, *thresholds)
+        except Exception:
+            # Score what can be read; a page that fails on its own adds nothing
+            texts = []
+            for img in images:
+                try:
+                    texts.extend(engine.predict([img], *thresholds))
+                except Exception:
+                    continue
+    return sum(score_text(t) for t in texts)
+
+# ================= SEARCH =================
+
+def all_combos():
+    return [
+        Combo(*c) for c in itertools.product(
+            DPI_OPTIONS, VARIANTS, TEXTLINE_OPTIONS,
+            TEXT_DET_THRESH_OPTIONS, BOX_THRESH_OPTIONS
+        )
+    ]
+
+
+def tune_class(pdf_paths, pool, device="cpu", cache_dir=CACHE_DIR, log=print):
+    """Successive halving over the sample pages; returns (best Combo, mean score/page)."""
+    samples = render_samples(pdf_paths, cache_dir, device)
+    if not samples:
+        return None, 0.0
+
+    alive = all_combos()
+    scores = {c: 0.0 for c in alive}
+    seen, rung_size = 0, 1
+
+    while True:
+        batch = samples[seen:seen + rung_size]
+        futures = {
+            pool.submit(
+                _evaluate, c,
+                [_variant_path(cache_dir, h, n, c.dpi, c.preprocess) for h, n in batch],
+                device
+            ): c
+            for c in alive
+        }
+        for fut, c in futures.items():
+            scores[c] += fut.result()
+        seen += len(batch)
+        log(f"  rung: {len(alive)} combos x {seen} page(s)")
+
+        if seen >= len(samples) or len(alive) == 1:
+            break
+        alive.sort(key=scores.get, reverse=True)
+        alive = alive[:max(1, math.ceil(len(alive) * KEEP_FRACTION))]
+        rung_size *= 2
+
+    best = max(alive, key=scores.get)
+    return best, scores[best] / seen
+
+
+def tune(classes, workers=None, device=None, profile_path=PROFILE_PATH, log=print):
+    """
+    classes: {class_name: [pdf paths]}. Writes the best combo per class to
+    profile_path (other classes already in the file are kept).
+    """
+    if device is None:
+        device = "gpu" if cv2.cuda.getCudaEnabledDeviceCount() > 0 else "cpu"
+    workers = workers or max(1, (os.cpu_count() or 2) // 2)
+
+    profiles = {}
+    if os.path.exists(profile_path):
+        with open(profile_path, "r") as f:
+            profiles = yaml.safe_load(f) or {}
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for doc_class, pdfs in classes.items():
+            log(f"Tuning '{doc_class}' on {len(pdfs)} document(s), device={device}")
+            best, score = tune_class(pdfs, pool, device, log=log)
+            if best is None:
+                continue
+            profiles[doc_class] = {
+                "engine": "paddleocr",
+                "dpi": best.dpi,
+                "preprocess": best.preprocess,
+                "use_textline_orientation": best.use_textline_orientation,
+                "text_det_thresh": best.text_det_thresh,
+                "text_det_box_thresh": best.text_det_box_thresh,
+                "score": round(score, 1),
+            }
+            log(f"  best: {profiles[doc_class]}")
+
+    with open(profile_path, "w") as f:
+        yaml.safe_dump(profiles, f, sort_keys=False)
+    return profiles
+
+
+def classes_from_dir(root):
+    """Sub-folders are document classes; PDFs directly in root are 'default'."""
+    classes = {}
+    loose = sorted(glob.glob(os.path.join(root, "*.pdf")))
+    if loose:
+        classes["default"] = loose
+    for entry in sorted(os.listdir(root)):
+        pdfs = sorted(glob.glob(os.path.join(root, entry, "*.pdf")))
+        if pdfs:
+            classes[entry] = pdfs
+    return classes
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("usage: python -m src.tuning <samples_dir> [workers]")
+    tune(
+        classes_from_dir(sys.argv[1]),
+        workers=int(sys.argv[2]) if len(sys.argv) > 2 else None
+    )
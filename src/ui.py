@@ -1,20 +1,28 @@
 import os
 import logging
+import threading
 from PySide6.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
     QPushButton, QFileDialog, QTableWidget,
     QTableWidgetItem, QLabel, QHeaderView, QProgressBar,
-    QFrame, QGraphicsDropShadowEffect, QAbstractItemView
+    QFrame, QGraphicsDropShadowEffect, QAbstractItemView, QMessageBox
 )
 from PySide6.QtCore import Qt, QThread, Signal, QTimer, QPropertyAnimation, QPoint, QEasingCurve
 from PySide6.QtGui import QColor
 
-from src.core import InvoicePipeline, export_to_excel
+from src.core import export_to_excel
+from .batch import BatchEngine
+from .jobs import JobQueue, FAILED
 from .security import SecurityManager
-from .utils import setup_logger
+from .storage import StorageEngine, SAVED
+from .utils import setup_logger, load_settings
 
 logger = setup_logger()
 
+# How long closing the window blocks on a running batch before it stays
+# open until the files already claimed are finished
+CLOSE_WAIT_MS = 3000
+
 # ---------------- ASSETS ----------------
 
 class AssetManager:
@@ -107,26 +115,61 @@ class Toast(QLabel):
 # ---------------- WORKER ----------------
 
 class Worker(QThread):
-    progress = Signal(dict, str)
+    """
+    Runs a batch through the persistent JobQueue: files=... queues a new
+    batch, batch_id=... resumes one. Only finished files are reported.
+    """
+    # (original file index, row data, status) - emitted in completion order
+    progress = Signal(int, dict, str)
+    # The batch stopped on an error (e.g. the database stayed locked)
+    failed = Signal(str)
     finished = Signal()
 
-    def __init__(self, files):
+    def __init__(self, files=None, batch_id=None):
         super().__init__()
         self.files = files
-        self.pipeline = InvoicePipeline()
+        self.batch_id = batch_id
+        self.engine = BatchEngine()
+        self.stop_event = threading.Event()
 
     def run(self):
-        for path in self.files:
-            try:
-                data = self.pipeline.process_invoice(path)
-                self.progress.emit(data, "Processed")
-            except Exception as e:
-                logger.error(f"Failed {path}: {e}")
-                self.progress.emit(
-                    {"Filename": os.path.basename(path), "Vendor Name": "N/A"},
-                    "Error"
-                )
-        self.finished.emit()
+        storage = queue = None
+        try:
+            storage = open_storage()
+            queue = JobQueue(storage)
+            if self.batch_id is None:
+                self.batch_id = queue.create_batch(self.files)
+            with self.engine:
+                for job, result, stored in queue.drain(self.batch_id, self.engine, self.stop_event):
+                    self.progress.emit(job.position, result.data, badge_status(stored))
+        except Exception as e:
+            logger.error(f"Batch stopped: {e}")
+            self.failed.emit(str(e))
+        finally:
+            if queue:
+                queue.close()
+            if storage:
+                storage.close()
+            self.finished.emit()
+
+
+def open_storage():
+    return StorageEngine(load_settings().get("storage", {}).get("db_name", "invoices.db"))
+
+
+def badge_status(stored):
+    """StatusBadge type for a JobQueue storage status (None: failed)."""
+    if stored is None:
+        return "Error"
+    # Near duplicates are stored but flagged like exact ones
+    return "Processed" if stored == SAVED else "Duplicate"
+
+
+def stored_row(storage, path, file_hash):
+    """Table/export row of a file finished before a restart."""
+    invoice_id = storage.find_by_hash(file_hash) if file_hash else None
+    data = storage.get_invoice(invoice_id) if invoice_id else None
+    return dict(data or {"Vendor Name": "N/A"}, Filename=os.path.basename(path))
 
 # ---------------- MAIN WINDOW ----------------
 
@@ -137,6 +180,7 @@ class MainWindow(QMainWindow):
         self.resize(1100, 750)
 
         self.extracted_rows = []
+        self._close_when_done = False
 
         style_content = AssetManager.load_stylesheet()
         if style_content:
@@ -144,6 +188,8 @@ class MainWindow(QMainWindow):
 
         self._setup_ui()
         self._connect_signals()
+        # A batch cut short by a crash or a closed window can pick up where it stopped
+        QTimer.singleShot(0, self.resume_unfinished)
 
     def _setup_ui(self):
         root = QWidget()
@@ -255,22 +301,95 @@ class MainWindow(QMainWindow):
         )
         if not files:
             return
+        self._start_worker(Worker(files), len(files))
+
+    def resume_unfinished(self):
+        storage = open_storage()
+        queue = JobQueue(storage)
+        try:
+            batches = queue.unfinished_batches()
+            if not batches:
+                return
+            batch = batches[0]
+            # Files moved or deleted since would only be retried until they fail
+            missing = queue.fail_missing(batch["id"])
+            remaining = batch["remaining"] - missing
+            if remaining <= 0:
+                return
+            if not self._confirm_resume(batch, remaining, missing):
+                return
+            done = [
+                (position, stored_row(storage, path, file_hash),
+                 badge_status(None if state == FAILED else outcome))
+                for position, path, state, outcome, file_hash, _ in queue.finished_jobs(batch["id"])
+            ]
+        finally:
+            queue.close()
+            storage.close()
+
+        self._start_worker(Worker(batch_id=batch["id"]), batch["total"])
+        for row in done:
+            self.handle_progress(*row)
+        self.show_toast(f"Resuming {remaining} unfinished invoices.", "info")
+
+    def _confirm_resume(self, batch, remaining, missing):
+        """Asks before resuming; Discard fails the rest of the batch for good."""
+        box = QMessageBox(self)
+        box.setWindowTitle("Unfinished batch")
+        box.setIcon(QMessageBox.Question)
+        text = f"{remaining} of {batch['total']} invoices from an earlier batch were not processed."
+        if missing:
+            text += f" {missing} more no longer exist and were skipped."
+        box.setText(text)
+        resume = box.addButton("Resume", QMessageBox.AcceptRole)
+        discard = box.addButton("Discard", QMessageBox.DestructiveRole)
+        box.addButton("Later", QMessageBox.RejectRole)
+        box.setDefaultButton(resume)
+        box.exec()
+
+        if box.clickedButton() is discard:
+            storage = open_storage()
+            queue = JobQueue(storage)
+            try:
+                queue.cancel_batch(batch["id"])
+            finally:
+                queue.close()
+                storage.close()
+        return box.clickedButton() is resume
 
+    def _start_worker(self, worker, total):
         self.extracted_rows.clear()
         self.table.setRowCount(0)
 
         self.progress_bar.setVisible(True)
-        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(0)
         self.update_status_pill("Processing invoices...", "working")
         self.btn_upload.setEnabled(False)
         self.btn_export.setEnabled(False)
 
-        self.worker = Worker(files)
+        self.worker = worker
+        self._worker_error = None
         self.worker.progress.connect(self.handle_progress)
+        self.worker.failed.connect(self.handle_failed)
         self.worker.finished.connect(self.handle_finished)
         self.worker.start()
 
-    def handle_progress(self, data, status):
+    def closeEvent(self, event):
+        # Stop claiming files; whatever is unfinished resumes on next start
+        worker = getattr(self, "worker", None)
+        if worker and worker.isRunning():
+            worker.stop_event.set()
+            if not worker.wait(CLOSE_WAIT_MS):
+                # Files already claimed finish first; handle_finished closes
+                self._close_when_done = True
+                self.update_status_pill("Finishing current files...", "working")
+                self.show_toast("Closing once the current files are done.", "info")
+                event.ignore()
+                return
+        super().closeEvent(event)
+
+    def handle_progress(self, index, data, status):
         row = self.table.rowCount()
         self.table.insertRow(row)
 
@@ -281,10 +400,25 @@ class MainWindow(QMainWindow):
         self.table.setItem(row, 1, QTableWidgetItem(vendor))
         self.table.setCellWidget(row, 2, StatusBadge(status, status))
 
-        self.extracted_rows.append(data)
+        self.extracted_rows.append((index, data))
+        self.progress_bar.setValue(len(self.extracted_rows))
         self.table.scrollToBottom()
 
+    def handle_failed(self, message):
+        self._worker_error = message
+        self.show_toast(f"Batch stopped: {message}", "error")
+
     def handle_finished(self):
+        if self._close_when_done:
+            self.close()
+            return
+        if self._worker_error:
+            # Unfinished files stay queued and are offered again on next start
+            self.progress_bar.setVisible(False)
+            self.update_status_pill("Processing stopped", "error")
+            self.btn_upload.setEnabled(True)
+            self.btn_export.setEnabled(bool(self.extracted_rows))
+            return
         self.progress_bar.setVisible(False)
         self.update_status_pill("Processing complete", "success")
         self.btn_upload.setEnabled(True)
@@ -303,7 +437,9 @@ class MainWindow(QMainWindow):
             return
 
         try:
-            export_to_excel(self.extracted_rows, path)
+            # Results arrive out of order; export in the order files were picked
+            rows = [data for _, data in sorted(self.extracted_rows, key=lambda r: r[0])]
+            export_to_excel(rows, path)
             self.show_toast("Excel exported successfully.", "success")
         except Exception as e:
             logger.error(f"Export failed: {e}")
@@ -1,6 +1,7 @@
 import logging
 import os
 import sys
+import yaml
 from logging.handlers import RotatingFileHandler
 
 def setup_logger(name="WilowApp", log_file="app.log"):
@@ -27,6 +28,43 @@ def setup_logger(name="WilowApp", log_file="app.log"):
 
     return logger
 
+# External tools: $WILOW_* first, then tools: in settings.yaml, then the
+# usual Windows install location. None elsewhere: the tool is on PATH
+WINDOWS_TOOL_PATHS = {
+    "poppler_path": r"C:\poppler-25.12.0\Library\bin",
+    "tesseract_cmd": r"C:\Program Files\Tesseract-OCR\tesseract.exe",
+    "tessdata_path": r"C:\Program Files\Tesseract-OCR\tessdata",
+}
+TOOL_PATH_ENV = {
+    "poppler_path": "WILOW_POPPLER_PATH",
+    "tesseract_cmd": "WILOW_TESSERACT_CMD",
+    "tessdata_path": "WILOW_TESSDATA_PATH",
+}
+
+def tool_path(name):
+    value = os.environ.get(TOOL_PATH_ENV[name]) or (load_settings().get("tools") or {}).get(name)
+    if value:
+        return value
+    return WINDOWS_TOOL_PATHS[name] if sys.platform == "win32" else None
+
 def get_safe_path(filename):
     # Prevents directory traversal attacks
-    return os.path.basename(filename)
\ No newline at end of file
+    return os.path.basename(filename)
+
+def load_settings():
+    # config/ ships next to src/ (and is bundled as a data dir by build.py)
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    path = os.path.join(os.path.dirname(base_dir), "config", "settings.yaml")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return yaml.safe_load(f) or {}
+
+def load_ocr_profile(doc_class):
+    # Written by the autotuner (python -m src.tuning); None if never tuned
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    path = os.path.join(os.path.dirname(base_dir), "config", "ocr_profiles.yaml")
+    if not doc_class or not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return (yaml.safe_load(f) or {}).get(doc_class)
@@ -0,0 +1,291 @@
+import os
+import time
+import struct
+import select
+import logging
+import ctypes
+import ctypes.util
+from collections import OrderedDict
+
+from .batch import BatchEngine
+from .security import SecurityManager
+from .storage import SAVED, STORED
+from .utils import load_settings
+
+logger = logging.getLogger("WilowApp")
+
+# ---------------- CONFIG ----------------
+# A file is ready once its size and mtime have not changed for SETTLE_SECONDS
+# and it ends in a PDF trailer; files that never get one are tried anyway
+# after INCOMPLETE_SECONDS (the pipeline then reports the broken PDF)
+SETTLE_SECONDS = 1.0
+INCOMPLETE_SECONDS = 60.0
+PDF_TRAILER = b"%%EOF"
+TRAILER_PROBE = 1024
+
+# Ready files are collected for up to BATCH_WINDOW seconds after the first
+# one (or until MAX_BATCH), then processed together
+BATCH_WINDOW = 2.0
+MAX_BATCH = 64
+
+# A file that fails is tried again (after settling anew) up to MAX_ATTEMPTS
+# times in total; a worker crash or a copy picked up unfinished often passes
+# the next time
+MAX_ATTEMPTS = 3
+
+# Hashes remembered as handled; older ones fall back to a storage lookup
+SEEN_LIMIT = 100000
+
+TICK = 0.5
+POLL_INTERVAL = 1.0
+
+# inotify(7)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct("iIII")
+
+# ---------------- WATCHERS ----------------
+
+class InotifyWatcher:
+    """
+    Linux inotify on one directory, through libc. changes() returns the
+    paths created, closed after writing or moved in since the last call;
+    None after a queue overflow (the caller rescans).
+    """
+    name = "inotify"
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.directory = directory
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {directory}")
+
+    def changes(self, timeout):
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        paths, offset = [], 0
+        while offset < len(buf):
+            _, mask, _, length = _EVENT.unpack_from(buf, offset)
+            offset += _EVENT.size
+            name = buf[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if name:
+                paths.append(os.path.join(self.directory, os.fsdecode(name)))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Fallback for non-Linux systems and network shares inotify can't see."""
+    name = "polling"
+
+    def __init__(self, directory, interval=POLL_INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self._last = {}
+        self._next = 0.0
+
+    def changes(self, timeout):
+        wait = self._next - time.monotonic()
+        if wait > 0:
+            time.sleep(min(wait, timeout))
+            if self._next > time.monotonic():
+                return []
+        self._next = time.monotonic() + self.interval
+
+        current = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    st = entry.stat()
+                    current[entry.path] = (st.st_size, st.st_mtime_ns)
+        changed = [p for p, sig in current.items() if self._last.get(p) != sig]
+        self._last = current
+        return changed
+
+    def close(self):
+        pass
+
+
+def open_watcher(directory, mode="auto"):
+    """mode: "inotify", "polling", or "auto" (inotify where it works)."""
+    if mode == "polling":
+        return PollingWatcher(directory)
+    try:
+        return InotifyWatcher(directory)
+    except (OSError, AttributeError) as e:
+        # AttributeError: libc without inotify_* (macOS, Windows)
+        if mode == "inotify":
+            raise
+        logger.info(f"inotify unavailable ({e}); polling {directory}")
+        return PollingWatcher(directory)
+
+# ---------------- HOT FOLDER ----------------
+
+class HotFolder:
+    """
+    Ingests PDFs dropped into a directory: waits until each file is fully
+    written, batches arrivals over BATCH_WINDOW, runs them through a
+    long-lived BatchEngine and stores them with StorageEngine. Files whose
+    hash is already stored are skipped, so restarts and re-dropped copies
+    cost one hash each; files that fail are retried up to MAX_ATTEMPTS.
+    """
+
+    def __init__(self, directory, storage, workers=None, mode="auto",
+                 settle=SETTLE_SECONDS, window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.directory = os.path.abspath(directory)
+        self.storage = storage
+        self.workers = workers
+        self.mode = mode
+        self.settle = settle
+        self.window = window
+        self.max_batch = max_batch
+        extensions = load_settings().get("app", {}).get("allowed_extensions", [".pdf"])
+        self.extensions = tuple(e.lower() for e in extensions)
+
+        self.pending = {}   # path -> (size, mtime_ns, unchanged since)
+        self.ready = []
+        self.ready_since = None
+        self.seen = OrderedDict()   # hashes stored (or given up on), oldest first
+        self.failures = OrderedDict()   # hash -> failed attempts so far
+        self.stats = {"processed": 0, "failed": 0, "skipped": 0, SAVED: 0}
+        self._stop = False
+
+    def stop(self):
+        self._stop = True
+
+    def run(self):
+        watcher = open_watcher(self.directory, self.mode)
+        logger.info(f"Watching {self.directory} ({watcher.name})")
+        try:
+            with BatchEngine(self.workers) as engine:
+                # Files that arrived while nobody was watching
+                self._track(self._listing())
+                while not self._stop:
+                    changed = watcher.changes(TICK)
+                    self._track(self._listing() if changed is None else changed)
+                    self._promote()
+                    if self.ready and (
+                        len(self.ready) >= self.max_batch
+                        or time.monotonic() - self.ready_since >= self.window
+                    ):
+                        batch, self.ready = self.ready[:self.max_batch], self.ready[self.max_batch:]
+                        self.ready_since = time.monotonic() if self.ready else None
+                        self.ingest(engine, batch)
+        finally:
+            watcher.close()
+
+    def _listing(self):
+        with os.scandir(self.directory) as entries:
+            return [e.path for e in entries if e.is_file()]
+
+    def _track(self, paths):
+        for path in paths:
+            if path.lower().endswith(self.extensions) and path not in self.ready:
+                # Any event restarts the settle clock
+                self.pending[path] = (None, None, time.monotonic())
+
+    def _promote(self):
+        now = time.monotonic()
+        for path, (size, mtime, since) in list(self.pending.items()):
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                del self.pending[path]
+                continue
+            if (st.st_size, st.st_mtime_ns) != (size, mtime):
+                self.pending[path] = (st.st_size, st.st_mtime_ns, now)
+                continue
+            quiet = now - since
+            if quiet >= self.settle and (_has_trailer(path) or quiet >= INCOMPLETE_SECONDS):
+                del self.pending[path]
+                self.ready.append(path)
+                self.ready_since = self.ready_since or now
+
+    def ingest(self, engine, paths):
+        """Hashes, deduplicates, processes and stores one batch of files."""
+        start = time.monotonic()
+        hashes = {}
+        for path in paths:
+            try:
+                hashes[path] = SecurityManager.get_file_hash(path)
+            except OSError as e:
+                logger.error(f"Cannot read {path}: {e}")
+        known = self.storage.known_hashes(set(hashes.values()) - self.seen.keys()) | self.seen.keys()
+        self._remember(self.seen, known)
+        todo, batch_hashes = [], set()
+        for path, file_hash in hashes.items():
+            if file_hash in known or file_hash in batch_hashes:
+                self.stats["skipped"] += 1
+            else:
+                batch_hashes.add(file_hash)
+                todo.append(path)
+        if not todo:
+            return
+
+        rows = []
+        for result in engine.run(todo):
+            if result.status == "Processed":
+                self.stats["processed"] += 1
+                data = result.data
+                rows.append((data["Filename"], data["File Hash"], data))
+            else:
+                self.stats["failed"] += 1
+                self._failed(result.path, hashes[result.path])
+        statuses = self.storage.save_invoices(rows) if rows else []
+        # Stored or a duplicate of something stored: either way, done
+        self._remember(self.seen, [file_hash for _, file_hash, _ in rows])
+        for _, file_hash, _ in rows:
+            self.failures.pop(file_hash, None)
+        saved = sum(status in STORED for status in statuses)
+        self.stats[SAVED] += saved
+        logger.info(
+            f"Ingested {len(todo)} files in {time.monotonic() - start:.1f}s: "
+            f"{saved} saved, {len(rows) - saved} duplicates, "
+            f"{len(todo) - len(rows)} failed"
+        )
+
+
+    def _failed(self, path, file_hash):
+        attempts = self.failures.pop(file_hash, 0) + 1
+        if attempts >= MAX_ATTEMPTS:
+            logger.error(f"Giving up on {path} after {attempts} attempts")
+            self._remember(self.seen, [file_hash])
+        else:
+            self._remember(self.failures, [file_hash], attempts)
+            self._track([path])
+
+    def _remember(self, cache, hashes, value=None):
+        for file_hash in hashes:
+            cache[file_hash] = value
+            cache.move_to_end(file_hash)
+        while len(cache) > SEEN_LIMIT:
+            cache.popitem(last=False)
+
+
+def _has_trailer(path):
+    # Writers append %%EOF last; its absence means the copy is still going
+    try:
+        with open(path, "rb") as f:
+            f.seek(max(0, os.path.getsize(path) - TRAILER_PROBE))
+            return PDF_TRAILER in f.read()
+    except OSError:
+        return False
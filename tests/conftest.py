@@ -0,0 +1,42 @@
+import os
+import uuid
+
+import pytest
+
+from src.storage import StorageEngine
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+@pytest.fixture
+def db_name():
+    """Name of a throwaway database under data/, removed afterwards."""
+    name = f"test_{uuid.uuid4().hex[:8]}.db"
+    yield name
+    for suffix in ("", "-wal", "-shm"):
+        path = os.path.join(DATA_DIR, name + suffix)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+@pytest.fixture
+def storage(db_name):
+    engine = StorageEngine(db_name)
+    yield engine
+    engine.close()
+
+
+def _invoice(n, **fields):
+    data = {
+        "Filename": f"inv{n}.pdf", "Invoice No": f"INV-{n:04d}", "Invoice Date": "12-01-2026",
+        "Vendor Name": "Acme Traders", "Vendor GSTIN": "29ABCDE1234F1Z5",
+        "Grand Total": f"{100 * n}.00", "Raw OCR Text": f"Invoice {n} body {uuid.uuid4().hex}",
+    }
+    data.update(fields)
+    return data
+
+
+@pytest.fixture
+def make_invoice():
+    """make_invoice(n, **fields): a pipeline-style invoice dict, distinct per n."""
+    return _invoice
@@ -0,0 +1,28 @@
+import sqlite3
+
+import pytest
+
+from src import cli
+from src.storage import StorageEngine
+
+
+@pytest.fixture
+def pdf_dir(tmp_path):
+    (tmp_path / "a.pdf").write_bytes(b"%PDF-1.4\n")
+    return str(tmp_path)
+
+
+def test_no_input(tmp_path):
+    assert cli.main(["extract", str(tmp_path)]) == cli.EXIT_NO_INPUT
+
+
+@pytest.mark.parametrize("error, code", [
+    (sqlite3.OperationalError("unable to open database file"), cli.EXIT_OUTPUT_ERROR),
+    (RuntimeError("migration failed"), cli.EXIT_INTERNAL_ERROR),
+])
+def test_storage_setup_errors(pdf_dir, db_name, monkeypatch, error, code):
+    def migrate(self, cur):
+        raise error
+
+    monkeypatch.setattr(StorageEngine, "_migrate", migrate)
+    assert cli.main(["extract", pdf_dir, "--db", db_name, "--quiet"]) == code
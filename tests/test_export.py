@@ -0,0 +1,190 @@
+import os
+import csv
+import gzip
+from datetime import date
+
+import pytest
+
+from src.export import (
+    RAW_TEXT_PREVIEW, export_incremental, export_to_excel, export_to_parquet, items_path_for
+)
+
+# ---------------- CSV ----------------
+
+def test_csv_streams_in_chunks(storage, make_invoice, tmp_path):
+    storage.save_invoices([(f"inv{n}.pdf", f"hash{n}", make_invoice(n)) for n in range(1, 6)])
+    calls = []
+    output = str(tmp_path / "out.csv.gz")
+    written = storage.export_to_csv(
+        output, columns=["Invoice No", "Grand Total"], chunk_size=2,
+        progress=lambda done, total: calls.append((done, total))
+    )
+    assert written == 5
+    assert calls == [(2, 5), (4, 5), (5, 5)]
+    with gzip.open(output, "rt", newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["Invoice No", "Grand Total"]
+    assert rows[1:] == [[f"INV-{n:04d}", f"{100 * n}.00"] for n in range(1, 6)]
+
+
+def test_csv_rejects_unknown_columns_and_writes_nothing_for_no_rows(storage, tmp_path):
+    with pytest.raises(ValueError):
+        storage.export_to_csv(str(tmp_path / "out.csv"), columns=["Nope"])
+    assert storage.export_to_csv(str(tmp_path / "out.csv")) == 0
+    assert not (tmp_path / "out.csv").exists()
+
+# ---------------- EXCEL ----------------
+
+def test_excel_writes_text_cells(tmp_path):
+    openpyxl = pytest.importorskip("openpyxl")
+    output = str(tmp_path / "out.xlsx")
+    rows = [
+        {"Filename": "a.pdf", "Grand Total": "=1+1", "Raw OCR Text": "x" * (RAW_TEXT_PREVIEW + 50)},
+        {"Filename": "b.pdf", "Extra": "kept"},
+    ]
+    assert export_to_excel(rows, output, raw_text="truncate") == 2
+
+    ws = openpyxl.load_workbook(output)["Invoices"]
+    values = [list(row) for row in ws.iter_rows(values_only=True)]
+    header = values[0]
+    first = dict(zip(header, values[1]))
+    assert header[-1] == "Extra"
+    assert dict(zip(header, values[2]))["Extra"] == "kept"
+    # Cell text is never turned into a formula
+    assert first["Grand Total"] == "=1+1"
+    assert len(first["Raw OCR Text"]) == RAW_TEXT_PREVIEW
+
+
+def test_excel_rejects_no_rows(tmp_path):
+    with pytest.raises(ValueError):
+        export_to_excel([], str(tmp_path / "out.xlsx"))
+    with pytest.raises(ValueError):
+        export_to_excel(iter([]), str(tmp_path / "out.xlsx"))
+
+
+def test_excel_failure_keeps_original_error(tmp_path):
+    def rows():
+        yield {"Filename": "a.pdf"}
+        raise RuntimeError("source failed")
+
+    # The workbook is never created in a missing directory
+    with pytest.raises(RuntimeError, match="source failed"):
+        export_to_excel(rows(), str(tmp_path / "missing" / "out.xlsx"))
+
+    output = tmp_path / "out.xlsx"
+    with pytest.raises(RuntimeError, match="source failed"):
+        export_to_excel(rows(), str(output))
+    assert not output.exists()
+
+# ---------------- PARQUET ----------------
+
+def test_parquet_typed_headers_and_items(storage, make_invoice, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    items = {"Item Descriptions": "Bolts|Nuts", "HSN/SAC Codes": "7318|",
+             "Quantities": "10|20", "Rates": "2.50|1.00", "Item Amounts": "25.00|20.00"}
+    storage.save_invoices([
+        ("inv1.pdf", "hash1", make_invoice(1, **items)),
+        ("inv2.pdf", "hash2", make_invoice(2, **{"Grand Total": "Rs. 1,180.50"})),
+        ("inv3.pdf", "hash3", make_invoice(3)),
+    ])
+    output = str(tmp_path / "out.parquet")
+    assert export_to_parquet(storage, output, chunk_size=2) == 3
+
+    headers = pq.read_table(output)
+    assert pq.ParquetFile(output).num_row_groups == 2
+    assert headers.column("grand_total_num").to_pylist() == [100.0, 1180.5, 300.0]
+    assert headers.column("invoice_date_iso").to_pylist() == [date(2026, 1, 12)] * 3
+
+    rows = pq.read_table(items_path_for(output)).to_pylist()
+    first_id = headers.column("id").to_pylist()[0]
+    assert [(r["invoice_id"], r["line_no"], r["description"], r["hsn_sac"], r["amount"]) for r in rows] == [
+        (first_id, 1, "Bolts", "7318", 25.0),
+        (first_id, 2, "Nuts", None, 20.0),
+    ]
+
+
+def test_parquet_creates_nothing_for_no_rows(storage, tmp_path):
+    pytest.importorskip("pyarrow")
+    output = str(tmp_path / "out.parquet")
+    assert export_to_parquet(storage, output) == 0
+    assert os.listdir(tmp_path) == []
+
+# ---------------- INCREMENTAL ----------------
+
+@pytest.mark.parametrize("name", ["out.csv", "out.xlsx", "out.parquet"])
+def test_incremental_replace_removes_stale_output(storage, make_invoice, tmp_path, name):
+    output = str(tmp_path / name)
+    storage.save_invoice("inv1.pdf", "hash1", make_invoice(1))
+    assert export_incremental(storage, "nightly", output, append=False) == 1
+    assert os.path.exists(output)
+
+    # Nothing new: the last increment must not stay behind looking current
+    assert export_incremental(storage, "nightly", output, append=False) == 0
+    assert not os.path.exists(output)
+    assert not os.path.exists(items_path_for(output))
+
+    storage.save_invoice("inv2.pdf", "hash2", make_invoice(2))
+    assert export_incremental(storage, "nightly", output, append=False) == 1
+    assert os.path.exists(output)
+
+
+def test_incremental_csv_appends_each_invoice_once(storage, make_invoice, tmp_path):
+    output = str(tmp_path / "out.csv")
+    storage.save_invoice("inv1.pdf", "hash1", make_invoice(1))
+    storage.save_invoice("inv2.pdf", "hash2", make_invoice(2))
+    assert export_incremental(storage, "erp", output) == 2
+    assert storage.get_watermark("erp") == storage.max_id()
+    assert export_incremental(storage, "erp", output) == 0
+
+    storage.save_invoice("inv3.pdf", "hash3", make_invoice(3))
+    assert export_incremental(storage, "erp", output) == 1
+    # Targets are independent
+    assert export_incremental(storage, "audit", str(tmp_path / "audit.csv")) == 3
+
+    with open(output, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert [row["Invoice No"] for row in rows] == ["INV-0001", "INV-0002", "INV-0003"]
+
+    storage.reset_watermark("erp")
+    assert export_incremental(storage, "erp", str(tmp_path / "full.csv")) == 3
+
+
+def test_incremental_failure_keeps_watermark(storage, make_invoice, tmp_path, monkeypatch):
+    output = str(tmp_path / "out.csv")
+    storage.save_invoice("inv1.pdf", "hash1", make_invoice(1))
+    assert export_incremental(storage, "erp", output) == 1
+    size = os.path.getsize(output)
+    storage.save_invoice("inv2.pdf", "hash2", make_invoice(2))
+
+    write = type(storage).export_to_csv
+
+    def broken(self, *args, **kwargs):
+        write(self, *args, **kwargs)
+        raise OSError("disk full")
+
+    monkeypatch.setattr(type(storage), "export_to_csv", broken)
+    with pytest.raises(OSError):
+        export_incremental(storage, "erp", output)
+    monkeypatch.undo()
+
+    # Cut back to the last good run, then the whole increment is retried
+    assert os.path.getsize(output) == size
+    assert export_incremental(storage, "erp", output) == 1
+    with open(output, newline="", encoding="utf-8") as f:
+        assert [row["Invoice No"] for row in csv.DictReader(f)] == ["INV-0001", "INV-0002"]
+
+
+def test_incremental_parquet_dataset_parts(storage, make_invoice, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    output = str(tmp_path / "out.parquet")
+    storage.save_invoice("inv1.pdf", "hash1", make_invoice(1))
+    assert export_incremental(storage, "lake", output) == 1
+    storage.save_invoice("inv2.pdf", "hash2", make_invoice(2))
+    storage.save_invoice("inv3.pdf", "hash3", make_invoice(3))
+    assert export_incremental(storage, "lake", output) == 2
+
+    assert len(os.listdir(output)) == 2
+    assert len(os.listdir(items_path_for(output))) == 2
+    assert sorted(pq.read_table(output).column("invoice_number").to_pylist()) == [
+        "INV-0001", "INV-0002", "INV-0003"
+    ]
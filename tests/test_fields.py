@@ -0,0 +1,223 @@
+import re
+import random
+
+import pytest
+
+from src.fields import (
+    ACCOUNT_REGEX, AMOUNT_REGEX, DATE_REGEX, GST_REGEX, IFSC_REGEX, PAN_REGEX,
+    FieldExtractor, LineIndex, split_items
+)
+
+# ---------------- REFERENCE ----------------
+# The per-field helpers FieldExtractor replaced: one scan of the text or
+# the lines per field
+
+
+def _label_value(text, label):
+    m = re.search(rf"{label}\s*[:\-]?\s*(.+)", text, re.I)
+    return m.group(1).split("\n")[0].strip() if m else ""
+
+
+def _first_match(regex, text):
+    m = re.search(regex, text)
+    return m.group() if m else ""
+
+
+def _find_amount(lines, keyword):
+    for l in lines:
+        if keyword.lower() in l.lower():
+            m = re.findall(AMOUNT_REGEX, l)
+            if m:
+                return m[-1].replace(",", "")
+    return ""
+
+
+def _find_percent(lines, keyword):
+    for l in lines:
+        if keyword.lower() in l.lower() and "%" in l:
+            m = re.search(r"(\d+)%", l)
+            if m:
+                return m.group(1)
+    return ""
+
+
+def _after_buyer(lines, start, end):
+    for i, l in enumerate(lines):
+        if any(x in l.lower() for x in ["invoice to", "bill to"]):
+            return lines[i + start] if end is None else " ".join(lines[i + start:i + end])
+    return ""
+
+
+def reference_fields(raw_text):
+    lines = [l.strip() for l in raw_text.split("\n") if l.strip()]
+    cgst_rate = _find_percent(lines, "CGST")
+    sgst_rate = _find_percent(lines, "SGST") or cgst_rate
+    return {
+        "Invoice Type": next((k for l in lines for k in ["TAX INVOICE"] if k in l.upper()), ""),
+        "Invoice No": _label_value(raw_text, "Invoice No"),
+        "Invoice Date": _first_match(DATE_REGEX, raw_text),
+        "Due Date": _label_value(raw_text, "Due Date"),
+        "Place of Supply": _label_value(raw_text, "Place of Supply"),
+        "Currency": "INR",
+        "Vendor Name": next((l for l in lines if any(x in l.upper() for x in ["PVT", "LTD", "PRIVATE"])), ""),
+        "Vendor Address": " ".join(lines[1:6]),
+        "Vendor GSTIN": _first_match(GST_REGEX, raw_text),
+        "Vendor PAN": _first_match(PAN_REGEX, raw_text),
+        "Vendor Email": _label_value(raw_text, "Email"),
+        "Buyer Name": _after_buyer(lines, 1, None),
+        "Buyer Address": _after_buyer(lines, 2, 6),
+        "Buyer GSTIN": next((l for l in lines if re.search(GST_REGEX, l)), ""),
+        "Item Descriptions": "|".join(l for l in lines if re.search(r"\d+\s+.*\d{2}\.\d{2}$", l)),
+        "CGST Rate (%)": cgst_rate,
+        "CGST Amount": _find_amount(lines, "CGST"),
+        "SGST Rate (%)": sgst_rate,
+        "SGST Amount": _find_amount(lines, "SGST"),
+        "Total Tax": _find_amount(lines, "Tax"),
+        "Subtotal": _find_amount(lines, "Sub Total"),
+        "Grand Total": _find_amount(lines, "Grand Total"),
+        "Amount in Words": _label_value(raw_text, "Amount in Words"),
+        "Bank Name": _label_value(raw_text, "Bank"),
+        "Account Name": _label_value(raw_text, "Account Name"),
+        "Account Number": _first_match(ACCOUNT_REGEX, raw_text),
+        "IFSC Code": _first_match(IFSC_REGEX, raw_text),
+        "Branch": _label_value(raw_text, "Branch"),
+    }
+
+
+def extract(raw_text):
+    lines = [l.strip() for l in raw_text.split("\n") if l.strip()]
+    return FieldExtractor().extract(raw_text, LineIndex(lines))
+
+# ---------------- EQUIVALENCE ----------------
+
+SAMPLE = """TAX INVOICE
+Acme Traders Pvt Ltd
+12 MG Road, Bengaluru
+GSTIN: 29ABCDE1234F1Z5  PAN: ABCDE1234F
+Email: billing@acme.example
+Invoice No: INV-2026-0042
+Invoice Date: 12-01-2026
+Due Date - 11-02-2026
+Place of Supply: Karnataka
+Bill To
+Globex Retail
+4 Park Street
+Kolkata
+GSTIN 19PQRSX6789K1Z2
+1 Steel bolts HSN 7318 2,500.00
+2 Freight SAC: 996511 400.00
+Sub Total 2,900.00
+CGST @ 9% 261.00
+SGST 261.00
+Total Tax 522.00
+Grand Total INR 3,422.00
+Amount in Words:
+Three thousand four hundred twenty two only
+Bank: State Bank of India
+Account Name: Acme Traders
+Account No 123456789012  IFSC SBIN0001234
+Branch: Koramangala
+"""
+
+FRAGMENTS = [
+    "TAX INVOICE", "tax invoice", "Acme Pvt Ltd", "private limited", "Invoice No: {w}", "INVOICE NO-{w}",
+    "invoice no", "Due Date: {d}", "Place of Supply - {w}", "Email {w}@x.in", "Amount in Words: {w}",
+    "Bank {w}", "Bank Name: {w}", "Account Name: {w}", "Branch: {w}", "Bill to", "INVOICE TO {w}",
+    "GSTIN {g}", "{g}", "PAN ABCDE1234F", "IFSC HDFC0{n6}", "A/c {n12}", "Date {d}",
+    "CGST 9% {a}", "SGST @ 9 % {a}", "sgst 6% {a}", "Total Tax {a}", "Tax {a} {a}", "Sub Total {a}",
+    "Grand Total {a}", "grand total: {a}", "{n} {w} {a}", "{n} item HSN {n6} {a}", "İstanbul bank {w}",
+    "{w} {w}", "", "   ", "Branch", "Invoice No:",
+]
+
+
+def random_text(rng):
+    def fill(fragment):
+        return fragment.format(
+            w=rng.choice(["alpha", "Beta", "GAMMA", "delta 7", "x-y"]),
+            d=f"{rng.randint(1, 28):02d}{rng.choice('/-')}{rng.randint(1, 12):02d}-2026",
+            g=rng.choice(["29ABCDE1234F1Z5", "07AAACB2230M1ZX", "29abcde1234f1z5"]),
+            a=f"{rng.randint(0, 99999):,}.{rng.randint(0, 99):02d}",
+            n=rng.randint(1, 20), n6=rng.randint(100000, 999999), n12=rng.randint(10 ** 11, 10 ** 12 - 1),
+        )
+    return "\n".join(fill(rng.choice(FRAGMENTS)) for _ in range(rng.randint(0, 30)))
+
+
+def assert_equivalent(raw_text):
+    try:
+        expected = reference_fields(raw_text)
+    except IndexError:
+        # "Bill to" on the last line: both fail alike
+        with pytest.raises(IndexError):
+            extract(raw_text)
+        return
+    got = extract(raw_text)
+    for field, value in expected.items():
+        assert got[field] == value, (field, raw_text)
+
+
+def test_sample_matches_reference():
+    assert_equivalent(SAMPLE)
+    got = extract(SAMPLE)
+    assert got["Invoice No"] == "INV-2026-0042"
+    assert got["Grand Total"] == "3422.00"
+    assert got["SGST Rate (%)"] == "9"
+    assert got["Buyer Name"] == "Globex Retail"
+
+
+def test_random_texts_match_reference():
+    rng = random.Random(5)
+    for _ in range(2000):
+        assert_equivalent(random_text(rng))
+
+
+def test_empty_text():
+    assert_equivalent("")
+    assert extract("")["Line Items"] == []
+
+# ---------------- LINE INDEX ----------------
+
+@pytest.mark.parametrize("keyword", [
+    "tax", "TAX", "Total Tax", "al ta", "grand total", "İ", "ı", "x", "  ", "sub  total", "missing",
+])
+def test_line_index_find_matches_substring_scan(keyword):
+    lines = ["Total Tax 10.00", "SubTotal", "sub  total", "Grand  Total", "İstanbul", "ıx", "TAXABLE", ""]
+    index = LineIndex(lines)
+    expected = [i for i, l in enumerate(lines) if keyword.lower() in l.lower()]
+    assert index.find(keyword) == expected
+    # Cached lookups give the same answer
+    assert index.find(keyword) == expected
+    assert index.first(keyword) == (expected[0] if expected else None)
+
+
+def test_line_index_first_upper():
+    index = LineIndex(["acme", "Acme pvt ltd", "Tax Invoice"])
+    assert index.first_upper(["PVT", "LTD"]) == 1
+    assert index.first_upper(["TAX INVOICE"]) == 2
+    assert index.first_upper(["NOPE"]) is None
+
+# ---------------- ITEMS ----------------
+
+@pytest.mark.parametrize("line, expected", [
+    ("1 Steel bolts HSN 7318 2,500.00", "7318"),
+    ("2 Freight SAC: 996511 400.00", "996511"),
+    ("3 Nuts HSN/SAC - 73181500 10.00", "73181500"),
+    ("4 Washers hsn:7318 15.00", "7318"),
+    ("5 Labour SAC 99 10.00", ""),
+    ("6 Paint THSN 3208 10.00", ""),
+    ("7 Bolts HSN 123456789 10.00", ""),
+])
+def test_item_hsn(line, expected):
+    [item] = extract(line)["Line Items"]
+    assert item["hsn_sac"] == expected
+
+
+def test_items_round_trip_through_joined_fields():
+    got = extract(SAMPLE)
+    items = got["Line Items"]
+    assert [(i["line_no"], i["hsn_sac"], i["amount"]) for i in items] == [
+        (1, "7318", "2500.00"), (2, "996511", "400.00"),
+    ]
+    flat = {k: v for k, v in got.items() if k != "Line Items"}
+    assert [(i["line_no"], i["hsn_sac"], i["amount"]) for i in split_items(flat)] == [
+        (1, "7318", "2500.00"), (2, "996511", "400.00"),
+    ]
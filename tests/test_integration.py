@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import asyncio
+import threading
+import http.client
+import multiprocessing
+from concurrent.futures import Future
+
+import pytest
+
+from src.batch import BatchEngine
+from src.service import ExtractionService
+from src.sharedqueue import SharedQueue
+from src.storage import StorageEngine
+
+INVOICE_TEXT = [
+    "TAX INVOICE",
+    "Invoice No: INV-2026-0042",
+    "Invoice Date: 12-01-2026",
+    "Vendor GSTIN: 29ABCDE1234F1Z5",
+    "Grand Total: INR 1,180.00",
+]
+
+
+def make_pdf(lines):
+    """A one-page PDF with a real text layer (no OCR needed)."""
+    stream = "BT /F1 12 Tf 72 720 Td 16 TL " + " ".join(
+        f"({line}) Tj T*" for line in lines
+    ) + " ET"
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+        "/Resources << /Font << /F1 4 0 R >> >> /Contents 5 0 R >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream",
+    ]
+    out, offsets = "%PDF-1.4\n", []
+    for n, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{n} 0 obj\n{body}\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    return out.encode("latin-1")
+
+# ---------------- SERVICE ----------------
+
+@pytest.fixture
+def service():
+    """ExtractionService on an ephemeral localhost port, in a background loop."""
+    svc = ExtractionService(workers=1, max_queue=2)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    server = asyncio.run_coroutine_threadsafe(svc.start("127.0.0.1", 0), loop).result(10)
+    yield svc
+    server.close()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(10)
+    svc.close()
+
+
+def request(svc, method, path, body=None, headers=None):
+    conn = http.client.HTTPConnection("127.0.0.1", svc.port, timeout=120)
+    try:
+        conn.request(method, path, body=body, headers=headers or {})
+        resp = conn.getresponse()
+        return resp.status, dict(resp.getheaders()), json.loads(resp.read())
+    finally:
+        conn.close()
+
+
+def test_sync_extract(service):
+    status, _, payload = request(
+        service, "POST", "/extract?filename=a.pdf&raw=0", make_pdf(INVOICE_TEXT)
+    )
+    assert status == 200
+    assert payload["status"] == "done"
+    assert payload["filename"] == "a.pdf"
+    assert "INV-2026-0042" in json.dumps(payload["result"])
+    assert "Raw OCR Text" not in payload["result"]
+
+
+def test_async_extract_and_poll(service):
+    status, _, payload = request(service, "POST", "/extract?mode=async", make_pdf(INVOICE_TEXT))
+    assert status == 202
+    job_id = payload["job"]
+
+    deadline = time.monotonic() + 120
+    while True:
+        status, _, job = request(service, "GET", f"/jobs/{job_id}")
+        assert status == 200
+        if job["status"] not in ("queued", "running") or time.monotonic() > deadline:
+            break
+        time.sleep(0.2)
+    assert job["status"] == "done"
+    assert job["result"]["File Hash"]
+
+    _, _, metrics = request(service, "GET", "/metrics")
+    assert metrics["completed"] == 1
+    assert metrics["queue_depth"] == 0
+
+
+def test_busy_server_rejects_before_reading_body(service):
+    # Fill every slot; a 429 must come back without the body being sent
+    service.in_flight = service.max_queue
+    try:
+        with socket.create_connection(("127.0.0.1", service.port), timeout=10) as sock:
+            sock.sendall(
+                b"POST /extract HTTP/1.1\r\nHost: localhost\r\n"
+                b"Content-Length: 1000000\r\nExpect: 100-continue\r\n\r\n"
+            )
+            response = sock.makefile("rb").read()
+    finally:
+        service.in_flight = 0
+
+    head, _, body = response.partition(b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.1 429")
+    assert b"Retry-After: 2" in head
+    assert json.loads(body)["capacity"] == service.max_queue
+
+
+def test_negative_content_length(service):
+    status, _, payload = request(
+        service, "POST", "/extract", b"", headers={"Content-Length": "-1"}
+    )
+    assert status == 400
+
+# ---------------- SHARED QUEUE ----------------
+
+class StuckEngine:
+    """Claims like a real worker, then never finishes (killed mid-lease)."""
+    workers = 1
+
+    def submit(self, path, index=0):
+        return Future()
+
+
+def _shared_worker(root, owner, db_name, lease, stuck=False):
+    queue = SharedQueue(root, owner=owner, lease=lease)
+    if stuck:
+        queue.work(StuckEngine())
+        return
+    storage = StorageEngine(db_name)
+    try:
+        with BatchEngine(1) as engine:
+            queue.work(engine, idle_exit=5, storage=storage)
+    finally:
+        storage.close()
+
+
+@pytest.fixture
+def shared_db():
+    name = f"test_shared_{uuid.uuid4().hex[:8]}.db"
+    storage = StorageEngine(name)
+    path = storage.db_path
+    storage.close()
+    yield name, path
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+def test_shared_queue_commits_every_job_once(tmp_path, shared_db):
+    db_name, db_path = shared_db
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    jobs = 6
+    for i in range(jobs):
+        lines = INVOICE_TEXT + [f"Reference: batch {i} of {jobs}"]
+        lines[1] = f"Invoice No: INV-2026-{i:04d}"
+        (inbox / f"inv{i}.pdf").write_bytes(make_pdf(lines))
+    root = str(tmp_path / "queue")
+    queue = SharedQueue(root, owner="producer")
+    assert queue.enqueue(sorted(str(p) for p in inbox.iterdir())) == jobs
+
+    lease = 2.0
+    ctx = multiprocessing.get_context("spawn")
+    # One worker claims a job and is killed while holding its lease
+    victim = ctx.Process(target=_shared_worker, args=(root, "victim", db_name, lease, True))
+    victim.start()
+    deadline = time.monotonic() + 60
+    while not any(".victim." in n for n in os.listdir(os.path.join(root, "leased"))):
+        assert time.monotonic() < deadline, "victim never claimed a job"
+        time.sleep(0.05)
+    victim.kill()
+    victim.join()
+
+    workers = [
+        ctx.Process(target=_shared_worker, args=(root, f"worker{n}", db_name, lease))
+        for n in range(2)
+    ]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join(300)
+        assert w.exitcode == 0
+
+    # A late committer finds nothing left to do
+    storage = StorageEngine(db_name)
+    try:
+        assert queue.commit(storage) == {}
+    finally:
+        storage.close()
+
+    conn = sqlite3.connect(db_path)
+    try:
+        committed = conn.execute("SELECT COUNT(*), COUNT(DISTINCT job) FROM shared_commits").fetchone()
+        invoices = conn.execute("SELECT COUNT(*) FROM invoices").fetchone()[0]
+    finally:
+        conn.close()
+    assert committed == (jobs, jobs)
+    assert invoices == jobs
+    assert queue.status() == {"pending": 0, "leased": 0, "results": 0, "done": jobs, "failed": 0}
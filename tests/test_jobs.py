@@ -0,0 +1,128 @@
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from src.batch import BatchResult
+from src.jobs import DONE, FAILED, PENDING, JobQueue
+from src.storage import SAVED
+
+
+@pytest.fixture
+def queue(storage):
+    jobs = JobQueue(storage, max_attempts=3, backoff=0.0)
+    yield jobs
+    jobs.close()
+
+
+class FakeEngine:
+    """BatchEngine stand-in: outcome(path, attempt) -> data dict, or raises to fail the file."""
+    workers = 1
+
+    def __init__(self, outcome):
+        self.outcome = outcome
+        self.attempts = {}
+
+    def submit(self, path, index=0):
+        attempt = self.attempts[path] = self.attempts.get(path, 0) + 1
+        fut = Future()
+        try:
+            fut.set_result(BatchResult(index, path, self.outcome(path, attempt), "Processed", None))
+        except Exception as e:
+            fut.set_result(BatchResult(index, path, {}, "Error", str(e)))
+        return fut
+
+    def result(self, future, index, path):
+        return future.result()
+
+# ---------------- RETRIES ----------------
+
+def test_failed_attempts_back_off_then_fail(storage):
+    queue = JobQueue(storage, max_attempts=2, backoff=60.0)
+    try:
+        batch = queue.create_batch(["a.pdf"])
+        [job] = queue.claim(batch, 5)
+        assert job.attempts == 1
+        assert queue.fail(job, "OCR crashed") == PENDING
+
+        # Backing off: nothing to claim yet, but the batch is not over
+        assert queue.claim(batch, 5) == []
+        assert 55 < queue.next_wake(batch) <= 60
+        queue._conn.execute("UPDATE jobs SET next_attempt = 0")
+
+        [job] = queue.claim(batch, 5)
+        assert job.attempts == 2
+        assert queue.fail(job, "OCR crashed again") == FAILED
+        assert queue.next_wake(batch) is None
+        assert queue.finished_jobs(batch) == [(0, "a.pdf", FAILED, None, None, "OCR crashed again")]
+        assert queue.unfinished_batches() == []
+    finally:
+        queue.close()
+
+
+def test_drain_retries_until_done(queue, make_invoice):
+    def outcome(path, attempt):
+        if path == "flaky.pdf" and attempt == 1:
+            raise RuntimeError("transient")
+        if path == "broken.pdf":
+            raise RuntimeError("unreadable")
+        return dict(make_invoice(len(path)), **{"Filename": path, "File Hash": f"hash-{path}"})
+
+    batch = queue.create_batch(["ok.pdf", "flaky.pdf", "broken.pdf"])
+    engine = FakeEngine(outcome)
+    finished = {job.path: status for job, _, status in queue.drain(batch, engine)}
+
+    assert finished == {"ok.pdf": SAVED, "flaky.pdf": SAVED, "broken.pdf": None}
+    assert engine.attempts == {"ok.pdf": 1, "flaky.pdf": 2, "broken.pdf": 3}
+    states = {path: (state, outcome) for _, path, state, outcome, _, _ in queue.finished_jobs(batch)}
+    assert states == {"ok.pdf": (DONE, SAVED), "flaky.pdf": (DONE, SAVED), "broken.pdf": (FAILED, None)}
+    assert len(queue.storage.query()) == 2
+
+# ---------------- RESUME ----------------
+
+def test_expired_lease_resumes_on_another_owner(storage, make_invoice):
+    crashed = JobQueue(storage, lease=0.05)
+    resumed = JobQueue(storage)
+    try:
+        batch = crashed.create_batch(["a.pdf", "b.pdf"])
+        [lost] = crashed.claim(batch, 1)
+        time.sleep(0.1)
+
+        assert resumed.unfinished_batches()[0]["remaining"] == 2
+        jobs = resumed.claim(batch, 5)
+        assert [(job.path, job.attempts) for job in jobs] == [("a.pdf", 2), ("b.pdf", 1)]
+
+        data = dict(make_invoice(1), **{"File Hash": "hash-a"})
+        # The first owner finishing late stores nothing
+        assert crashed.complete(lost, data) is None
+        assert crashed.fail(lost, "late") is None
+        assert storage.query() == []
+
+        assert resumed.complete(jobs[0], data) == SAVED
+        assert resumed.complete(jobs[1], dict(make_invoice(2), **{"File Hash": "hash-b"})) == SAVED
+        assert resumed.unfinished_batches() == []
+        assert len(storage.query()) == 2
+    finally:
+        crashed.close()
+        resumed.close()
+
+
+def test_expired_lease_out_of_attempts_fails(storage):
+    queue = JobQueue(storage, max_attempts=1, lease=0.05)
+    try:
+        batch = queue.create_batch(["a.pdf"])
+        assert len(queue.claim(batch, 1)) == 1
+        time.sleep(0.1)
+        assert queue.claim(batch, 1) == []
+        [(_, _, state, _, _, error)] = queue.finished_jobs(batch)
+        assert (state, error) == (FAILED, "worker died while processing")
+    finally:
+        queue.close()
+
+
+def test_fail_missing(queue, tmp_path):
+    present = tmp_path / "a.pdf"
+    present.write_bytes(b"%PDF")
+    batch = queue.create_batch([str(present), str(tmp_path / "gone.pdf")])
+    assert queue.fail_missing(batch) == 1
+    assert [job.path for job in queue.claim(batch, 5)] == [str(present)]
@@ -0,0 +1,186 @@
+import os
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.neardup import MIN_SIMILARITY
+from src.security import SecurityManager
+from src.storage import (
+    DUPLICATE, NEAR_DUPLICATE, RAW_TEXT_KEY, SAVED, SCHEMA_VERSION, ZSTD_MAGIC, StorageEngine,
+    parse_amount, parse_date_iso
+)
+
+from conftest import DATA_DIR
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Rs. 500", 500.0),
+    ("Rs.1,000.00", 1000.0),
+    ("INR 1,234.50", 1234.5),
+    ("₹1,000", 1000.0),
+    ("1,20,000.00", 120000.0),
+    ("-12.5", -12.5),
+    (450.5, 450.5),
+    ("N/A", None),
+    (None, None),
+])
+def test_parse_amount(text, expected):
+    assert parse_amount(text) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("12-01-2026", "2026-01-12"),
+    ("12/01/2026", "2026-01-12"),
+    ("2026-01-12", "2026-01-12"),
+    ("31-02-2026", None),
+    ("N/A", None),
+])
+def test_parse_date_iso(text, expected):
+    assert parse_date_iso(text) == expected
+
+# ---------------- MIGRATION ----------------
+
+# invoices as created before PRAGMA user_version was used (schema 0)
+BASELINE_SCHEMA = """
+    CREATE TABLE invoices (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        file_hash TEXT UNIQUE,
+        filename TEXT,
+        upload_date TEXT,
+        invoice_number TEXT,
+        invoice_date TEXT,
+        vendor_name TEXT,
+        vendor_gstin TEXT,
+        buyer_name TEXT,
+        cgst TEXT,
+        sgst TEXT,
+        grand_total TEXT,
+        currency TEXT,
+        json_data_enc BLOB,
+        status TEXT
+    )
+"""
+
+
+def test_migrates_baseline_database(db_name, make_invoice):
+    data = make_invoice(
+        7, **{"Grand Total": "Rs. 500", "Item Descriptions": "Bolts|Nuts",
+              "Raw OCR Text": "\n".join(f"Acme Traders line {i}: bolts and nuts" for i in range(20)),
+              "HSN/SAC Codes": "7318|7318", "Quantities": "10|20",
+              "Rates": "2.50|1.00", "Item Amounts": "25.00|20.00"}
+    )
+    conn = sqlite3.connect(os.path.join(DATA_DIR, db_name))
+    conn.execute(BASELINE_SCHEMA)
+    conn.execute(
+        "INSERT INTO invoices (file_hash, filename, upload_date, invoice_number, invoice_date,"
+        " vendor_name, vendor_gstin, buyer_name, cgst, sgst, grand_total, currency,"
+        " json_data_enc, status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        ("hash7", "inv7.pdf", "2026-01-12 10:00", "INV-0007", "12-01-2026", "Acme Traders",
+         "29ABCDE1234F1Z5", "Buyer", "45.00", "45.00", "Rs. 500", "INR",
+         SecurityManager().encrypt_data(json.dumps(data)), "PROCESSED")
+    )
+    conn.commit()
+    conn.close()
+
+    storage = StorageEngine(db_name)
+    try:
+        conn = sqlite3.connect(storage.db_path)
+        try:
+            assert conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+            row = conn.execute(
+                "SELECT grand_total_num, cgst_num, invoice_date_iso, dedup_key FROM invoices"
+            ).fetchone()
+            items = conn.execute(
+                "SELECT line_no, description, hsn_sac, quantity, amount FROM invoice_items ORDER BY line_no"
+            ).fetchall()
+            signatures = conn.execute("SELECT COUNT(*) FROM invoice_minhash").fetchone()[0]
+        finally:
+            conn.close()
+        assert row == (500.0, 45.0, "2026-01-12", "29ABCDE1234F1Z5|INV0007|50000")
+        assert items == [(1, "Bolts", "7318", 10.0, 25.0), (2, "Nuts", "7318", 20.0, 20.0)]
+        assert signatures == 1
+
+        # The old row reads back like a new one, inline raw text included
+        [stored] = storage.query()
+        loaded = storage.get_invoice(stored["id"], include_raw=True)
+        assert loaded["Raw OCR Text"] == data["Raw OCR Text"]
+        assert storage.save_invoice("inv7.pdf", "hash7", data) is False
+    finally:
+        storage.close()
+
+
+def test_migration_is_idempotent(db_name):
+    StorageEngine(db_name).close()
+    storage = StorageEngine(db_name)
+    try:
+        assert storage._conn.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    finally:
+        storage.close()
+
+# ---------------- DEDUP ----------------
+
+def test_save_statuses(storage, make_invoice):
+    text = " ".join(f"line {i} of the original scan" for i in range(40))
+    first = make_invoice(1, **{"Raw OCR Text": text})
+    statuses = storage.save_invoices([
+        ("inv1.pdf", "hash1", first),
+        # Same file again, in the same batch
+        ("inv1-copy.pdf", "hash1", first),
+        # Re-scan: new hash, same GSTIN / number / total
+        ("inv1-rescan.pdf", "hash2", dict(first, **{"Raw OCR Text": "blurry"})),
+        ("inv3.pdf", "hash3", make_invoice(3)),
+    ])
+    assert statuses == [SAVED, DUPLICATE, DUPLICATE, SAVED]
+    assert storage.save_invoices([("inv1.pdf", "hash1", first)]) == [DUPLICATE]
+
+    # No key (number not read), but the text matches invoice 1
+    unkeyed = dict(first, **{"Invoice No": "N/A"})
+    assert storage.save_invoices([("inv1-ocr.pdf", "hash4", unkeyed)]) == [NEAR_DUPLICATE]
+    rows = {row["filename"]: row for row in storage.query()}
+    assert rows["inv1-ocr.pdf"]["duplicate_of"] == rows["inv1.pdf"]["id"]
+    assert rows["inv1-ocr.pdf"]["duplicate_similarity"] >= MIN_SIMILARITY
+    assert rows["inv3.pdf"]["duplicate_of"] is None
+
+# ---------------- WRITE PATH ----------------
+
+def test_failed_on_commit_rolls_back_the_batch(storage, make_invoice):
+    def reject(cur, statuses):
+        raise RuntimeError("bookkeeping failed")
+
+    with pytest.raises(RuntimeError):
+        storage.save_invoices(
+            [(f"inv{n}.pdf", f"hash{n}", make_invoice(n)) for n in range(1, 4)], on_commit=reject
+        )
+    assert storage.query() == []
+    assert storage.save_invoices([("inv1.pdf", "hash1", make_invoice(1))]) == [SAVED]
+
+
+def test_concurrent_saves(storage, make_invoice):
+    def save(n):
+        return storage.save_invoice(f"inv{n}.pdf", f"hash{n}", make_invoice(n))
+
+    with ThreadPoolExecutor(8) as pool:
+        assert all(pool.map(save, range(1, 41)))
+    assert len(storage.query(limit=None)) == 40
+
+# ---------------- PAYLOADS ----------------
+
+def test_payload_is_compressed_and_raw_text_kept_apart(storage, make_invoice):
+    data = make_invoice(1, **{"Raw OCR Text": "line of OCR text\n" * 200})
+    storage.save_invoice("inv1.pdf", "hash1", data)
+    [row] = storage.query()
+
+    payload_enc, raw_enc = storage._conn.execute("""
+        SELECT json_data_enc, raw_text_enc FROM invoices
+        JOIN invoice_raw_text ON invoice_raw_text.invoice_id = invoices.id
+    """).fetchone()
+    assert storage.sec.decrypt_bytes(payload_enc).startswith(ZSTD_MAGIC)
+    assert RAW_TEXT_KEY not in storage._unpack(payload_enc)
+    assert len(raw_enc) < len(data[RAW_TEXT_KEY])
+
+    assert RAW_TEXT_KEY not in storage.get_invoice(row["id"])
+    assert storage.get_invoice(row["id"], include_raw=True)[RAW_TEXT_KEY] == data[RAW_TEXT_KEY]
+    assert storage.get_raw_text(row["id"]) == data[RAW_TEXT_KEY]
+    assert storage.get_invoice(row["id"] + 1) is None